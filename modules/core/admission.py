@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Admission Control
+Per-client rate limits and coalescing of identical requests (middleware layers)
+
+Every route belongs to a rate class (route option `limit`, 'api' by
+default; None exempts the route, as for static files). Each client (by
+IP address) has one token bucket per class: a request takes a token, and
+tokens refill at the class rate up to its burst size. A request finding
+its bucket empty gets 429 with Retry-After, before any work is done.
+
+Routes with `coalesce=True` (the filesystem scans) run once per set of
+identical concurrent requests. The first request computes the response
+and the ones arriving while it runs wait for it and get a copy.
+
+Limits are "rate/burst" per class in WOODCHUNK_RATE_LIMITS, e.g.
+"scan=2/20,api=20/100"; WOODCHUNK_RATE_LIMITS=off disables rate limiting.
+"""
+
+import os
+import math
+import time
+import threading
+
+from json_response import send_json
+from middleware import buffered_response, variant_key
+
+# Requests per second and burst size of each rate class
+RATE_LIMITS = {
+    'api': (20.0, 100),
+    'scan': (2.0, 20),
+    'write': (5.0, 20),
+}
+# Buckets kept before full (idle) ones are dropped
+MAX_BUCKETS = 4096
+# Seconds a coalesced request waits for the running one before running itself
+COALESCE_TIMEOUT = 60
+
+
+def parse_limits(spec, defaults=RATE_LIMITS):
+    """Rate classes from a "class=rate/burst,..." string; None if limits are off"""
+    if spec is None or not spec.strip():
+        return dict(defaults)
+    if spec.strip().lower() in ('0', 'off', 'false', 'none'):
+        return None
+    limits = dict(defaults)
+    for part in spec.split(','):
+        name, _, value = part.partition('=')
+        rate, _, burst = value.partition('/')
+        try:
+            limits[name.strip()] = (float(rate), int(burst or max(1, math.ceil(float(rate)))))
+        except ValueError:
+            print(f"[Server] Ignoring invalid rate limit: {part.strip()}")
+    return limits
+
+
+class RateLimit:
+    """Token buckets per (client, rate class)"""
+
+    name = 'rateLimit'
+
+    def __init__(self, limits=None):
+        self.limits = parse_limits(os.environ.get('WOODCHUNK_RATE_LIMITS')) if limits is None else limits
+        self._lock = threading.Lock()
+        # (client, class) -> [tokens, last refill time]
+        self._buckets = {}
+        self.allowed = {}
+        self.rejected = {}
+
+    def acquire(self, client, rate_class):
+        """Take a token; returns 0, or the seconds until one is available"""
+        rate, burst = self.limits[rate_class]
+        now = time.monotonic()
+        key = (client, rate_class)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._drop_idle(now)
+                bucket = self._buckets[key] = [float(burst), now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.allowed[rate_class] = self.allowed.get(rate_class, 0) + 1
+                return 0
+            self.rejected[rate_class] = self.rejected.get(rate_class, 0) + 1
+            return (1 - bucket[0]) / rate if rate > 0 else 60
+
+    def _drop_idle(self, now):
+        """Forget buckets that have refilled completely (their clients went quiet)"""
+        for key, (tokens, last) in list(self._buckets.items()):
+            rate, burst = self.limits[key[1]]
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+    def __call__(self, handler, route, call_next):
+        rate_class = route.options.get('limit', 'api')
+        if self.limits is None or rate_class is None or rate_class not in self.limits:
+            call_next(handler, route)
+            return
+        wait = self.acquire(handler.client_address[0], rate_class)
+        if not wait:
+            call_next(handler, route)
+            return
+        retry_after = max(1, math.ceil(wait))
+        send_json(handler, {
+            'success': False,
+            'error': f'Too many {rate_class} requests, retry in {retry_after}s',
+            'retryAfter': retry_after
+        }, status=429, headers={'Retry-After': str(retry_after)})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.limits is not None,
+                'limits': {name: {'rate': rate, 'burst': burst} for name, (rate, burst) in (self.limits or {}).items()},
+                'buckets': len(self._buckets),
+                'allowed': dict(self.allowed),
+                'rejected': dict(self.rejected)
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.waiting = 0
+
+
+class Coalesce:
+    """Runs identical concurrent GET requests of coalesce=True routes once"""
+
+    name = 'coalesce'
+
+    def __init__(self, timeout=COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def __call__(self, handler, route, call_next):
+        if (not route.options.get('coalesce') or handler.command != 'GET'
+                or getattr(handler, 'response', None) is None):
+            call_next(handler, route)
+            return
+
+        # Conditional requests and content negotiation change the response
+        key = (*variant_key(handler), handler.headers.get('If-None-Match'))
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                flight.waiting += 1
+                self.followers += 1
+
+        if leader:
+            try:
+                call_next(handler, route)
+                response = buffered_response(handler)
+                if response is not None:
+                    flight.result = response.snapshot()
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return
+
+        if flight.done.wait(self.timeout) and flight.result is not None:
+            handler.response.replay(*flight.result)
+        else:
+            # The first request failed, streamed its response or took too long
+            call_next(handler, route)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'inFlight': len(self._flights),
+                'waiting': sum(flight.waiting for flight in self._flights.values())
+            }
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Asset Cache
+Size-bounded in-memory cache for small static files
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Total bytes kept in memory
+ASSET_CACHE_BYTES = 64 * 1024 * 1024
+# Files larger than this are always streamed from disk
+ASSET_CACHE_MAX_FILE = 1024 * 1024
+
+
+class AssetCache:
+    """LRU cache of file contents validated against mtime and size
+
+    Entries are keyed by inode, so hardlinked copies of a file (see
+    tile_store.py) share one entry whatever path they are requested by.
+    """
+
+    def __init__(self, max_bytes=ASSET_CACHE_BYTES, max_file=ASSET_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_path):
+        """Return the file's bytes, or None if it is too large to cache"""
+        path = os.path.normpath(file_path)
+        stat = os.stat(path)
+        if stat.st_size > self.max_file:
+            return None
+        key = (stat.st_dev, stat.st_ino)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            self._keys[path] = key
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (signature, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return data
+
+    def invalidate(self, file_path):
+        """Drop one file from the cache"""
+        with self._lock:
+            key = self._keys.pop(os.path.normpath(file_path), None)
+            if key is not None:
+                self._remove(key)
+
+    def invalidate_prefix(self, directory):
+        """Drop every cached file below a directory"""
+        prefix = os.path.normpath(directory) + os.sep
+        with self._lock:
+            for path in [path for path in self._keys if path.startswith(prefix)]:
+                self._remove(self._keys.pop(path))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Cache statistics for /api/status"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'paths': len(self._keys),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+asset_cache = AssetCache()
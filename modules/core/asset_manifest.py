@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Asset Manifest
+Versioned list of the files under assets/ and modules/ for client precaching
+
+The manifest is derived from the hash index. Every change of the file set
+bumps the version; each entry remembers the version it last changed in and
+deleted files are kept as tombstones, so clients that already hold
+version N can ask for just the entries changed since (?from=N). The state
+is persisted so versions survive server restarts.
+"""
+
+import json
+import threading
+
+from hash_index import hash_index
+from file_locks import replace_file
+
+MANIFEST_STATE_FILE = '.cache/asset_manifest.json'
+# Tombstones older than this many versions are dropped; clients that are
+# further behind get the full manifest instead of a diff
+TOMBSTONE_VERSIONS = 1000
+
+
+class AssetManifest:
+    """Incrementally maintained {path: {size, hash, version}} with tombstones"""
+
+    def __init__(self, index=hash_index, state_file=MANIFEST_STATE_FILE):
+        self.index = index
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._entries = None
+        self._version = 0
+        self._min_diff_version = 0
+        self._generation = None
+
+    def _load(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self._entries = state['entries']
+            self._version = state['version']
+            self._min_diff_version = state.get('minDiffVersion', 0)
+        except (OSError, ValueError, KeyError):
+            self._entries = {}
+            self._version = 0
+            self._min_diff_version = 0
+
+    def _save(self):
+        state = {
+            'version': self._version,
+            'minDiffVersion': self._min_diff_version,
+            'entries': self._entries
+        }
+        replace_file(self.state_file, json.dumps(state, separators=(',', ':')))
+
+    def refresh(self):
+        """Fold the current hash index into the manifest; returns the version"""
+        generation, files = self.index.snapshot()
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if generation == self._generation:
+                return self._version
+
+            changed = {}
+            for path, ((_, size, _), digest) in files.items():
+                entry = self._entries.get(path)
+                if entry is None or entry.get('deleted') or entry['hash'] != digest:
+                    changed[path] = {'size': size, 'hash': digest}
+            deleted = [path for path, entry in self._entries.items()
+                       if not entry.get('deleted') and path not in files]
+
+            if changed or deleted:
+                self._version += 1
+                for path, entry in changed.items():
+                    entry['version'] = self._version
+                    self._entries[path] = entry
+                for path in deleted:
+                    self._entries[path] = {'deleted': True, 'version': self._version}
+                self._prune_tombstones()
+                try:
+                    self._save()
+                except OSError as e:
+                    print(f"[AssetManifest] Could not persist manifest: {e}")
+            self._generation = generation
+            return self._version
+
+    def _prune_tombstones(self):
+        cutoff = self._version - TOMBSTONE_VERSIONS
+        if cutoff <= self._min_diff_version:
+            return
+        for path in [path for path, entry in self._entries.items()
+                     if entry.get('deleted') and entry['version'] <= cutoff]:
+            del self._entries[path]
+        self._min_diff_version = cutoff
+
+    def version(self):
+        return self.refresh()
+
+    def full(self):
+        """The complete manifest"""
+        version = self.refresh()
+        with self._lock:
+            files = [
+                {'path': path, 'size': entry['size'], 'hash': entry['hash']}
+                for path, entry in sorted(self._entries.items()) if not entry.get('deleted')
+            ]
+        return {'version': version, 'full': True, 'files': files, 'count': len(files)}
+
+    def diff(self, since):
+        """Entries changed after version `since`; full manifest if that is too old"""
+        version = self.refresh()
+        with self._lock:
+            if since < self._min_diff_version or since > version:
+                diff_possible = False
+            else:
+                diff_possible = True
+                changed = []
+                deleted = []
+                for path, entry in sorted(self._entries.items()):
+                    if entry['version'] <= since:
+                        continue
+                    if entry.get('deleted'):
+                        deleted.append(path)
+                    else:
+                        changed.append({'path': path, 'size': entry['size'], 'hash': entry['hash']})
+        if not diff_possible:
+            return self.full()
+        return {'version': version, 'from': since, 'full': False, 'files': changed, 'deleted': deleted}
+
+    def stats(self):
+        with self._lock:
+            return {'version': self._version, 'entries': len(self._entries or {})}
+
+
+asset_manifest = AssetManifest()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - asyncio Server Backend
+Event-loop based alternative to the socketserver backend. Connections are
+coroutines instead of threads; the regular handler routes run in a worker
+pool through the request bridge, static files are streamed by the loop.
+"""
+
+import os
+import asyncio
+import tempfile
+import functools
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+import events
+from request_bridge import run_request
+from request_body import MAX_REQUEST_BODY, READ_CHUNK_SIZE
+
+# Seconds an idle keep-alive connection is held open
+KEEPALIVE_TIMEOUT = 75
+# Seconds between SSE heartbeat comments
+SSE_HEARTBEAT = 15
+# Largest accepted request line + header block
+MAX_HEADER_BYTES = 64 * 1024
+# Worker threads for handler routes (filesystem scans, JSON parsing)
+EXECUTOR_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Events buffered per SSE client before old ones are dropped
+SSE_QUEUE_SIZE = 256
+# Request bodies larger than this are spooled to a temporary file
+BODY_SPOOL_BYTES = 1024 * 1024
+
+
+class _LoopSink:
+    """Bridge sink that writes a handler's response to an asyncio stream
+
+    The handler runs in a worker thread; every write is scheduled on the
+    loop and the worker waits for the transport to drain, so slow clients
+    apply backpressure to the producer instead of growing a buffer.
+    """
+
+    def __init__(self, loop, writer, keep_alive):
+        self.loop = loop
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.file_path = None
+
+    def start(self, status, reason, headers):
+        names = {name.lower() for name, _ in headers}
+        if 'connection' not in names:
+            headers.append(('Connection', 'keep-alive' if self.keep_alive else 'close'))
+        lines = [f'HTTP/1.1 {status} {reason}']
+        lines.extend(f'{name}: {value}' for name, value in headers)
+        self.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', 'replace'))
+
+    def write(self, data):
+        if data:
+            asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+
+    def send_file(self, file_path):
+        # Streamed by the event loop once the handler has returned
+        self.file_path = file_path
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+
+class AsyncWoodChunkServer:
+    """HTTP/1.1 server on asyncio streams using a BaseHTTPRequestHandler class"""
+
+    backend_name = 'asyncio'
+
+    def __init__(self, handler_class, host, port, workers=EXECUTOR_WORKERS):
+        self.handler_class = handler_class
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='woodchunk-worker')
+        self.server_address = (host, port)
+
+    async def serve_forever(self, on_bound=None):
+        """Bind and serve until cancelled; on_bound() runs once the socket is bound"""
+        server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port,
+            limit=MAX_HEADER_BYTES, backlog=1024
+        )
+        if on_bound is not None:
+            on_bound()
+        print(f"[AsyncServer] ✅ Server started successfully!")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until it closes or idles out"""
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self.send_simple(writer, 431, 'Request Header Fields Too Large')
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                request = self.parse_head(head)
+                if request is None:
+                    await self.send_simple(writer, 400, 'Bad Request')
+                    break
+                method, target, version, headers = request
+
+                try:
+                    length = int(headers.get('Content-Length') or 0)
+                except ValueError:
+                    await self.send_simple(writer, 400, 'Bad Request')
+                    break
+                if length > MAX_REQUEST_BODY:
+                    await self.send_simple(writer, 413, 'Content Too Large')
+                    break
+                body = await self.read_body(reader, length)
+
+                if target.split('?', 1)[0] == '/api/events':
+                    await self.serve_events(writer, headers)
+                    break
+
+                keep_alive = self.wants_keep_alive(version, headers)
+                try:
+                    keep_alive = await self.dispatch(writer, method, target, version, headers, body, peer,
+                                                     keep_alive)
+                finally:
+                    if not isinstance(body, bytes):
+                        body.close()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"[AsyncServer] Connection error: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    def parse_head(self, head):
+        """Split a raw request head into method, target, version and headers"""
+        try:
+            text = head.decode('latin-1')
+            request_line, _, header_block = text.partition('\r\n')
+            method, target, version = request_line.split()
+            if not version.startswith('HTTP/1.'):
+                return None
+            headers = http.client.HTTPMessage()
+            for line in header_block.split('\r\n'):
+                if not line:
+                    continue
+                name, _, value = line.partition(':')
+                headers[name.strip()] = value.strip()
+            return method, target, version, headers
+        except ValueError:
+            return None
+
+    def wants_keep_alive(self, version, headers):
+        connection = (headers.get('Connection') or '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    async def read_body(self, reader, length):
+        """The request body; bytes, or a spooled file for large bodies"""
+        if length <= 0:
+            return b''
+        if length <= BODY_SPOOL_BYTES:
+            return await reader.readexactly(length)
+        # Large uploads (maps) are parsed incrementally by the routes, so
+        # they are not buffered in memory here either
+        spool = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+        try:
+            remaining = length
+            while remaining:
+                data = await reader.readexactly(min(READ_CHUNK_SIZE, remaining))
+                spool.write(data)
+                remaining -= len(data)
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    async def dispatch(self, writer, method, target, version, headers, body, peer, keep_alive):
+        """Run the handler route in the executor and stream its response"""
+        loop = asyncio.get_running_loop()
+        sink = _LoopSink(loop, writer, keep_alive)
+        call = functools.partial(
+            run_request, self.handler_class, method, target,
+            headers=headers, body=body, client_address=peer, server=self, sink=sink,
+            version=version
+        )
+        bridge = await loop.run_in_executor(self.executor, call)
+
+        if sink.file_path is not None:
+            await self.stream_file(writer, sink.file_path)
+        await writer.drain()
+        return keep_alive and not bridge.close_connection
+
+    async def stream_file(self, writer, file_path):
+        """Send a file without blocking the loop (zero-copy where supported)"""
+        loop = asyncio.get_running_loop()
+        await writer.drain()
+        with open(file_path, 'rb') as f:
+            await loop.sendfile(writer.transport, f, fallback=True)
+
+    async def send_simple(self, writer, status, reason):
+        body = f'{status} {reason}\n'.encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def serve_events(self, writer, headers):
+        """Serve the /api/events Server-Sent Events stream"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+
+        def offer(message):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+        def deliver(message):
+            loop.call_soon_threadsafe(offer, message)
+
+        events.subscribe(deliver)
+        try:
+            writer.write(
+                b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                b'Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\n\r\nretry: 3000\n\n'
+            )
+            try:
+                last_id = int(headers.get('Last-Event-ID') or 0)
+            except ValueError:
+                last_id = 0
+            if last_id:
+                for message in events.events_since(last_id):
+                    writer.write(events.format_sse(message))
+            await writer.drain()
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT)
+                    writer.write(events.format_sse(message))
+                except asyncio.TimeoutError:
+                    writer.write(b': heartbeat\n\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            events.unsubscribe(deliver)
+
+
+def serve(handler_class, host, port, on_bound=None):
+    """Run the asyncio backend until interrupted"""
+    server = AsyncWoodChunkServer(handler_class, host, port)
+    try:
+        asyncio.run(server.serve_forever(on_bound))
+    finally:
+        server.executor.shutdown(wait=False)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Batch Requests
+Runs several GET API requests concurrently through the regular handler
+routes (via request_bridge) and multiplexes their responses into one body
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from request_bridge import run_request
+from json_response import RawJson, StreamedList
+
+# Sub-requests accepted per batch
+MAX_BATCH_REQUESTS = 32
+BATCH_WORKERS = min(16, (os.cpu_count() or 1) + 4)
+# Routes that cannot be answered inside a batch
+EXCLUDED_PATHS = ('/api/batch', '/api/events')
+# Request headers passed on to every sub-request
+FORWARDED_HEADERS = ('Accept', 'Accept-Language', 'User-Agent')
+
+_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+
+def parse_items(data):
+    """Normalize a batch body (list of paths or {"requests": [...]}) to items"""
+    if isinstance(data, dict):
+        data = data.get('requests')
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of requests")
+    if len(data) > MAX_BATCH_REQUESTS:
+        raise ValueError(f"At most {MAX_BATCH_REQUESTS} requests per batch")
+
+    items = []
+    for index, entry in enumerate(data):
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('path'), str):
+            raise ValueError(f"Request {index} has no path")
+        items.append({
+            'id': entry.get('id', index),
+            'path': entry['path'],
+            'headers': entry.get('headers') or {}
+        })
+    return items
+
+
+def _run_item(handler_class, item, headers, server, client_address):
+    path = item['path']
+    if not path.startswith('/api/') or path.split('?', 1)[0] in EXCLUDED_PATHS:
+        return {'id': item['id'], 'path': path, 'status': 400, 'error': 'Path not allowed in a batch'}
+
+    request_headers = dict(headers)
+    # Sub-responses are spliced into the batch body, so they are never compressed
+    request_headers.update({str(name): str(value) for name, value in item['headers'].items()
+                            if str(name).lower() != 'accept-encoding'})
+    try:
+        bridge = run_request(handler_class, 'GET', path, headers=request_headers,
+                             client_address=client_address, server=server)
+    except Exception as e:
+        print(f"[Batch] Error running {path}: {e}")
+        return {'id': item['id'], 'path': path, 'status': 500, 'error': str(e)}
+
+    result = {'id': item['id'], 'path': path, 'status': bridge.status}
+    etag = bridge.get_header('ETag')
+    if etag:
+        result['etag'] = etag
+    content_type = bridge.get_header('Content-Type') or ''
+    body = bridge.body
+    if bridge.status >= 400:
+        result['error'] = bridge.reason
+    elif content_type.startswith('application/json') and body:
+        # Already encoded by the route - spliced in without a decode/encode pass
+        result['body'] = RawJson(body)
+    elif body:
+        result['body'] = body.decode('utf-8', 'replace')
+    return result
+
+
+def run_batch(handler_class, items, request_headers, server=None, client_address=('127.0.0.1', 0)):
+    """Run the items concurrently; returns the results in request order"""
+    headers = {name: request_headers[name] for name in FORWARDED_HEADERS if request_headers.get(name)}
+    futures = [
+        _executor.submit(_run_item, handler_class, item, headers, server, client_address)
+        for item in items
+    ]
+    return StreamedList(future.result() for future in futures)
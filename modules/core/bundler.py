@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Script Bundler
+Concatenates the classic <script src> tags of an editor page into versioned
+bundles served by /api/bundle/<editor>.js
+
+Inline scripts between external ones keep their position: the external
+scripts of a page are split into segments at every inline script, and each
+segment becomes one bundle (?part=N). Files are joined in document order,
+separated by an empty statement so a "use strict" directive of one file can
+never turn the whole bundle strict. Pages whose scripts only work as
+separate scripts (e.g. a file with a parse error, or clashing top-level
+const/let names) can request ?isolate=1 bundles instead.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+import posixpath
+from urllib.parse import unquote
+
+# Emit a sourceMappingURL comment in bundles
+BUNDLE_SOURCE_MAPS = True
+
+SCRIPT_TAG_PATTERN = re.compile(r'<script\b([^>]*)>(.*?)</script\s*>', re.IGNORECASE | re.DOTALL)
+SRC_PATTERN = re.compile(r'\bsrc\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+TYPE_PATTERN = re.compile(r'\btype\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+HTML_COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+EDITOR_NAME_PATTERN = re.compile(r'^[\w\-]+$')
+
+BASE64_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+
+def resolve_editor_page(editor):
+    """Map an editor id to its HTML page
+
+    "hexMapEditor" resolves to modules/hexMapEditor/index.html (falling back
+    to <editor>.html), "hexMapEditor/hexMapEditor" names a page directly.
+    """
+    parts = (editor or '').split('/')
+    if len(parts) > 2 or not all(EDITOR_NAME_PATTERN.match(part) for part in parts):
+        return None
+    if len(parts) == 2:
+        candidates = [f'modules/{parts[0]}/{parts[1]}.html']
+    else:
+        candidates = [f'modules/{editor}/index.html', f'modules/{editor}/{editor}.html']
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def editor_id_for_page(page_path):
+    """Inverse of resolve_editor_page for pages below modules/"""
+    parts = page_path.replace('\\', '/').lstrip('/').split('/')
+    if len(parts) != 3 or parts[0] != 'modules' or not parts[2].endswith('.html'):
+        return None
+    return f'{parts[1]}/{parts[2][:-5]}'
+
+
+def _resolve_url(page_url, src):
+    """Resolve a script src against its page like a browser would"""
+    if not src.startswith('/'):
+        src = posixpath.join(posixpath.dirname(page_url), src)
+    parts = []
+    for part in src.split('/'):
+        if part == '..':
+            # Browsers clamp ".." at the site root
+            if parts:
+                parts.pop()
+        elif part not in ('', '.'):
+            parts.append(part)
+    return '/' + '/'.join(parts)
+
+
+def _scan_scripts(page_path, html):
+    """Group the page's bundleable scripts into segments of (url, span)"""
+    # Blank out comments without shifting offsets so spans index the real HTML
+    masked = HTML_COMMENT_PATTERN.sub(lambda match: ' ' * len(match.group(0)), html)
+    page_url = '/' + page_path.replace('\\', '/').lstrip('/')
+    segments = [[]]
+
+    for match in SCRIPT_TAG_PATTERN.finditer(masked):
+        attributes = match.group(1)
+        src_match = SRC_PATTERN.search(attributes)
+        type_match = TYPE_PATTERN.search(attributes)
+        script_type = type_match.group(1).lower() if type_match else 'text/javascript'
+        src = src_match.group(1) if src_match else None
+
+        bundleable = (
+            src is not None
+            and not src.startswith(('http:', 'https:', '//', 'data:'))
+            and script_type in ('text/javascript', 'application/javascript')
+        )
+        if bundleable:
+            segments[-1].append((_resolve_url(page_url, src.split('?', 1)[0]), match.span()))
+        elif segments[-1]:
+            # Inline or module scripts must run between the surrounding bundles
+            segments.append([])
+
+    return [segment for segment in segments if segment]
+
+
+def parse_script_segments(page_path, html):
+    """Return the page's external script URLs grouped into bundleable segments"""
+    return [[url for url, _ in segment] for segment in _scan_scripts(page_path, html)]
+
+
+def rewrite_page(page_path, html, bundles, isolate=False):
+    """Replace each script segment of a page with one versioned bundle tag"""
+    editor_id = editor_id_for_page(page_path)
+    if editor_id is None:
+        return html
+    output = []
+    position = 0
+    for part, segment in enumerate(_scan_scripts(page_path, html)):
+        version = bundles[part].version if part < len(bundles) and bundles[part] else ''
+        for index, (_, (start, end)) in enumerate(segment):
+            output.append(html[position:start])
+            if index == 0:
+                output.append(
+                    f'<script src="/api/bundle/{editor_id}.js?part={part}&v={version}'
+                    f'{"&isolate=1" if isolate else ""}"></script>'
+                )
+            position = end
+    output.append(html[position:])
+    return ''.join(output)
+
+
+def _vlq(value):
+    """Encode one integer as a Base64 VLQ (source map v3)"""
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    digits = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        digits += BASE64_DIGITS[digit]
+        if not value:
+            return digits
+
+
+class Bundle:
+    """One built bundle segment
+
+    `code` is the plain concatenation. `isolated_code()` evaluates every file
+    as its own script element instead, which keeps the browser's per-script
+    semantics (a file with a parse error only breaks itself) at the cost of
+    shipping the sources as string literals.
+    """
+
+    def __init__(self, version, sources):
+        self.version = version
+        self.sources = sources
+        self.files = [url for url, _ in sources]
+        self._line_map = []
+        self._source_map = None
+        self._isolated_code = None
+
+        chunks = [f'/* WoodChunk bundle {version} */\n']
+        line_map = [None]
+        for url, source in sources:
+            if source is None:
+                chunks.append(f';\n/* missing: {url} */\n')
+                line_map.extend([None, None])
+                continue
+            chunks.append(f';\n/* {url} */\n')
+            chunks.append(source)
+            line_map.extend([None, None])
+            line_map.extend((url, line) for line in range(source.count('\n')))
+        self.code = ''.join(chunks).encode('utf-8')
+        self._line_map = line_map
+
+    def source_map(self, file_name):
+        """Build (once) a source map mapping every bundle line to its source line"""
+        if self._source_map is None:
+            sources = [url for url, source in self.sources if source is not None]
+            source_indexes = {url: index for index, url in enumerate(sources)}
+            mappings = []
+            prev_source, prev_line = 0, 0
+            for entry in self._line_map:
+                if entry is None:
+                    mappings.append('')
+                    continue
+                source_index = source_indexes[entry[0]]
+                mappings.append(
+                    'A' + _vlq(source_index - prev_source) + _vlq(entry[1] - prev_line) + 'A'
+                )
+                prev_source, prev_line = source_index, entry[1]
+            source_map = {
+                'version': 3,
+                'file': file_name,
+                'sources': sources,
+                'names': [],
+                'mappings': ';'.join(mappings)
+            }
+            self._source_map = json.dumps(source_map, ensure_ascii=False).encode('utf-8')
+        return self._source_map
+
+    def isolated_code(self):
+        """Build (once) the variant that runs each file as a separate script"""
+        if self._isolated_code is None:
+            payload = json.dumps(
+                [[url, source] for url, source in self.sources if source is not None],
+                ensure_ascii=False
+            ).replace('</', '<\\/')
+            self._isolated_code = (
+                f'/* WoodChunk bundle {self.version} (isolated) */\n'
+                '(function (sources) {\n'
+                '    var anchor = document.currentScript;\n'
+                '    var parent = anchor ? anchor.parentNode : document.head;\n'
+                '    sources.forEach(function (entry) {\n'
+                '        var script = document.createElement("script");\n'
+                '        script.text = entry[1] + "\\n//# sourceURL=" + entry[0];\n'
+                '        parent.insertBefore(script, anchor);\n'
+                '    });\n'
+                f'}})({payload});\n'
+            ).encode('utf-8')
+        return self._isolated_code
+
+
+class BundleCache:
+    """In-memory bundles keyed by the content hashes of their inputs
+
+    Every lookup re-stats the page and its scripts; only files whose mtime or
+    size changed are re-hashed, and a bundle is rebuilt when the combined
+    hash of its inputs differs from the cached one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file_hashes = {}
+        self._bundles = {}
+
+    def file_hash(self, file_path):
+        """Content hash of a file, recomputed only after it changed"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self._file_hashes.pop(file_path, None)
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_hashes.get(file_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        with open(file_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._file_hashes[file_path] = (signature, digest)
+        return digest
+
+    def segments(self, page_path):
+        """Script segments of a page"""
+        with open(page_path, 'r', encoding='utf-8') as f:
+            return parse_script_segments(page_path, f.read())
+
+    def get(self, page_path, part):
+        """Return the current Bundle for a page segment (None if out of range)"""
+        with self._lock:
+            segments = self.segments(page_path)
+            if part < 0 or part >= len(segments):
+                return None
+            urls = segments[part]
+            hashes = [self.file_hash(unquote(url).lstrip('/')) or 'missing' for url in urls]
+            version = hashlib.sha1('\n'.join(
+                f'{url}:{digest}' for url, digest in zip(urls, hashes)
+            ).encode('utf-8')).hexdigest()[:12]
+
+            key = (page_path, part)
+            bundle = self._bundles.get(key)
+            if bundle is None or bundle.version != version:
+                bundle = self.build(urls, version)
+                self._bundles[key] = bundle
+            return bundle
+
+    def versions(self, page_path):
+        """Return the current version of every segment of a page"""
+        count = len(self.segments(page_path))
+        return [self.get(page_path, part) for part in range(count)]
+
+    def build(self, urls, version):
+        """Read the scripts of one segment into a Bundle"""
+        root = os.path.realpath('.') + os.sep
+        sources = []
+        for url in urls:
+            real_path = os.path.realpath(unquote(url).lstrip('/'))
+            if not real_path.startswith(root) or not os.path.isfile(real_path):
+                print(f"[Bundler] Missing script {url}")
+                sources.append((url, None))
+                continue
+            with open(real_path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            if not source.endswith('\n'):
+                source += '\n'
+            sources.append((url, source))
+        return Bundle(version, sources)
+
+
+bundle_cache = BundleCache()
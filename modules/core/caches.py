@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Shared Caches
+Single invalidation entry point for the process-wide caches. Every route that
+writes files under assets/ reports the touched paths here.
+"""
+
+import threading
+
+import events
+from asset_cache import asset_cache
+from tile_index import tile_index
+from hash_index import hash_index
+
+_lock = threading.Lock()
+_invalidators = []
+
+
+def register_invalidator(callback):
+    """Register callback(paths) to run whenever files change"""
+    with _lock:
+        _invalidators.append(callback)
+
+
+def invalidate_paths(paths, reason='files-changed'):
+    """Drop cached state for changed files and notify clients"""
+    paths = [str(path).replace('\\', '/').lstrip('/') for path in paths if path]
+    for path in paths:
+        asset_cache.invalidate(path)
+        tile_index.invalidate_path(path)
+    hash_index.invalidate(paths)
+
+    with _lock:
+        invalidators = list(_invalidators)
+    for callback in invalidators:
+        try:
+            callback(paths)
+        except Exception as e:
+            print(f"[Caches] Invalidator error: {e}")
+
+    events.publish(reason, {'paths': paths})
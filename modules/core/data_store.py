@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Game Data Store
+SQLite index of the item, ability and people data for filtered queries
+
+The JS files under assets/items and assets/abilities and
+assets/peoples/peoples.json stay the source of truth. The store mirrors
+them into .cache/game_data.sqlite3 (WAL mode, so queries never wait for a
+sync), re-parsing only files whose mtime or size changed, and answers
+queries such as availableFor=elves&level<=3 from indexed columns. Each
+record keeps its original JSON, which is spliced into responses as is.
+
+sqlite3 is optional: without it the store reports itself unavailable.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import unquote_plus
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from js_literal import read_js_data
+from json_response import RawJson
+
+DB_FILE = '.cache/game_data.sqlite3'
+ITEMS_PATH = 'assets/items'
+ABILITIES_PATH = 'assets/abilities'
+PEOPLES_FILE = 'assets/peoples/peoples.json'
+# Sources are re-checked at most this often unless the store is invalidated
+SYNC_INTERVAL = 2.0
+# Bumped whenever the schema changes; older databases are rebuilt
+SCHEMA_VERSION = 1
+MAX_QUERY_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, signature TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY, file TEXT NOT NULL, category TEXT NOT NULL,
+    id TEXT, name TEXT, type TEXT, material TEXT, rarity TEXT, level INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_category ON items (category, level);
+CREATE INDEX IF NOT EXISTS items_type ON items (type, level);
+CREATE INDEX IF NOT EXISTS items_level ON items (level);
+CREATE TABLE IF NOT EXISTS abilities (
+    path TEXT PRIMARY KEY, file TEXT NOT NULL, category TEXT NOT NULL,
+    id TEXT, name TEXT, type TEXT, level INTEGER, rank INTEGER, cost INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS abilities_category ON abilities (category, level);
+CREATE INDEX IF NOT EXISTS abilities_type ON abilities (type, level);
+CREATE INDEX IF NOT EXISTS abilities_level ON abilities (level);
+CREATE TABLE IF NOT EXISTS ability_races (
+    race TEXT NOT NULL COLLATE NOCASE, path TEXT NOT NULL, PRIMARY KEY (race, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ability_races_path ON ability_races (path);
+CREATE TABLE IF NOT EXISTS peoples (
+    position INTEGER PRIMARY KEY, id TEXT, name TEXT, race TEXT COLLATE NOCASE,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS peoples_race ON peoples (race);
+"""
+
+# Queryable fields per table: field -> (SQL expression, value type)
+QUERY_FIELDS = {
+    'items': {
+        'id': ('id', str), 'name': ('name', str), 'category': ('category', str),
+        'type': ('type', str), 'material': ('material', str), 'rarity': ('rarity', str),
+        'level': ('level', int)
+    },
+    'abilities': {
+        'id': ('id', str), 'name': ('name', str), 'category': ('category', str),
+        'type': ('type', str), 'level': ('level', int), 'rank': ('rank', int),
+        'cost': ('cost', int), 'availableFor': (None, str)
+    },
+    'peoples': {
+        'id': ('id', str), 'name': ('name', str), 'race': ('race', str)
+    }
+}
+# Default order of each table
+ORDER = {'items': 'category, level, name', 'abilities': 'category, level, name', 'peoples': 'position'}
+OPERATORS = ('<=', '>=', '!=', '<', '>', '=')
+_CONDITION = re.compile(r'^([A-Za-z_]\w*)(<=|>=|!=|<|>|=)(.*)$', re.DOTALL)
+
+
+def parse_query(table, query):
+    """Split a raw query string into (filters, options)
+
+    Filters are (field, operator, values) triples; `field=a,b` matches any
+    of the values. The comparison operators are taken from the raw query,
+    so `level<=3` works as written. Options are sort, limit and offset.
+    Raises ValueError for unknown fields or malformed values.
+    """
+    fields = QUERY_FIELDS[table]
+    filters = []
+    options = {'sort': None, 'limit': None, 'offset': 0}
+    for part in query.split('&') if query else ():
+        if not part:
+            continue
+        match = _CONDITION.match(unquote_plus(part))
+        if match is None:
+            raise ValueError(f"Malformed condition: {unquote_plus(part)}")
+        field, operator, raw_value = match.groups()
+
+        if field in ('limit', 'offset'):
+            if operator != '=' or not raw_value.isdigit():
+                raise ValueError(f"{field} must be a non-negative integer")
+            options[field] = int(raw_value)
+            continue
+        if field == 'sort':
+            name = raw_value.lstrip('-')
+            if operator != '=' or name not in fields or fields[name][0] is None:
+                raise ValueError(f"Cannot sort by {raw_value}")
+            options['sort'] = (name, raw_value.startswith('-'))
+            continue
+
+        if field not in fields:
+            raise ValueError(f"Unknown field '{field}' (allowed: {', '.join(sorted(fields))})")
+        column, value_type = fields[field]
+        values = raw_value.split(',') if operator in ('=', '!=') else [raw_value]
+        try:
+            values = [value_type(value) for value in values]
+        except ValueError:
+            raise ValueError(f"Invalid value for {field}: {raw_value}")
+        if column is None and operator != '=':
+            raise ValueError(f"{field} only supports '='")
+        filters.append((field, operator, values))
+
+    if options['limit'] is not None:
+        options['limit'] = min(options['limit'], MAX_QUERY_LIMIT)
+    return filters, options
+
+
+def _build_where(table, filters):
+    clauses = []
+    params = []
+    for field, operator, values in filters:
+        column = QUERY_FIELDS[table][field][0]
+        placeholders = ', '.join('?' * len(values))
+        if column is None:
+            # availableFor: abilities usable by any of the given races
+            clauses.append(f'path IN (SELECT path FROM ability_races WHERE race IN ({placeholders}))')
+        elif operator in ('=', '!=') and len(values) > 1:
+            clauses.append(f'{column} {"NOT IN" if operator == "!=" else "IN"} ({placeholders})')
+        else:
+            clauses.append(f'{column} {operator} ?')
+        params.extend(values)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DataStore:
+    """SQLite mirror of the game data files"""
+
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._sync_lock = threading.Lock()
+        self._synced_at = 0.0
+        self._dirty = True
+        self._generation = None
+
+    @property
+    def available(self):
+        return sqlite3 is not None
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+            connection = sqlite3.connect(self.db_file, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _ensure_schema(self, connection):
+        if connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION:
+            return
+        # Derived data only - an outdated database is simply rebuilt
+        with connection:
+            for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                connection.execute(f'DROP TABLE IF EXISTS "{name}"')
+            connection.executescript(SCHEMA)
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    # -- sync -----------------------------------------------------------------
+
+    def _scan_sources(self):
+        """path -> signature of every source file"""
+        paths = []
+        for root, skipped in ((ITEMS_PATH, ('classes',)), (ABILITIES_PATH, ('abilities',))):
+            if not os.path.isdir(root):
+                continue
+            for category in sorted(os.listdir(root)):
+                category_path = f'{root}/{category}'
+                if category in skipped or not os.path.isdir(category_path):
+                    continue
+                paths.extend(f'{category_path}/{name}' for name in sorted(os.listdir(category_path))
+                             if name.endswith('.js') and name != 'columns.js')
+        paths.append(PEOPLES_FILE)
+
+        sources = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            sources[path] = f'{stat.st_mtime_ns}:{stat.st_size}'
+        return sources
+
+    def invalidate(self, paths=None):
+        """Mark the store stale (registered with caches.invalidate_paths)"""
+        if paths is None or any(path.startswith((ITEMS_PATH, ABILITIES_PATH, PEOPLES_FILE)) for path in paths):
+            self._dirty = True
+
+    def sync(self, force=False):
+        """Mirror changed source files into the database; returns the generation"""
+        if not self.available:
+            return None
+        with self._sync_lock:
+            if not force and not self._dirty and self._generation is not None \
+                    and time.monotonic() - self._synced_at < SYNC_INTERVAL:
+                return self._generation
+            self._dirty = False
+
+            connection = self._connection()
+            self._ensure_schema(connection)
+            sources = self._scan_sources()
+            known = dict(connection.execute('SELECT path, signature FROM sources'))
+            changed = [path for path, signature in sources.items() if known.get(path) != signature]
+            removed = [path for path in known if path not in sources]
+
+            if changed or removed:
+                with connection:
+                    for path in removed:
+                        self._remove(connection, path)
+                        connection.execute('DELETE FROM sources WHERE path = ?', (path,))
+                    for path in changed:
+                        self._remove(connection, path)
+                        try:
+                            self._insert(connection, path)
+                        except (OSError, ValueError) as e:
+                            print(f"[DataStore] Could not read {path}: {e}")
+                        connection.execute('INSERT OR REPLACE INTO sources (path, signature) VALUES (?, ?)',
+                                           (path, sources[path]))
+                    connection.execute("INSERT INTO meta (key, value) VALUES ('generation', 1) "
+                                       "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+                print(f"[DataStore] Synced {len(changed)} changed, {len(removed)} removed source files")
+
+            row = connection.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            self._generation = row[0] if row else 0
+            self._synced_at = time.monotonic()
+            return self._generation
+
+    def _remove(self, connection, path):
+        if path == PEOPLES_FILE:
+            connection.execute('DELETE FROM peoples')
+        else:
+            table = 'items' if path.startswith(ITEMS_PATH) else 'abilities'
+            connection.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+            connection.execute('DELETE FROM ability_races WHERE path = ?', (path,))
+
+    def _insert(self, connection, path):
+        if path == PEOPLES_FILE:
+            with open(path, 'r', encoding='utf-8') as f:
+                peoples = json.load(f).get('peoples', [])
+            connection.executemany(
+                'INSERT INTO peoples (position, id, name, race, data) VALUES (?, ?, ?, ?, ?)',
+                [(position, people.get('id'), people.get('name'), people.get('race'),
+                  json.dumps(people, ensure_ascii=False))
+                 for position, people in enumerate(peoples) if isinstance(people, dict)]
+            )
+            return
+
+        data = read_js_data(path)
+        if not isinstance(data, dict):
+            raise ValueError("Expected an object")
+        _, category, file_name = path.rsplit('/', 2)
+        encoded = json.dumps(data, ensure_ascii=False)
+        if path.startswith(ITEMS_PATH):
+            connection.execute(
+                'INSERT INTO items (path, file, category, id, name, type, material, rarity, level, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, file_name, category, data.get('id'), data.get('name'), data.get('type'),
+                 data.get('material'), data.get('rarity'), _int_or_none(data.get('level')), encoded)
+            )
+        else:
+            connection.execute(
+                'INSERT INTO abilities (path, file, category, id, name, type, level, rank, cost, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, file_name, category, data.get('id'), data.get('name'), data.get('type'),
+                 _int_or_none(data.get('level')), _int_or_none(data.get('rank')),
+                 _int_or_none(data.get('cost')), encoded)
+            )
+            races = data.get('availableFor') or []
+            connection.executemany('INSERT OR IGNORE INTO ability_races (race, path) VALUES (?, ?)',
+                                   [(race, path) for race in races if isinstance(race, str)])
+
+    # -- queries --------------------------------------------------------------
+
+    def query(self, table, filters, sort=None, limit=None, offset=0):
+        """Matching records and the total match count
+
+        Items and abilities are {file, path, category, data}; peoples are
+        their peoples.json entries.
+        """
+        self.sync()
+        where, params = _build_where(table, filters)
+        order = ORDER[table]
+        if sort is not None:
+            name, descending = sort
+            order = f'{QUERY_FIELDS[table][name][0]} {"DESC" if descending else "ASC"}, {order}'
+        columns = 'data' if table == 'peoples' else 'file, path, category, data'
+        sql = f'SELECT {columns} FROM {table}{where} ORDER BY {order}'
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            page = [limit if limit is not None else -1, offset]
+        else:
+            page = []
+
+        connection = self._connection()
+        rows = connection.execute(sql, params + page).fetchall()
+        if page:
+            total = connection.execute(f'SELECT COUNT(*) FROM {table}{where}', params).fetchone()[0]
+        else:
+            total = len(rows)
+
+        if table == 'peoples':
+            records = [RawJson(data.encode('utf-8')) for (data,) in rows]
+        else:
+            records = [
+                {'file': file_name, 'path': path, 'category': category, 'data': RawJson(data.encode('utf-8'))}
+                for file_name, path, category, data in rows
+            ]
+        return records, total
+
+    def stats(self):
+        if not self.available:
+            return {'available': False}
+        connection = self._connection()
+        try:
+            counts = {table: connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                      for table in ('items', 'abilities', 'peoples')}
+        except sqlite3.Error:
+            counts = {}
+        return {'available': True, 'generation': self._generation, **counts}
+
+
+data_store = DataStore()
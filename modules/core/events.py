@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Event Hub
+Small publish/subscribe hub used to push server-side changes to clients
+"""
+
+import json
+import threading
+import itertools
+from collections import deque
+from datetime import datetime
+
+# Number of recent events kept for clients reconnecting with Last-Event-ID
+REPLAY_SIZE = 100
+
+_lock = threading.Lock()
+_subscribers = []
+_recent = deque(maxlen=REPLAY_SIZE)
+_event_ids = itertools.count(1)
+
+
+def subscribe(callback):
+    """Register a callback that receives every published event"""
+    with _lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    """Remove a previously registered callback"""
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def publish(event, data=None):
+    """Publish an event to all subscribers (safe to call from any thread)"""
+    with _lock:
+        message = {
+            'id': next(_event_ids),
+            'event': event,
+            'data': data or {},
+            'timestamp': datetime.now().isoformat()
+        }
+        _recent.append(message)
+        subscribers = list(_subscribers)
+
+    for callback in subscribers:
+        try:
+            callback(message)
+        except Exception as e:
+            print(f"[Events] Subscriber error for {event}: {e}")
+    return message
+
+
+def events_since(last_id):
+    """Return buffered events newer than last_id"""
+    with _lock:
+        return [message for message in _recent if message['id'] > last_id]
+
+
+def format_sse(message):
+    """Encode an event as a Server-Sent Events frame"""
+    payload = json.dumps(message['data'], ensure_ascii=False)
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {payload}\n\n".encode('utf-8')
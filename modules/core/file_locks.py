@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - File Locks
+Per-resource write locks shared by threads and by processes
+
+Writers of a file (or of a logical resource such as a directory) take its
+lock with file_locks.locked(path). Threads of one process queue up in
+arrival order; across processes (several server workers, or the core
+server next to the standalone TileEditor API server) the holder also takes
+a lock on a lock file in LOCKS_PATH (fcntl.flock, or msvcrt.locking on
+Windows), so every process that uses this module is serialized as well.
+LOCK_METHOD names the mechanism in use; with neither available only the
+in-process lock applies, which stats() and the startup log report.
+
+Readers never take a lock: writes go through replace_file(), which writes
+a temporary file and moves it into place, so a reader always sees the last
+committed version. Wait times per resource are reported by stats().
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# How lock files are locked across processes (None: in-process locks only)
+LOCK_METHOD = 'fcntl' if fcntl is not None else 'msvcrt' if msvcrt is not None else None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Lock files, shared by every process serving this tree
+LOCKS_PATH = os.environ.get('WOODCHUNK_LOCKS', os.path.join(ROOT_DIR, '.cache', 'locks'))
+# Seconds a writer waits for a lock before giving up (WOODCHUNK_LOCK_TIMEOUT)
+LOCK_TIMEOUT = float(os.environ.get('WOODCHUNK_LOCK_TIMEOUT', 30))
+# Poll interval while another process holds the lock file
+POLL_INTERVAL = 0.005
+# Resources listed in stats(), by total wait time
+STATS_RESOURCES = 10
+
+
+class LockTimeout(TimeoutError):
+    """A lock could not be taken within the timeout"""
+
+
+def resource_name(path):
+    """Canonical name of a file or directory resource, the same in every process"""
+    return os.path.realpath(str(path))
+
+
+def replace_file(path, data, encoding='utf-8'):
+    """Write text or bytes to a file through a temporary file next to it
+
+    The file is replaced in one step, so readers see either the previous or
+    the new content, never a partial write. Callers hold the file's lock.
+    """
+    path = str(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f'.{os.path.basename(path)}.tmp{os.getpid()}-{threading.get_ident()}')
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data.encode(encoding) if isinstance(data, str) else data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class _Resource:
+    """Lock state and wait statistics of one resource"""
+
+    def __init__(self, name):
+        self.name = name
+        self.owner = None
+        self.depth = 0
+        self.fd = None
+        # (thread id, event) of the waiting threads, in arrival order
+        self.queue = deque()
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+
+class FileLocks:
+    """Per-resource FIFO locks, extended across processes with lock files"""
+
+    def __init__(self, locks_path=LOCKS_PATH, timeout=LOCK_TIMEOUT):
+        self.locks_path = locks_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._resources = {}
+
+    def _lock_file(self, name):
+        os.makedirs(self.locks_path, exist_ok=True)
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:20]
+        return os.open(os.path.join(self.locks_path, f'{digest}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _try_lock_file(self, fd):
+        """Lock the lock file without blocking; False if another process holds it"""
+        if LOCK_METHOD == 'fcntl':
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            return True
+        # msvcrt locks a byte range from the file position: the first byte
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def _unlock_file(self, fd):
+        if LOCK_METHOD == 'fcntl':
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def _flock(self, fd, deadline):
+        """Take the lock on fd; False if the deadline passed"""
+        while not self._try_lock_file(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def acquire(self, path, timeout=None):
+        """Take the lock of a resource; reentrant within a thread
+
+        Raises LockTimeout if it is not free within `timeout` seconds
+        (None: the manager's timeout; 0 or less waits forever).
+        """
+        name = resource_name(path)
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None or timeout <= 0 else time.monotonic() + timeout
+        me = threading.get_ident()
+        started = time.perf_counter()
+
+        with self._lock:
+            resource = self._resources.get(name)
+            if resource is None:
+                resource = self._resources[name] = _Resource(name)
+            if resource.owner == me:
+                resource.depth += 1
+                return
+            waiter = None
+            if resource.owner is None and not resource.queue:
+                resource.owner = me
+            else:
+                waiter = threading.Event()
+                resource.queue.append((me, waiter))
+                resource.contended += 1
+
+        if waiter is not None and not waiter.wait(None if deadline is None else max(0, deadline - time.monotonic())):
+            with self._lock:
+                # Handed over between the timeout and here: it is ours after all
+                if not waiter.is_set():
+                    resource.queue.remove((me, waiter))
+                    resource.timeouts += 1
+                    raise LockTimeout(f"Timed out waiting for the lock of {path}")
+
+        if LOCK_METHOD is not None:
+            try:
+                fd = self._lock_file(name)
+            except OSError:
+                self._hand_over(resource)
+                raise
+            if not self._flock(fd, deadline):
+                os.close(fd)
+                with self._lock:
+                    resource.timeouts += 1
+                self._hand_over(resource)
+                raise LockTimeout(f"Timed out waiting for another process holding {path}")
+            resource.fd = fd
+
+        waited = (time.perf_counter() - started) * 1000
+        with self._lock:
+            resource.depth = 1
+            resource.acquisitions += 1
+            resource.wait_ms += waited
+            resource.max_wait_ms = max(resource.max_wait_ms, waited)
+
+    def release(self, path):
+        name = resource_name(path)
+        with self._lock:
+            resource = self._resources.get(name)
+            if resource is None or resource.owner != threading.get_ident():
+                raise RuntimeError(f"Lock of {path} is not held by this thread")
+            resource.depth -= 1
+            if resource.depth:
+                return
+            fd, resource.fd = resource.fd, None
+        if fd is not None:
+            try:
+                self._unlock_file(fd)
+            finally:
+                os.close(fd)
+        self._hand_over(resource)
+
+    def _hand_over(self, resource):
+        """Pass the in-process lock to the next waiting thread, if any"""
+        with self._lock:
+            resource.depth = 0
+            if resource.queue:
+                resource.owner, waiter = resource.queue.popleft()
+                waiter.set()
+            else:
+                resource.owner = None
+
+    def locked(self, *paths, timeout=None):
+        """Context manager holding the locks of all given resources
+
+        The locks are taken in a fixed (sorted) order, so writers that
+        need several files cannot deadlock each other.
+        """
+        return _Locked(self, sorted({resource_name(path) for path in paths}), timeout)
+
+    def stats(self):
+        with self._lock:
+            resources = list(self._resources.values())
+            slowest = sorted(resources, key=lambda resource: resource.wait_ms, reverse=True)[:STATS_RESOURCES]
+            return {
+                'crossProcess': LOCK_METHOD is not None,
+                'lockMethod': LOCK_METHOD,
+                'resources': len(resources),
+                'held': sum(1 for resource in resources if resource.owner is not None),
+                'waiting': sum(len(resource.queue) for resource in resources),
+                'acquisitions': sum(resource.acquisitions for resource in resources),
+                'contended': sum(resource.contended for resource in resources),
+                'timeouts': sum(resource.timeouts for resource in resources),
+                'waitMs': round(sum(resource.wait_ms for resource in resources), 2),
+                'maxWaitMs': round(max((resource.max_wait_ms for resource in resources), default=0), 2),
+                'slowest': [{
+                    'resource': os.path.relpath(resource.name, ROOT_DIR).replace('\\', '/'),
+                    'acquisitions': resource.acquisitions,
+                    'contended': resource.contended,
+                    'timeouts': resource.timeouts,
+                    'waitMs': round(resource.wait_ms, 2),
+                    'maxWaitMs': round(resource.max_wait_ms, 2)
+                } for resource in slowest if resource.acquisitions or resource.timeouts]
+            }
+
+
+class _Locked:
+    def __init__(self, locks, names, timeout):
+        self.locks = locks
+        self.names = names
+        self.timeout = timeout
+        self.held = []
+
+    def __enter__(self):
+        try:
+            for name in self.names:
+                self.locks.acquire(name, self.timeout)
+                self.held.append(name)
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        while self.held:
+            self.locks.release(self.held.pop())
+        return False
+
+
+file_locks = FileLocks()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Hash Index
+Content hashes (SHA-256) of the files under assets/ and modules/
+
+Rescans only stat the tree; files are re-hashed when their mtime, size or
+inode changed. The tile store and the asset manifest are built on top of it.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from file_locks import file_locks, replace_file
+
+INDEX_ROOTS = ('assets', 'modules')
+# Never indexed: bytecode and server-side sources
+EXCLUDED_DIRS = {'__pycache__', '.git'}
+EXCLUDED_EXTENSIONS = ('.pyc', '.py')
+# A full rescan happens at most this often unless the index is invalidated
+RESCAN_INTERVAL = 5.0
+# Hashes persisted between runs, so a restart only has to stat the tree
+SNAPSHOT_FILE = '.cache/hash_index.json'
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashIndex:
+    """path -> ((mtime, size, inode), sha256) for every file below the roots"""
+
+    def __init__(self, roots=INDEX_ROOTS, snapshot_file=SNAPSHOT_FILE):
+        self.roots = roots
+        self.snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._files = {}
+        self._generation = 0
+        self._scanned_at = 0.0
+        self._dirty = True
+
+    def refresh(self, force=False):
+        """Rescan the roots, hashing only files whose signature changed"""
+        with self._refresh_lock:
+            with self._lock:
+                if not force and not self._dirty and time.monotonic() - self._scanned_at < RESCAN_INTERVAL:
+                    return
+                known = self._files
+                # Cleared before the walk so invalidations during it are kept
+                self._dirty = False
+
+            files = {}
+            for root in self.roots:
+                for dirpath, dirnames, filenames in os.walk(root):
+                    dirnames[:] = sorted(name for name in dirnames if name not in EXCLUDED_DIRS)
+                    for name in sorted(filenames):
+                        if name.endswith(EXCLUDED_EXTENSIONS):
+                            continue
+                        path = os.path.join(dirpath, name).replace('\\', '/')
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+                        previous = known.get(path)
+                        if previous is not None and previous[0] == signature:
+                            files[path] = previous
+                            continue
+                        try:
+                            files[path] = (signature, hash_file(path))
+                        except OSError as e:
+                            print(f"[HashIndex] Could not hash {path}: {e}")
+
+            with self._lock:
+                changed = files != known
+                if changed:
+                    self._generation += 1
+                self._files = files
+                self._scanned_at = time.monotonic()
+            if changed:
+                self.save_snapshot()
+
+    def load_snapshot(self):
+        """Seed the index from the persisted snapshot; False if there is none
+
+        Entries are only trusted while their stat signature still matches,
+        so the next refresh re-hashes whatever changed in between.
+        """
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            files = {path: (tuple(signature), digest) for path, (signature, digest) in data['files'].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        with self._lock:
+            if not self._files:
+                self._files = files
+                self._dirty = True
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_file:
+            return
+        with self._lock:
+            data = {'files': self._files}
+        try:
+            text = json.dumps(data, separators=(',', ':'))
+            with file_locks.locked(self.snapshot_file):
+                replace_file(self.snapshot_file, text)
+        except OSError as e:
+            print(f"[HashIndex] Could not write snapshot: {e}")
+
+    def invalidate(self, paths=None):
+        """Mark the index stale (called from caches.invalidate_paths)"""
+        with self._lock:
+            self._dirty = True
+
+    def snapshot(self):
+        """(generation, files) - generation changes whenever any file does"""
+        self.refresh()
+        with self._lock:
+            return self._generation, self._files
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._files), 'generation': self._generation}
+
+
+hash_index = HashIndex()
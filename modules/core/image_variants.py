@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Image Variants
+Offline optimization of the PNG images under assets/
+
+Every source PNG gets a losslessly recompressed PNG and, when Pillow is
+installed, a lossless WebP variant. Variants live in .cache/images next to
+a manifest that records the source's mtime and size, so only changed
+sources are reprocessed. The server picks a variant per request from the
+client's Accept header.
+
+    python modules/core/image_variants.py [--workers N] [--force] [paths...]
+"""
+
+import io
+import os
+import sys
+import json
+import zlib
+import struct
+import argparse
+import threading
+import importlib.util
+
+from file_locks import file_locks, replace_file
+
+# Pillow is optional; it is only imported where WebP files are written, so
+# the server does not pay for the import at startup
+WEBP_SUPPORTED = importlib.util.find_spec('PIL') is not None
+
+ASSETS_PATH = 'assets'
+VARIANTS_PATH = '.cache/images'
+MANIFEST_FILE = 'manifest.json'
+# Bumped whenever the pipeline output changes, so all variants are rebuilt
+PIPELINE_VERSION = 1
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Metadata chunks that do not affect the decoded pixels
+PNG_DROP_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+# -- PNG recompression --------------------------------------------------------
+
+def read_png_chunks(data):
+    """Split PNG data into (type, body) chunks"""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    chunks = []
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + length]
+        if len(body) != length:
+            raise ValueError("Truncated PNG chunk")
+        chunks.append((chunk_type, body))
+        offset += 12 + length
+        if chunk_type == b'IEND':
+            break
+    return chunks
+
+
+def png_chunk(chunk_type, body):
+    crc = zlib.crc32(chunk_type + body) & 0xffffffff
+    return struct.pack('>I4s', len(body), chunk_type) + body + struct.pack('>I', crc)
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa = abs(p - a)
+    pb = abs(p - b)
+    pc = abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def unfilter_scanlines(raw, width, height, bpp):
+    """Undo the PNG row filters; returns the unfiltered rows"""
+    stride = width * bpp
+    rows = []
+    previous = bytearray(stride)
+    offset = 0
+    for _ in range(height):
+        filter_type = raw[offset]
+        row = bytearray(raw[offset + 1:offset + 1 + stride])
+        offset += 1 + stride
+        step = bpp
+        if filter_type == 1:
+            for i in range(step, stride):
+                row[i] = (row[i] + row[i - step]) & 0xff
+        elif filter_type == 2:
+            for i in range(stride):
+                row[i] = (row[i] + previous[i]) & 0xff
+        elif filter_type == 3:
+            for i in range(stride):
+                left = row[i - step] if i >= step else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xff
+        elif filter_type == 4:
+            for i in range(stride):
+                left = row[i - step] if i >= step else 0
+                upper_left = previous[i - step] if i >= step else 0
+                row[i] = (row[i] + _paeth(left, previous[i], upper_left)) & 0xff
+        elif filter_type != 0:
+            raise ValueError(f"Unknown PNG filter {filter_type}")
+        rows.append(row)
+        previous = row
+    return rows
+
+
+def _filter_row(filter_type, row, previous, step):
+    if filter_type == 0:
+        return bytes(row)
+    out = bytearray(len(row))
+    for i in range(len(row)):
+        left = row[i - step] if i >= step else 0
+        up = previous[i]
+        if filter_type == 1:
+            predictor = left
+        elif filter_type == 2:
+            predictor = up
+        elif filter_type == 3:
+            predictor = (left + up) >> 1
+        else:
+            predictor = _paeth(left, up, previous[i - step] if i >= step else 0)
+        out[i] = (row[i] - predictor) & 0xff
+    return bytes(out)
+
+
+def refilter_scanlines(rows, bpp, adaptive):
+    """Filter rows again, either all with filter 0 or per row by minimum sum"""
+    step = bpp
+    out = bytearray()
+    previous = bytearray(len(rows[0]) if rows else 0)
+    for row in rows:
+        if not adaptive:
+            out.append(0)
+            out += row
+        else:
+            best = None
+            for filter_type in range(5):
+                candidate = _filter_row(filter_type, row, previous, step)
+                # Signed-magnitude sum, the usual libpng heuristic
+                score = sum(value if value < 128 else 256 - value for value in candidate)
+                if best is None or score < best[0]:
+                    best = (score, filter_type, candidate)
+            out.append(best[1])
+            out += best[2]
+        previous = row
+    return bytes(out)
+
+
+def _compress_best(raw):
+    candidates = []
+    for strategy in (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+        candidates.append(compressor.compress(raw) + compressor.flush())
+    return min(candidates, key=len)
+
+
+def decode_png(data):
+    """(width, height, RGBA bytes) of an 8-bit, non-interlaced PNG"""
+    chunks = read_png_chunks(data)
+    header = dict(chunks).get(b'IHDR')
+    if header is None:
+        raise ValueError("PNG without IHDR")
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header)
+    if bit_depth != 8 or interlace != 0 or color_type not in PNG_CHANNELS:
+        raise ValueError(f"Unsupported PNG format (depth {bit_depth}, color type {color_type}, interlace {interlace})")
+    channels = PNG_CHANNELS[color_type]
+    raw = zlib.decompress(b''.join(body for chunk_type, body in chunks if chunk_type == b'IDAT'))
+    pixels = b''.join(unfilter_scanlines(raw, width, height, channels))
+
+    count = width * height
+    rgba = bytearray(count * 4)
+    if color_type == 6:
+        return width, height, bytes(pixels)
+    if color_type == 2:
+        for channel in range(3):
+            rgba[channel::4] = pixels[channel::3]
+        rgba[3::4] = b'\xff' * count
+    elif color_type in (0, 4):
+        for channel in range(3):
+            rgba[channel::4] = pixels[0::channels]
+        rgba[3::4] = pixels[1::2] if color_type == 4 else b'\xff' * count
+    else:
+        chunk_map = dict(chunks)
+        palette = chunk_map.get(b'PLTE', b'')
+        alpha = chunk_map.get(b'tRNS', b'')
+        table = [bytes(palette[i * 3:i * 3 + 3].ljust(3, b'\0')) + bytes([alpha[i] if i < len(alpha) else 255])
+                 for i in range(256)]
+        rgba = bytearray(b''.join(map(table.__getitem__, pixels)))
+    return width, height, bytes(rgba)
+
+
+def encode_png(width, height, rgba, level=6):
+    """PNG of RGBA pixel rows (no filtering; previews compress well as they are)"""
+    stride = width * 4
+    raw = b''.join(b'\0' + rgba[offset:offset + stride] for offset in range(0, stride * height, stride))
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (PNG_SIGNATURE + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', zlib.compress(raw, level))
+            + png_chunk(b'IEND', b''))
+
+
+def optimize_png(data):
+    """Losslessly recompress PNG data; returns the smallest encoding found"""
+    chunks = read_png_chunks(data)
+    header = dict(chunks).get(b'IHDR')
+    if header is None:
+        raise ValueError("PNG without IHDR")
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header)
+    raw = zlib.decompress(b''.join(body for chunk_type, body in chunks if chunk_type == b'IDAT'))
+
+    candidates = [_compress_best(raw)]
+    # Sub-byte pixel formats are only recompressed, not refiltered
+    if interlace == 0 and color_type in PNG_CHANNELS and bit_depth >= 8:
+        bpp = PNG_CHANNELS[color_type] * bit_depth // 8
+        rows = unfilter_scanlines(raw, width, height, bpp)
+        for adaptive in (False, True):
+            candidates.append(_compress_best(refilter_scanlines(rows, bpp, adaptive)))
+    idat = min(candidates, key=len)
+
+    out = [PNG_SIGNATURE]
+    idat_written = False
+    for chunk_type, body in chunks:
+        if chunk_type in PNG_DROP_CHUNKS:
+            continue
+        if chunk_type == b'IDAT':
+            if not idat_written:
+                out.append(png_chunk(b'IDAT', idat))
+                idat_written = True
+            continue
+        out.append(png_chunk(chunk_type, body))
+    optimized = b''.join(out)
+    return optimized if len(optimized) < len(data) else data
+
+
+# -- pipeline -----------------------------------------------------------------
+
+def build_variants(source_path, variants_path=VARIANTS_PATH):
+    """Create the variants of one PNG (runs in a worker process)
+
+    Returns the manifest entry for the source.
+    """
+    stat = os.stat(source_path)
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    entry = {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'pipeline': PIPELINE_VERSION,
+        'variants': {}
+    }
+    base = os.path.join(variants_path, source_path)
+
+    try:
+        optimized = optimize_png(data)
+    except (ValueError, zlib.error) as e:
+        entry['error'] = f'png: {e}'
+        optimized = data
+    if len(optimized) < len(data):
+        replace_file(base, optimized)
+        entry['variants']['image/png'] = {'path': base, 'size': len(optimized)}
+
+    if WEBP_SUPPORTED:
+        try:
+            from PIL import Image
+            webp = io.BytesIO()
+            with Image.open(source_path) as image:
+                image.save(webp, 'WEBP', lossless=True, quality=100, method=6)
+            webp = webp.getvalue()
+            if len(webp) < len(optimized):
+                replace_file(base + '.webp', webp)
+                entry['variants']['image/webp'] = {'path': base + '.webp', 'size': len(webp)}
+            elif os.path.exists(base + '.webp'):
+                os.remove(base + '.webp')
+        except Exception as e:
+            entry['error'] = f'webp: {e}'
+    return entry
+
+
+def accepts(accept_header, content_type):
+    """True if the Accept header allows content_type with a non-zero q"""
+    for part in accept_header.split(','):
+        fields = [field.strip() for field in part.split(';')]
+        if fields[0] != content_type:
+            continue
+        for field in fields[1:]:
+            if field.startswith('q='):
+                try:
+                    return float(field[2:]) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def source_images(root=ASSETS_PATH):
+    """Relative paths of all PNG files below root"""
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        sources.extend(
+            os.path.join(dirpath, name).replace('\\', '/')
+            for name in sorted(filenames) if name.lower().endswith('.png')
+        )
+    return sources
+
+
+class ImageVariants:
+    """Manifest of the optimized variants and the queue that produces them"""
+
+    def __init__(self, variants_path=VARIANTS_PATH, workers=None):
+        self.variants_path = variants_path
+        self.manifest_path = os.path.join(variants_path, MANIFEST_FILE)
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._manifest_mtime = None
+        # Entries recorded since the last save; kept when the file is reloaded
+        self._unsaved = {}
+        self._executor = None
+        self._pending = set()
+
+    def _load(self):
+        """The manifest, reloaded if another process rewrote the file (caller holds _lock)
+
+        Entries recorded here but not saved yet are merged into the reloaded one.
+        """
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self._manifest is None or (mtime is not None and mtime != self._manifest_mtime):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    images = json.load(f).get('images', {})
+            except (OSError, ValueError):
+                images = {}
+            images.update(self._unsaved)
+            self._manifest = images
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def manifest(self):
+        """Source path -> entry; reloaded when the file was rewritten by another process
+
+        For lookups: the dict is changed (under the lock) as variants are built.
+        """
+        with self._lock:
+            return self._load()
+
+    def save_manifest(self):
+        # The file lock keeps the CLI and the server from overwriting each other's entries
+        with file_locks.locked(self.manifest_path), self._lock:
+            data = json.dumps({'pipeline': PIPELINE_VERSION, 'images': self._load()}, indent=1, sort_keys=True)
+            replace_file(self.manifest_path, data)
+            self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+            self._unsaved.clear()
+
+    def is_current(self, source_path, entry=None):
+        """True if the manifest entry still matches the source file"""
+        entry = entry or self.manifest().get(source_path)
+        if not entry or entry.get('pipeline') != PIPELINE_VERSION:
+            return False
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        return entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+
+    def variant_for(self, source_path, accept_header):
+        """(path, content type) of the best variant the client accepts, or None"""
+        source_path = os.path.normpath(source_path).replace('\\', '/')
+        entry = self.manifest().get(source_path)
+        if entry is None or not self.is_current(source_path, entry):
+            return None
+        variants = entry['variants']
+        if 'image/webp' in variants and accepts(accept_header or '', 'image/webp'):
+            candidate = variants['image/webp']
+            if os.path.exists(candidate['path']):
+                return candidate['path'], 'image/webp'
+        if 'image/png' in variants and os.path.exists(variants['image/png']['path']):
+            return variants['image/png']['path'], 'image/png'
+        return None
+
+    def stale_sources(self, root=ASSETS_PATH):
+        """Source PNGs without an up-to-date manifest entry"""
+        return [path for path in source_images(root) if not self.is_current(path)]
+
+    def _record(self, source_path, entry):
+        with self._lock:
+            self._pending.discard(source_path)
+            self._load()[source_path] = entry
+            self._unsaved[source_path] = entry
+
+    def _prune(self):
+        """Drop entries (and files) of sources that no longer exist"""
+        with self._lock:
+            manifest = self._load()
+            removed = []
+            for source_path in [path for path in manifest if not os.path.exists(path)]:
+                removed.append(manifest.pop(source_path))
+                self._unsaved.pop(source_path, None)
+        for entry in removed:
+            for variant in entry['variants'].values():
+                try:
+                    os.remove(variant['path'])
+                except OSError:
+                    pass
+
+    def build(self, sources=None, force=False, workers=None):
+        """Process sources (default: every stale PNG) in a process pool"""
+        if sources is None:
+            sources = source_images() if force else self.stale_sources()
+        elif not force:
+            sources = [path for path in sources if not self.is_current(path)]
+
+        results = {'processed': 0, 'failed': 0, 'bytesBefore': 0, 'bytesAfter': 0}
+        if sources:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers or self.workers) as pool:
+                futures = {path: pool.submit(build_variants, path, self.variants_path) for path in sources}
+                for path, future in futures.items():
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        print(f"[Images] Failed to process {path}: {e}")
+                        results['failed'] += 1
+                        continue
+                    self._record(path, entry)
+                    results['processed'] += 1
+                    results['bytesBefore'] += entry['size']
+                    results['bytesAfter'] += min([entry['size']] + [v['size'] for v in entry['variants'].values()])
+        self._prune()
+        self.save_manifest()
+        return results
+
+    def enqueue(self, source_path):
+        """Queue one (new or changed) source for background processing"""
+        source_path = os.path.normpath(source_path).replace('\\', '/')
+        if not source_path.lower().endswith('.png'):
+            return
+        with self._lock:
+            if source_path in self._pending:
+                return
+            self._pending.add(source_path)
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.workers or 2)
+            executor = self._executor
+        future = executor.submit(build_variants, source_path, self.variants_path)
+        future.add_done_callback(lambda done: self._queued_done(source_path, done))
+
+    def _queued_done(self, source_path, future):
+        try:
+            entry = future.result()
+        except Exception as e:
+            with self._lock:
+                self._pending.discard(source_path)
+            print(f"[Images] Failed to process {source_path}: {e}")
+            return
+        self._record(source_path, entry)
+        try:
+            self.save_manifest()
+        except OSError as e:
+            print(f"[Images] Could not write manifest: {e}")
+
+    def stats(self):
+        with self._lock:
+            manifest = self._load()
+            return {
+                'images': len(manifest),
+                'webp': sum(1 for entry in manifest.values() if 'image/webp' in entry['variants']),
+                'png': sum(1 for entry in manifest.values() if 'image/png' in entry['variants']),
+                'pending': len(self._pending),
+                'webpSupport': WEBP_SUPPORTED
+            }
+
+
+image_variants = ImageVariants()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build optimized PNG/WebP variants of the asset images')
+    parser.add_argument('paths', nargs='*', help='PNG files to process (default: all stale images under assets/)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='Rebuild variants even if they are up to date')
+    args = parser.parse_args()
+
+    if not WEBP_SUPPORTED:
+        print("[Images] Pillow is not installed - only optimized PNG variants are built")
+    sources = [os.path.normpath(path).replace('\\', '/') for path in args.paths] or None
+    results = image_variants.build(sources, force=args.force, workers=args.workers)
+    saved = results['bytesBefore'] - results['bytesAfter']
+    print(f"[Images] Processed {results['processed']} images ({results['failed']} failed), "
+          f"{results['bytesBefore']} -> {results['bytesAfter']} bytes ({saved} saved)")
+    return 0 if results['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
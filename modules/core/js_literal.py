@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - JS Literals
+Reads the data files written as JavaScript object literals
+
+Item files are ES modules (`export default {...};`, unquoted keys, single
+quoted strings, comments, trailing commas); ability and people files are
+parenthesized JSON (`({...})`). parse_js_data() accepts both and returns
+the first exported/parenthesized value as Python data.
+"""
+
+import re
+import json
+
+_TOKEN = re.compile(r'''
+    (?P<ws>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<punct>[{}\[\]:,()=;])
+''', re.VERBOSE | re.DOTALL)
+
+_CONSTANTS = {'true': True, 'false': False, 'null': None, 'undefined': None}
+# Leading statements skipped before the value
+_PREFIX = re.compile(r'^\s*(?:(?://[^\n]*|/\*.*?\*/)\s*)*'
+                     r'(?:export\s+default\s+|export\s+const\s+[\w$]+\s*=\s*|(?:const|let|var)\s+[\w$]+\s*=\s*)?',
+                     re.DOTALL)
+
+
+def _tokens(text, pos):
+    length = len(text)
+    while pos < length:
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f"Unexpected character {text[pos]!r} at {pos}")
+        pos = match.end()
+        if match.lastgroup != 'ws':
+            yield match.lastgroup, match.group(match.lastgroup), match.start()
+
+
+def _string(token):
+    if token[0] == '"':
+        return json.loads(token)
+    # Single quoted: swap the quoting so json can decode the escapes
+    body = token[1:-1].replace("\\'", "'").replace('"', '\\"')
+    return json.loads(f'"{body}"')
+
+
+class _Parser:
+    def __init__(self, text, pos):
+        self.tokens = _tokens(text, pos)
+        self.current = next(self.tokens, None)
+
+    def advance(self):
+        token = self.current
+        if token is None:
+            raise ValueError("Unexpected end of data")
+        self.current = next(self.tokens, None)
+        return token
+
+    def expect(self, char):
+        kind, value, position = self.advance()
+        if value != char:
+            raise ValueError(f"Expected {char!r} at {position}, got {value!r}")
+
+    def peek(self, char):
+        return self.current is not None and self.current[0] == 'punct' and self.current[1] == char
+
+    def value(self):
+        kind, value, position = self.advance()
+        if kind == 'string':
+            return _string(value)
+        if kind == 'number':
+            number = float(value)
+            return int(number) if re.fullmatch(r'-?\d+', value) else number
+        if kind == 'name':
+            if value in _CONSTANTS:
+                return _CONSTANTS[value]
+            raise ValueError(f"Unsupported expression {value!r} at {position}")
+        if value == '(':
+            result = self.value()
+            self.expect(')')
+            return result
+        if value == '{':
+            result = {}
+            while not self.peek('}'):
+                key_kind, key, key_position = self.advance()
+                if key_kind == 'string':
+                    key = _string(key)
+                elif key_kind not in ('name', 'number'):
+                    raise ValueError(f"Expected a key at {key_position}")
+                self.expect(':')
+                result[key] = self.value()
+                if not self.peek('}'):
+                    self.expect(',')
+            self.advance()
+            return result
+        if value == '[':
+            result = []
+            while not self.peek(']'):
+                result.append(self.value())
+                if not self.peek(']'):
+                    self.expect(',')
+            self.advance()
+            return result
+        raise ValueError(f"Unexpected {value!r} at {position}")
+
+
+def parse_js_data(text):
+    """Python data of a JS/JSON data file; raises ValueError"""
+    stripped = text.strip()
+    # Fast path for the parenthesized JSON files
+    if stripped.startswith('({') and stripped.endswith('})'):
+        try:
+            return json.loads(stripped[1:-1])
+        except ValueError:
+            pass
+    return _Parser(text, _PREFIX.match(text).end()).value()
+
+
+def read_js_data(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return parse_js_data(f.read())
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - JSON Responses
+Encoding, caching and streaming of API JSON bodies
+
+Uses orjson when it is installed and falls back to the json module. Bodies
+of cacheable endpoints are kept pre-encoded, keyed by a data version; large
+bodies are streamed item by item with chunked transfer encoding so only one
+item is held in memory at a time.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Total bytes of pre-encoded bodies kept in memory
+JSON_CACHE_BYTES = 32 * 1024 * 1024
+# Bodies expected to be larger than this are streamed instead of cached
+JSON_CACHE_MAX_ENTRY = 4 * 1024 * 1024
+# Streamed output is written in pieces of about this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def dumps(data):
+    """Encode data as UTF-8 JSON bytes with the fastest available backend"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Non-string keys, integers beyond 64 bit etc.
+            pass
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """Decode JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def read_json_file(file_path):
+    """Load a JSON file"""
+    with open(file_path, 'rb') as f:
+        return loads(f.read())
+
+
+class StreamedList:
+    """JSON array whose items are produced and encoded one at a time"""
+
+    def __init__(self, items):
+        self.items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.count += 1
+            yield item
+
+
+class Deferred:
+    """Value computed when the encoder reaches it (e.g. a count after a StreamedList)"""
+
+    def __init__(self, compute):
+        self.compute = compute
+
+
+class RawJson:
+    """Already encoded JSON bytes, inserted into the output as they are"""
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _is_streamed(value):
+    if isinstance(value, (StreamedList, Deferred, RawJson)):
+        return True
+    if isinstance(value, dict):
+        return any(_is_streamed(item) for item in value.values())
+    return False
+
+
+def iter_encode(value):
+    """Yield the JSON encoding of value in pieces"""
+    if isinstance(value, StreamedList):
+        yield b'['
+        first = True
+        for item in value:
+            if not first:
+                yield b', '
+            first = False
+            yield from iter_encode(item)
+        yield b']'
+    elif isinstance(value, Deferred):
+        yield from iter_encode(value.compute())
+    elif isinstance(value, RawJson):
+        yield value.data
+    elif isinstance(value, dict) and _is_streamed(value):
+        yield b'{'
+        for index, (key, item) in enumerate(value.items()):
+            yield (b', ' if index else b'') + dumps(str(key)) + b': '
+            yield from iter_encode(item)
+        yield b'}'
+    else:
+        yield dumps(value)
+
+
+def encode(value):
+    """Encode a value that may contain streamed parts into one bytes object"""
+    if _is_streamed(value):
+        return b''.join(iter_encode(value))
+    return dumps(value)
+
+
+def files_stamp(*roots, extensions=None):
+    """Cheap (version, total bytes) stamp for a set of files from names, sizes and mtimes"""
+    digest = hashlib.sha1()
+    total_bytes = 0
+    for root in roots:
+        if os.path.isfile(root):
+            candidates = [root]
+        else:
+            candidates = []
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                candidates.extend(os.path.join(dirpath, name) for name in sorted(filenames))
+        for path in candidates:
+            if extensions and not path.endswith(extensions):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            digest.update(f'{path}\0{stat.st_mtime_ns}\0{stat.st_size}\n'.encode('utf-8'))
+            total_bytes += stat.st_size
+    return digest.hexdigest()[:16], total_bytes
+
+
+class JsonResponseCache:
+    """LRU cache of encoded response bodies keyed by (key, version)"""
+
+    def __init__(self, max_bytes=JSON_CACHE_BYTES, max_entry=JSON_CACHE_MAX_ENTRY):
+        self.max_bytes = max_bytes
+        self.max_entry = max_entry
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, body):
+        if len(body) > self.max_entry:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (version, body)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+json_cache = JsonResponseCache()
+
+
+def send_json_body(handler, body, status=200, headers=None):
+    """Send an already encoded JSON body"""
+    handler.send_response(status)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Content-Length', str(len(body)))
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def send_json(handler, data, status=200, headers=None):
+    """Encode and send a JSON response"""
+    send_json_body(handler, encode(data), status, headers)
+
+
+def send_json_stream(handler, data, status=200, headers=None):
+    """Stream a JSON response piece by piece
+
+    Uses chunked transfer encoding where the connection speaks HTTP/1.1,
+    otherwise the body is delimited by closing the connection.
+    """
+    chunked = handler.request_version == 'HTTP/1.1' and handler.protocol_version == 'HTTP/1.1'
+    handler.send_response(status)
+    handler.send_header('Content-Type', 'application/json')
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    if chunked:
+        handler.send_header('Transfer-Encoding', 'chunked')
+    else:
+        handler.send_header('Connection', 'close')
+    handler.end_headers()
+
+    def write(piece):
+        if chunked:
+            handler.wfile.write(b'%x\r\n' % len(piece) + piece + b'\r\n')
+        else:
+            handler.wfile.write(piece)
+
+    try:
+        buffer = bytearray()
+        for piece in iter_encode(data):
+            buffer += piece
+            if len(buffer) >= STREAM_CHUNK_SIZE:
+                write(bytes(buffer))
+                buffer.clear()
+        if buffer:
+            write(bytes(buffer))
+        if chunked:
+            handler.wfile.write(b'0\r\n\r\n')
+    except Exception as e:
+        # Headers are gone already; drop the connection so the client sees
+        # a truncated body instead of a corrupt one
+        print(f"[Server] Error while streaming JSON: {e}")
+        handler.close_connection = True
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == tag:
+            return True
+    return False
+
+
+def accepts_gzip(header):
+    """True if an Accept-Encoding header allows gzip"""
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            params = params.strip().lower()
+            try:
+                return not (params.startswith('q=') and float(params[2:] or 0) == 0)
+            except ValueError:
+                return False
+    return False
+
+
+def gzip_etag(etag):
+    """ETag of the gzip-encoded variant of a response (suffix -gz inside the quotes)"""
+    return etag[:-1] + '-gz"' if etag.endswith('"') else etag + '-gz'
+
+
+def variant_etag(handler, etag):
+    """ETag of the variant a request gets of a compressible body with the given ETag"""
+    return gzip_etag(etag) if accepts_gzip(handler.headers.get('Accept-Encoding')) else etag
+
+
+def send_cached_json(handler, key, version, build, headers=None, size_hint=0):
+    """Send the body cached for (key, version), building it on a miss
+
+    build() returns the response data. Responses expected to exceed the
+    cache entry limit (size_hint, in bytes) are streamed and not cached.
+    If-None-Match is compared against the ETag of the variant the client
+    gets: buffered bodies may be gzipped by the middleware.
+    """
+    headers = dict(headers or {})
+    headers.setdefault('ETag', f'"{key}-{version}"')
+    streamed = size_hint > json_cache.max_entry
+    etag = headers['ETag'] if streamed else variant_etag(handler, headers['ETag'])
+    if etag_matches(handler.headers.get('If-None-Match'), etag):
+        if etag != headers['ETag']:
+            headers.update({'ETag': etag, 'Vary': 'Accept-Encoding'})
+        handler.send_response(304)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        return
+    body = json_cache.get(key, version)
+    if body is None:
+        if streamed:
+            send_json_stream(handler, build(), headers=headers)
+            return
+        body = encode(build())
+        json_cache.put(key, version, body)
+    send_json_body(handler, body, headers=headers)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map Analysis
+Statistics and validation of saved hex maps
+
+Tiles are fed in one at a time (while a map is being saved or streamed
+from disk) and packed into flat arrays in batches: one 64-bit coordinate
+key plus small type/biome/layer codes per tile. Histograms and bounds are
+folded in per batch; duplicate coordinates and orphaned streets are found
+at the end with set operations over the packed keys. NumPy is used when
+it is installed, otherwise the C-implemented Counter/set/min/max builtins.
+"""
+
+from array import array
+from itertools import compress
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from map_engine import HEX_DIRECTIONS, tile_fields
+from request_body import JsonStream
+
+# Tiles packed per batch
+BATCH_SIZE = 64 * 1024
+# Coordinates are packed as (q + BIAS) << 31 | (r + BIAS)
+COORD_BIAS = 1 << 30
+TERRAIN_LAYER = 'terrain'
+STREETS_LAYER = 'streets'
+# Example coordinates listed per finding
+SAMPLE_SIZE = 20
+
+
+def pack(q, r):
+    return ((q + COORD_BIAS) << 31) | (r + COORD_BIAS)
+
+
+def unpack(key):
+    return (key >> 31) - COORD_BIAS, (key & ((1 << 31) - 1)) - COORD_BIAS
+
+
+# Key offsets of the six neighbours
+NEIGHBOUR_OFFSETS = tuple((dq << 31) + dr for dq, dr in HEX_DIRECTIONS)
+
+
+class MapAnalyzer:
+    """Accumulates the tiles of one map; finish() returns the analysis"""
+
+    def __init__(self):
+        self._names = {'type': {}, 'biome': {}, 'layer': {}}
+        self._batch = self._new_batch()
+        self._keys = array('q')
+        self._layers = array('H')
+        self._histograms = {'type': Counter(), 'biome': Counter(), 'layer': Counter()}
+        self._bounds = None
+        self.entries = 0
+        self.invalid = 0
+
+    @staticmethod
+    def _new_batch():
+        return {'key': array('q'), 'type': array('H'), 'biome': array('H'), 'layer': array('H')}
+
+    def _code(self, kind, name):
+        codes = self._names[kind]
+        if name is not None and not isinstance(name, str):
+            name = str(name)
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(codes)
+        return code
+
+    def add(self, entry, layer=None):
+        """Add one saved tile; `layer` overrides the tile's own layer field"""
+        self.entries += 1
+        fields = tile_fields(entry)
+        if fields is None or not all(-COORD_BIAS <= value < COORD_BIAS for value in fields[:2]):
+            self.invalid += 1
+            return
+        q, r, tile_type, biome = fields
+        if layer is None:
+            tile = entry[1] if isinstance(entry, list) else entry
+            layer = tile.get('layer') or TERRAIN_LAYER
+        batch = self._batch
+        batch['key'].append(pack(q, r))
+        batch['type'].append(self._code('type', tile_type))
+        batch['biome'].append(self._code('biome', biome))
+        batch['layer'].append(self._code('layer', layer))
+        if len(batch['key']) >= BATCH_SIZE:
+            self._flush()
+
+    def add_packed(self, keys, codes, names, layer=TERRAIN_LAYER):
+        """Add a batch of tiles that is already packed
+
+        keys is an array('q') of pack(q, r) values, codes a bytes-like of one
+        code per tile indexing names, a list of (type, biome) pairs.
+        """
+        self._flush()
+        type_codes = [self._code('type', tile_type) for tile_type, _ in names]
+        biome_codes = [self._code('biome', biome) for _, biome in names]
+        batch = self._new_batch()
+        batch['key'] = keys
+        if np is not None:
+            indexes = np.frombuffer(codes, dtype=np.uint8)
+            batch['type'].frombytes(np.array(type_codes, dtype=np.uint16)[indexes].tobytes())
+            batch['biome'].frombytes(np.array(biome_codes, dtype=np.uint16)[indexes].tobytes())
+        else:
+            batch['type'] = array('H', map(type_codes.__getitem__, codes))
+            batch['biome'] = array('H', map(biome_codes.__getitem__, codes))
+        batch['layer'] = array('H', [self._code('layer', layer)]) * len(keys)
+        self.entries += len(keys)
+        self._batch = batch
+        self._flush()
+
+    def _flush(self):
+        batch = self._batch
+        if not batch['key']:
+            return
+        self._batch = self._new_batch()
+        keys = batch['key']
+
+        if np is not None:
+            packed = np.frombuffer(keys, dtype=np.int64)
+            for kind in ('type', 'biome', 'layer'):
+                counts = np.bincount(np.frombuffer(batch[kind], dtype=np.uint16))
+                for code in np.nonzero(counts)[0].tolist():
+                    self._histograms[kind][code] += int(counts[code])
+            qs = packed >> 31
+            rs = packed & ((1 << 31) - 1)
+            bounds = (int(qs.min()), int(qs.max()), int(rs.min()), int(rs.max()))
+        else:
+            for kind in ('type', 'biome', 'layer'):
+                self._histograms[kind].update(batch[kind])
+            rs = [key & ((1 << 31) - 1) for key in keys]
+            bounds = (min(keys) >> 31, max(keys) >> 31, min(rs), max(rs))
+
+        self._keys.extend(keys)
+        self._layers.extend(batch['layer'])
+        if self._bounds is None:
+            self._bounds = bounds
+        else:
+            self._bounds = (min(self._bounds[0], bounds[0]), max(self._bounds[1], bounds[1]),
+                            min(self._bounds[2], bounds[2]), max(self._bounds[3], bounds[3]))
+
+    def _layer_keys(self, layer):
+        """Packed keys of one layer's tiles"""
+        code = self._names['layer'].get(layer)
+        if np is not None:
+            keys = np.frombuffer(self._keys, dtype=np.int64)
+            if code is None:
+                return keys[:0]
+            if len(self._names['layer']) == 1:
+                return keys
+            return keys[np.frombuffer(self._layers, dtype=np.uint16) == code]
+        if code is None:
+            return array('q')
+        if len(self._names['layer']) == 1:
+            return self._keys
+        return array('q', compress(self._keys, map(code.__eq__, self._layers)))
+
+    def _duplicates(self):
+        """(extra entries, sample) of coordinates used twice within a layer"""
+        count = 0
+        sample = []
+        for layer in self._names['layer']:
+            keys = self._layer_keys(layer)
+            if np is not None:
+                unique, counts = np.unique(keys, return_counts=True)
+                count += int(len(keys) - len(unique))
+                repeated = unique[counts > 1][:SAMPLE_SIZE].tolist()
+            else:
+                unique = set(keys)
+                count += len(keys) - len(unique)
+                repeated = sorted(key for key, seen in Counter(keys).items() if seen > 1)[:SAMPLE_SIZE] \
+                    if len(keys) != len(unique) else []
+            sample.extend([*unpack(key), layer] for key in repeated)
+        return count, sample[:SAMPLE_SIZE]
+
+    def _orphaned_streets(self):
+        """Streets without terrain below them, and streets with no street neighbour"""
+        streets = self._layer_keys(STREETS_LAYER)
+        if not len(streets):
+            return {'withoutTerrain': 0, 'isolated': 0, 'sample': []}
+        terrain = self._layer_keys(TERRAIN_LAYER)
+        if np is not None:
+            streets = np.unique(streets)
+            floating = streets[~np.isin(streets, terrain)]
+            connected = np.zeros(len(streets), dtype=bool)
+            for offset in NEIGHBOUR_OFFSETS:
+                connected |= np.isin(streets + offset, streets)
+            isolated = streets[~connected]
+            floating_count, isolated_count = len(floating), len(isolated)
+            sample = sorted(set(floating[:SAMPLE_SIZE].tolist()) | set(isolated[:SAMPLE_SIZE].tolist()))
+        else:
+            street_set = set(streets)
+            floating = street_set.difference(terrain)
+            neighbours = set()
+            for offset in NEIGHBOUR_OFFSETS:
+                neighbours.update(key - offset for key in street_set)
+            isolated = street_set - neighbours
+            floating_count, isolated_count = len(floating), len(isolated)
+            sample = sorted(floating | isolated)
+        return {
+            'withoutTerrain': floating_count,
+            'isolated': isolated_count,
+            'sample': [list(unpack(key)) for key in sample[:SAMPLE_SIZE]]
+        }
+
+    def finish(self, declared_count=None):
+        """The analysis of all tiles added so far"""
+        self._flush()
+        names = {kind: {code: name for name, code in codes.items()} for kind, codes in self._names.items()}
+        histograms = {
+            kind: dict(sorted(((names[kind][code] if names[kind][code] is not None else 'none', count)
+                               for code, count in counter.items()), key=lambda item: (-item[1], item[0])))
+            for kind, counter in self._histograms.items()
+        }
+        layers = histograms['layer']
+        tiles = layers.get(TERRAIN_LAYER, 0)
+        duplicate_count, duplicate_sample = self._duplicates()
+        orphans = self._orphaned_streets()
+
+        analysis = {
+            'tiles': tiles,
+            'entries': self.entries,
+            'layers': layers,
+            'biomes': histograms['biome'],
+            'types': histograms['type'],
+            'bounds': None,
+            'duplicates': {'count': duplicate_count, 'sample': duplicate_sample},
+            'orphanedStreets': orphans,
+            'invalidTiles': self.invalid
+        }
+        if self._bounds is not None:
+            q_min, q_max, r_min, r_max = self._bounds
+            analysis['bounds'] = {
+                'qMin': q_min - COORD_BIAS, 'qMax': q_max - COORD_BIAS,
+                'rMin': r_min - COORD_BIAS, 'rMax': r_max - COORD_BIAS,
+                'width': q_max - q_min + 1, 'height': r_max - r_min + 1
+            }
+
+        issues = []
+        if duplicate_count:
+            issues.append(f'{duplicate_count} tiles share a coordinate with another tile of their layer')
+        if orphans['withoutTerrain']:
+            issues.append(f"{orphans['withoutTerrain']} street tiles have no terrain tile below them")
+        if orphans['isolated']:
+            issues.append(f"{orphans['isolated']} street tiles are not connected to another street")
+        if self.invalid:
+            issues.append(f'{self.invalid} tiles have no valid position')
+        if declared_count is not None and declared_count != tiles:
+            analysis['declaredTilesCount'] = declared_count
+            issues.append(f'tilesCount was {declared_count}, the map has {tiles} tiles')
+        analysis['issues'] = issues
+        analysis['valid'] = not issues
+        return analysis
+
+
+def feed_map_data(stream, analyzer):
+    """Feed the tiles of a map "data" value from a JsonStream into the analyzer
+
+    Reads data.tiles (terrain, or each tile's own layer) and data.layers
+    ({layer: [tiles]}); other keys are skipped.
+    """
+    for key in stream.iter_object():
+        if key == 'tiles' and stream.peek() in ('[', '{'):
+            members = stream.iter_array() if stream.peek() == '[' else stream.iter_object()
+            for _ in members:
+                analyzer.add(stream.value())
+        elif key == 'layers' and stream.peek() == '{':
+            for layer in stream.iter_object():
+                if stream.peek() != '[':
+                    stream.skip()
+                    continue
+                for _ in stream.iter_array():
+                    analyzer.add(stream.value(), layer)
+        else:
+            stream.skip()
+
+
+def analyze_file(file_path):
+    """Analysis of a saved map file, streamed from disk"""
+    analyzer = MapAnalyzer()
+    declared = None
+    with open(file_path, 'rb') as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key == 'data' and stream.peek() == '{':
+                feed_map_data(stream, analyzer)
+            elif key == 'tilesCount':
+                declared = stream.value()
+            else:
+                stream.skip()
+    if not isinstance(declared, int) or isinstance(declared, bool):
+        declared = None
+    return analyzer.finish(declared)
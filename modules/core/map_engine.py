@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map Engine
+Server-side queries on saved hex maps
+
+A map is loaded once into a compact axial grid: flat arrays over the
+bounding box of its tiles holding a type code and a biome code per cell
+(0 = no tile). The grid has an empty border, so the six neighbours of a
+cell are fixed index offsets and need no bounds checks. Neighbourhood and
+distance follow hexMapEditor/core/core.js.
+
+Region selection, cost tables and connected-component labelling are
+vectorized with NumPy when it is installed; the pure-Python fallbacks
+return the same results.
+"""
+
+import os
+import heapq
+import threading
+from array import array
+from collections import deque, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from request_body import JsonStream
+
+# Axial neighbour offsets (dq, dr), as in hexMapEditor/core/core.js
+HEX_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1))
+# Movement cost of entering a tile, by biome name or tile type; None is impassable
+DEFAULT_MOVEMENT_COSTS = {
+    'grass': 1, 'building': 1, 'forest': 2, 'desert': 2, 'swamp': 3, 'snow': 3,
+    'mountain': 4, 'mountains': 4, 'water': None, 'ocean': None, 'void': None
+}
+DEFAULT_COST = 1
+# Largest bounding box (in cells) a map may span; a quarter of it without
+# NumPy, where labelling and cost tables visit every cell in Python
+MAX_GRID_CELLS = 64 * 1024 * 1024 if np is not None else 16 * 1024 * 1024
+MAX_RADIUS = 1024
+# Tiles listed per response unless the query asks for fewer
+MAX_RESULT_TILES = 10000
+# Loaded grids kept in memory
+GRID_CACHE_SIZE = 4
+
+VECTORIZED = np is not None
+
+
+class QueryError(ValueError):
+    """An invalid map query (answered with 400)"""
+
+
+def hex_distance(q1, r1, q2, r2):
+    dq = q1 - q2
+    dr = r1 - r2
+    return max(abs(dq), abs(dr), abs(dq + dr))
+
+
+def tile_fields(entry):
+    """(q, r, type, biome) of a saved tile, or None if it has no position
+
+    Accepts the editor's [key, {position: {q, r}, type, biomeName}] pairs as
+    well as plain tile objects with position or q/r.
+    """
+    if isinstance(entry, list) and len(entry) == 2:
+        entry = entry[1]
+    if not isinstance(entry, dict):
+        return None
+    position = entry.get('position') if isinstance(entry.get('position'), dict) else entry
+    q = position.get('q')
+    r = position.get('r')
+    if not isinstance(q, (int, float)) or not isinstance(r, (int, float)) or isinstance(q, bool):
+        return None
+    return int(q), int(r), entry.get('type'), entry.get('biomeName') or entry.get('biome')
+
+
+def iter_map_tiles(file_path):
+    """Yield the tiles of a map file one at a time, without loading the file"""
+    with open(file_path, 'rb') as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key != 'data' or stream.peek() != '{':
+                stream.skip()
+                continue
+            for data_key in stream.iter_object():
+                if data_key != 'tiles' or stream.peek() not in ('[', '{'):
+                    stream.skip()
+                elif stream.peek() == '[':
+                    for _ in stream.iter_array():
+                        yield stream.value()
+                else:
+                    for _ in stream.iter_object():
+                        yield stream.value()
+
+
+class _Codes:
+    """name -> small integer code, 1-based (0 marks "no tile")"""
+
+    def __init__(self):
+        self.names = []
+        self._codes = {}
+
+    def code(self, name):
+        code = self._codes.get(name)
+        if code is None:
+            self.names.append(name)
+            code = self._codes[name] = len(self.names)
+        return code
+
+    def lookup(self, name):
+        return self._codes.get(name)
+
+    def name(self, code):
+        return self.names[code - 1]
+
+
+class HexGrid:
+    """Array-backed axial grid of one map"""
+
+    def __init__(self, tiles):
+        qs = array('i')
+        rs = array('i')
+        type_codes = array('H')
+        biome_codes = array('H')
+        self.types = _Codes()
+        self.biomes = _Codes()
+        for entry in tiles:
+            fields = tile_fields(entry)
+            if fields is None:
+                continue
+            q, r, tile_type, biome = fields
+            qs.append(q)
+            rs.append(r)
+            type_codes.append(self.types.code(tile_type))
+            biome_codes.append(self.biomes.code(biome))
+
+        if qs:
+            q_min, q_max, r_min, r_max = min(qs), max(qs), min(rs), max(rs)
+        else:
+            q_min = r_min = 0
+            q_max = r_max = -1
+        # One empty cell of border on every side
+        self.q_min = q_min - 1
+        self.r_min = r_min - 1
+        self.width = q_max - q_min + 3
+        self.height = r_max - r_min + 3
+        cells = self.width * self.height
+        if cells > MAX_GRID_CELLS:
+            raise QueryError(f"Map spans {cells} cells (limit {MAX_GRID_CELLS})")
+        self.offsets = tuple(dq + dr * self.width for dq, dr in HEX_DIRECTIONS)
+
+        if VECTORIZED:
+            index = (np.frombuffer(rs, dtype=np.int32).astype(np.int64) - self.r_min) * self.width \
+                + (np.frombuffer(qs, dtype=np.int32) - self.q_min)
+            self.cell_type = np.zeros(cells, dtype=np.uint16)
+            self.cell_biome = np.zeros(cells, dtype=np.uint16)
+            # Later tiles win on duplicate coordinates, as in the editor's Map
+            self.cell_type[index] = np.frombuffer(type_codes, dtype=np.uint16)
+            self.cell_biome[index] = np.frombuffer(biome_codes, dtype=np.uint16)
+            self.tile_count = int(np.count_nonzero(self.cell_type))
+        else:
+            self.cell_type = array('H', bytes(2 * cells))
+            self.cell_biome = array('H', bytes(2 * cells))
+            width = self.width
+            for q, r, tile_type, biome in zip(qs, rs, type_codes, biome_codes):
+                index = (r - self.r_min) * width + (q - self.q_min)
+                self.cell_type[index] = tile_type
+                self.cell_biome[index] = biome
+            self.tile_count = sum(1 for code in self.cell_type if code)
+        self.duplicates = len(qs) - self.tile_count
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    # -- cells ----------------------------------------------------------------
+
+    def index(self, q, r):
+        """Cell index of (q, r); None outside the grid"""
+        column = q - self.q_min
+        row = r - self.r_min
+        if 0 <= column < self.width and 0 <= row < self.height:
+            return row * self.width + column
+        return None
+
+    def coords(self, index):
+        return index % self.width + self.q_min, index // self.width + self.r_min
+
+    def tile(self, index):
+        q, r = self.coords(index)
+        return {
+            'q': q, 'r': r,
+            'type': self.types.name(int(self.cell_type[index])),
+            'biome': self.biomes.name(int(self.cell_biome[index]))
+        }
+
+    def _key(self, by):
+        if by == 'type':
+            return self.cell_type, self.types
+        if by == 'biome':
+            return self.cell_biome, self.biomes
+        raise QueryError("'by' must be 'type' or 'biome'")
+
+    def _start(self, q, r):
+        index = self.index(q, r)
+        if index is None or not self.cell_type[index]:
+            raise QueryError(f"No tile at {q},{r}")
+        return index
+
+    # -- queries --------------------------------------------------------------
+
+    def radius(self, q, r, radius, types=None, biomes=None):
+        """Indices of the tiles within `radius` steps of (q, r)"""
+        type_codes = None if types is None else {self.types.lookup(name) for name in types} - {None}
+        biome_codes = None if biomes is None else {self.biomes.lookup(name) for name in biomes} - {None}
+        q_lo = max(q - radius, self.q_min)
+        q_hi = min(q + radius, self.q_min + self.width - 1)
+        r_lo = max(r - radius, self.r_min)
+        r_hi = min(r + radius, self.r_min + self.height - 1)
+        if q_lo > q_hi or r_lo > r_hi:
+            return []
+
+        if VECTORIZED:
+            dq = np.arange(q_lo, q_hi + 1) - q
+            dr = np.arange(r_lo, r_hi + 1) - r
+            distance = np.maximum(np.maximum(np.abs(dq)[None, :], np.abs(dr)[:, None]),
+                                  np.abs(dq[None, :] + dr[:, None]))
+            window = (np.arange(r_lo, r_hi + 1) - self.r_min)[:, None] * self.width \
+                + (np.arange(q_lo, q_hi + 1) - self.q_min)[None, :]
+            mask = (distance <= radius) & (self.cell_type[window] != 0)
+            if type_codes is not None:
+                mask &= np.isin(self.cell_type[window], list(type_codes))
+            if biome_codes is not None:
+                mask &= np.isin(self.cell_biome[window], list(biome_codes))
+            return np.sort(window[mask]).tolist()
+
+        found = []
+        for row_r in range(r_lo, r_hi + 1):
+            dr = row_r - r
+            # Hex distance <= radius bounds dq to this range on each row
+            start = max(q_lo, q - radius - min(dr, 0))
+            stop = min(q_hi, q + radius - max(dr, 0))
+            base = (row_r - self.r_min) * self.width - self.q_min
+            for column_q in range(start, stop + 1):
+                index = base + column_q
+                code = self.cell_type[index]
+                if not code or (type_codes is not None and code not in type_codes):
+                    continue
+                if biome_codes is not None and self.cell_biome[index] not in biome_codes:
+                    continue
+                found.append(index)
+        return found
+
+    def labels(self, by='type'):
+        """Connected-component label of every cell (tiles of equal type/biome)
+
+        Cells without a tile keep their own index as label. Labels are
+        cached per grid; with NumPy they are computed by label hooking and
+        pointer jumping over all neighbour pairs at once.
+        """
+        with self._lock:
+            labels = self._labels.get(by)
+            if labels is not None:
+                return labels
+            key, _ = self._key(by)
+            labels = self._label_vectorized(key) if VECTORIZED else self._label_bfs(key)
+            self._labels[by] = labels
+            return labels
+
+    def _label_vectorized(self, key):
+        parent = np.arange(len(key), dtype=np.int64)
+        present = self.cell_type != 0
+        # Each undirected neighbour pair once: (1, 0), (0, 1) and (-1, 1)
+        sources = []
+        targets = []
+        for offset in (1, self.width, self.width - 1):
+            same = present[:-offset] & present[offset:] & (key[:-offset] == key[offset:])
+            a = np.nonzero(same)[0]
+            sources.append(a)
+            targets.append(a + offset)
+        a = np.concatenate(sources)
+        b = np.concatenate(targets)
+        while True:
+            root_a = parent[a]
+            root_b = parent[b]
+            differ = root_a != root_b
+            if not differ.any():
+                return parent
+            low = np.minimum(root_a[differ], root_b[differ])
+            high = np.maximum(root_a[differ], root_b[differ])
+            # Hook every root onto the smallest root it touches, then
+            # compress the trees until each cell points at its root
+            np.minimum.at(parent, high, low)
+            while True:
+                jumped = parent[parent]
+                if np.array_equal(jumped, parent):
+                    break
+                parent = jumped
+
+    def _label_bfs(self, key):
+        # Cell indices fit 32 bits (MAX_GRID_CELLS). A region is labelled from
+        # its first cell, so every other cell of it still holds its own index
+        # until it is reached; that doubles as the visited mark
+        labels = array('i', range(len(key)))
+        cell_type = self.cell_type
+        offsets = self.offsets
+        for start in range(len(key)):
+            if labels[start] != start or not cell_type[start]:
+                continue
+            value = key[start]
+            queue = deque((start,))
+            while queue:
+                index = queue.popleft()
+                for offset in offsets:
+                    neighbour = index + offset
+                    if (labels[neighbour] == neighbour != start and cell_type[neighbour]
+                            and key[neighbour] == value):
+                        labels[neighbour] = start
+                        queue.append(neighbour)
+        return labels
+
+    def flood(self, q, r, by='type'):
+        """Indices of the connected region of equal type/biome containing (q, r)"""
+        start = self._start(q, r)
+        labels = self.labels(by)
+        if VECTORIZED:
+            return np.nonzero(labels == labels[start])[0].tolist()
+        label = labels[start]
+        # Regions are labelled by their first cell, so none starts earlier
+        return [index for index in range(label, len(labels)) if labels[index] == label]
+
+    def components(self, by='type'):
+        """Connected components grouped by type/biome value
+
+        Returns {value: [component sizes, largest first]}.
+        """
+        key, codes = self._key(by)
+        labels = self.labels(by)
+        if VECTORIZED:
+            roots, sizes = np.unique(labels[self.cell_type != 0], return_counts=True)
+            values = key[roots]
+            pairs = zip(values.tolist(), sizes.tolist())
+        else:
+            counts = {}
+            for index, code in enumerate(self.cell_type):
+                if code:
+                    counts[labels[index]] = counts.get(labels[index], 0) + 1
+            pairs = ((key[root], size) for root, size in counts.items())
+
+        groups = {}
+        for code, size in pairs:
+            groups.setdefault(codes.name(code), []).append(size)
+        for sizes in groups.values():
+            sizes.sort(reverse=True)
+        return groups
+
+    def cost_table(self, overrides=None):
+        """Movement cost of entering each cell (inf where impassable)
+
+        Biome names and tile types share one cost table. A tile whose biome
+        has a cost (a default one included, e.g. 'mountains') takes it, so
+        overriding its tile type (e.g. 'mountain') has no effect there.
+        """
+        costs = dict(DEFAULT_MOVEMENT_COSTS)
+        for name, cost in (overrides or {}).items():
+            costs[str(name).lower()] = cost
+
+        def resolve(name):
+            cost = costs.get(str(name).lower(), DEFAULT_COST) if name is not None else DEFAULT_COST
+            if cost is None or not isinstance(cost, (int, float)) or cost <= 0:
+                return float('inf')
+            return float(cost)
+
+        # A biome with a configured cost overrides the tile type's cost
+        type_costs = [float('inf')] + [resolve(name) for name in self.types.names]
+        biome_costs = [float('nan')] + [
+            resolve(name) if name is not None and str(name).lower() in costs else float('nan')
+            for name in self.biomes.names
+        ]
+        if VECTORIZED:
+            by_type = np.asarray(type_costs)[self.cell_type]
+            by_biome = np.asarray(biome_costs)[self.cell_biome]
+            return np.where(np.isnan(by_biome), by_type, by_biome).tolist()
+        return [
+            biome_costs[biome] if biome_costs[biome] == biome_costs[biome] else type_costs[tile_type]
+            for tile_type, biome in zip(self.cell_type, self.cell_biome)
+        ]
+
+    def path(self, start, goal, overrides=None):
+        """Cheapest path (A*) between two tiles; (indices, cost) or (None, None)"""
+        start_index = self._start(*start)
+        goal_index = self._start(*goal)
+        if start_index == goal_index:
+            return [start_index], 0.0
+        costs = self.cost_table(overrides)
+        if costs[goal_index] == float('inf'):
+            return None, None
+        finite = [cost for cost in costs if cost != float('inf')]
+        step = min(finite) if finite else 1.0
+        goal_q, goal_r = goal
+        width = self.width
+        q_min = self.q_min
+        r_min = self.r_min
+
+        def heuristic(index):
+            return hex_distance(index % width + q_min, index // width + r_min, goal_q, goal_r) * step
+
+        best = {start_index: 0.0}
+        came_from = {}
+        frontier = [(heuristic(start_index), 0.0, start_index)]
+        while frontier:
+            _, cost, index = heapq.heappop(frontier)
+            if index == goal_index:
+                path = [index]
+                while index in came_from:
+                    index = came_from[index]
+                    path.append(index)
+                return path[::-1], cost
+            if cost > best.get(index, float('inf')):
+                continue
+            for offset in self.offsets:
+                neighbour = index + offset
+                step_cost = costs[neighbour]
+                if step_cost == float('inf'):
+                    continue
+                new_cost = cost + step_cost
+                if new_cost < best.get(neighbour, float('inf')):
+                    best[neighbour] = new_cost
+                    came_from[neighbour] = index
+                    heapq.heappush(frontier, (new_cost + heuristic(neighbour), new_cost, neighbour))
+        return None, None
+
+
+# -- loading ------------------------------------------------------------------
+
+_grids = OrderedDict()
+_grids_lock = threading.Lock()
+_load_lock = threading.Lock()
+
+
+def load_grid(file_path):
+    """The HexGrid of a map file, cached until the file changes"""
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _grids_lock:
+        cached = _grids.get(file_path)
+        if cached is not None and cached[0] == signature:
+            _grids.move_to_end(file_path)
+            return cached[1]
+    with _load_lock:
+        with _grids_lock:
+            cached = _grids.get(file_path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        grid = HexGrid(iter_map_tiles(file_path))
+        with _grids_lock:
+            _grids[file_path] = (signature, grid)
+            while len(_grids) > GRID_CACHE_SIZE:
+                _grids.popitem(last=False)
+        return grid
+
+
+# -- query parameters -----------------------------------------------------------
+
+def _int(params, name, default=None):
+    value = params.get(name, default)
+    if value is None:
+        raise QueryError(f"Missing parameter '{name}'")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"'{name}' must be an integer")
+
+
+def _position(params, name):
+    """(q, r) from {"q", "r"}, [q, r] or "q,r" """
+    value = params.get(name)
+    if isinstance(value, dict):
+        value = (value.get('q'), value.get('r'))
+    elif isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise QueryError(f"'{name}' must be a position (q,r)")
+    try:
+        return int(value[0]), int(value[1])
+    except (TypeError, ValueError):
+        raise QueryError(f"'{name}' must be a position (q,r)")
+
+
+def _names(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.split(',')
+    if isinstance(value, list):
+        return value
+    raise QueryError(f"'{name}' must be a list of names")
+
+
+def _cost(name, value):
+    """A cost override: a positive number (as number or string), or None for impassable"""
+    if value is None or isinstance(value, str) and value.strip().lower() in ('', 'none', 'null'):
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise QueryError(f"Invalid cost for {name}")
+    try:
+        cost = float(value)
+    except ValueError:
+        raise QueryError(f"Invalid cost for {name}")
+    if not cost > 0:
+        raise QueryError(f"Cost for {name} must be positive (or none for impassable)")
+    return cost
+
+
+def _costs(params):
+    """Cost overrides from {"forest": 3} or "forest:3,water:none" """
+    value = params.get('costs')
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return {str(name): _cost(name, cost) for name, cost in value.items()}
+    if not isinstance(value, str):
+        raise QueryError("'costs' must be an object")
+    costs = {}
+    for part in filter(None, value.split(',')):
+        name, _, cost = part.partition(':')
+        costs[name] = _cost(name, cost)
+    return costs
+
+
+def _tile_list(grid, indices, params):
+    limit = _int(params, 'limit', MAX_RESULT_TILES)
+    if limit < 0:
+        raise QueryError("'limit' must not be negative")
+    limit = min(limit, MAX_RESULT_TILES)
+    return {
+        'count': len(indices),
+        'tiles': [grid.tile(index) for index in indices[:limit]],
+        'truncated': len(indices) > limit
+    }
+
+
+def run_query(grid, params):
+    """Answer one query ({"op": ...} plus its parameters) on a grid"""
+    op = params.get('op')
+    if op == 'radius':
+        q, r = _position(params, 'center') if 'center' in params else (_int(params, 'q'), _int(params, 'r'))
+        radius = _int(params, 'radius')
+        if not 0 <= radius <= MAX_RADIUS:
+            raise QueryError(f"'radius' must be between 0 and {MAX_RADIUS}")
+        indices = grid.radius(q, r, radius, types=_names(params, 'type'), biomes=_names(params, 'biome'))
+        return {'op': op, 'center': {'q': q, 'r': r}, 'radius': radius, **_tile_list(grid, indices, params)}
+
+    if op == 'flood':
+        q, r = _position(params, 'start') if 'start' in params else (_int(params, 'q'), _int(params, 'r'))
+        by = params.get('by', 'type')
+        indices = grid.flood(q, r, by)
+        value = grid.tile(indices[0])[by] if indices else None
+        return {'op': op, 'start': {'q': q, 'r': r}, 'by': by, 'value': value, **_tile_list(grid, indices, params)}
+
+    if op == 'components':
+        by = params.get('by', 'type')
+        groups = grid.components(by)
+        return {
+            'op': op,
+            'by': by,
+            'components': sum(len(sizes) for sizes in groups.values()),
+            'groups': [
+                {'value': value, 'components': len(sizes), 'tiles': sum(sizes),
+                 'largest': sizes[0], 'sizes': sizes[:10]}
+                for value, sizes in sorted(groups.items(), key=lambda item: -sum(item[1]))
+            ]
+        }
+
+    if op == 'path':
+        start = _position(params, 'from')
+        goal = _position(params, 'to')
+        indices, cost = grid.path(start, goal, _costs(params))
+        if indices is None:
+            return {'op': op, 'found': False, 'from': start, 'to': goal}
+        return {
+            'op': op, 'found': True, 'cost': cost, 'length': len(indices) - 1,
+            'path': [list(grid.coords(index)) for index in indices]
+        }
+
+    raise QueryError("'op' must be one of radius, flood, components, path")
+
+
+def grid_stats(grid):
+    return {
+        'tiles': grid.tile_count,
+        'width': grid.width - 2,
+        'height': grid.height - 2,
+        'vectorized': VECTORIZED
+    }
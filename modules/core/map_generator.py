@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map Generator
+Procedural hex maps from a seed
+
+Elevation and moisture are fractal value-noise fields sampled at the tile
+centres (flat-top layout); a lookup table over both fields assigns one of
+the editor's biomes to every tile. The map is split into bands of rows
+that are generated in a process pool, each band returning its tiles as
+text in the save format, and written in order through map_store, so the
+result is the same file /api/maps/save would produce. With NumPy the
+fields are computed for a whole band at once; the pure-Python fallback
+yields the identical map, only slower.
+
+    python modules/core/map_generator.py --name world --width 1000 --height 1000 --seed 42
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import random
+import argparse
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from js_literal import parse_js_data
+from map_analysis import MapAnalyzer, COORD_BIAS
+from map_store import MAPS_PATH, write_map, tile_template
+
+BIOMES_PATH = 'assets/biomes'
+# Largest map one request may generate (WOODCHUNK_MAX_GENERATED_TILES)
+MAX_GENERATED_TILES = int(os.environ.get('WOODCHUNK_MAX_GENERATED_TILES', 4 * 1024 * 1024))
+# Tiles per chunk handed to a worker
+CHUNK_TILES = 64 * 1024
+
+# Biome codes are indexes into BIOMES; tile types as in hexMapEditor/core/types.js
+BIOMES = ('Ocean', 'Water', 'Coast', 'Plain', 'Forest', 'Jungle', 'Swamp',
+          'Desert', 'Badlands', 'Mountains', 'Snow')
+BIOME_TILE_TYPES = {
+    'Ocean': 'water', 'Water': 'water', 'Coast': 'grass', 'Plain': 'grass',
+    'Forest': 'forest', 'Jungle': 'forest', 'Swamp': 'grass', 'Desert': 'desert',
+    'Badlands': 'desert', 'Mountains': 'mountain', 'Snow': 'snow'
+}
+# TileColors of the editor, used when a biome file has no color
+TILE_COLORS = {
+    'grass': '#4CAF50', 'water': '#2196F3', 'mountain': '#795548',
+    'forest': '#388E3C', 'desert': '#FF9800', 'snow': '#FFFFFF',
+    'void': '#000000', 'building': '#8B4513'
+}
+
+# Resolution of the (elevation, moisture) -> biome lookup table
+TABLE_SIZE = 256
+# Raw fractal noise clusters around 0.5; spread it over [0, 1)
+NOISE_CONTRAST = 1.7
+SQRT3 = math.sqrt(3)
+
+DEFAULTS = {
+    'width': 256,
+    'height': 256,
+    'scale': 48.0,
+    'octaves': 5,
+    'seaLevel': 0.45,
+    'moisture': 0.0,
+    'falloff': 0.0
+}
+
+_BIOME_DATA = re.compile(r'window\.BIOME_DATA\s*=\s*(\{.*?\});', re.DOTALL)
+
+
+def read_biome_data(biome, biomes_path=BIOMES_PATH):
+    """window.BIOME_DATA of assets/biomes/<Biome>/<Biome>.js; None if missing or unreadable"""
+    try:
+        with open(os.path.join(biomes_path, biome, f'{biome}.js'), 'r', encoding='utf-8') as f:
+            match = _BIOME_DATA.search(f.read())
+        data = parse_js_data(match.group(1)) if match else None
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def biome_colors(biomes_path=BIOMES_PATH):
+    """Biome -> color from the biome files, falling back to the tile type color"""
+    colors = {}
+    for biome in BIOMES:
+        color = (read_biome_data(biome, biomes_path) or {}).get('color')
+        colors[biome] = color if isinstance(color, str) else TILE_COLORS[BIOME_TILE_TYPES[biome]]
+    return colors
+
+
+def classify(elevation, moisture, sea_level):
+    """Biome of a tile from its elevation and moisture (both in [0, 1))"""
+    if elevation < sea_level - 0.15:
+        return 'Ocean'
+    if elevation < sea_level:
+        return 'Water'
+    if elevation < sea_level + 0.025:
+        return 'Coast'
+    land = (elevation - sea_level) / (1 - sea_level)
+    if land > 0.8:
+        return 'Snow'
+    if land > 0.6:
+        return 'Mountains'
+    if moisture < 0.25:
+        return 'Badlands' if land > 0.35 else 'Desert'
+    if moisture < 0.52:
+        return 'Plain'
+    if moisture < 0.72:
+        return 'Forest'
+    return 'Swamp' if land < 0.12 else 'Jungle'
+
+
+def biome_table(sea_level):
+    """classify() sampled on a TABLE_SIZE x TABLE_SIZE grid, as bytes of biome codes"""
+    codes = {biome: code for code, biome in enumerate(BIOMES)}
+    return bytes(codes[classify((e + 0.5) / TABLE_SIZE, (m + 0.5) / TABLE_SIZE, sea_level)]
+                 for e in range(TABLE_SIZE) for m in range(TABLE_SIZE))
+
+
+# -- Noise ---------------------------------------------------------------------
+
+def _lattice(ix, iy, salt):
+    """Hash of integer lattice points to [0, 1)"""
+    if np is not None and isinstance(ix, np.ndarray):
+        h = ix.astype(np.uint32) * np.uint32(374761393) + iy.astype(np.uint32) * np.uint32(668265263)
+        h += np.uint32(salt)
+        h = (h ^ (h >> np.uint32(13))) * np.uint32(1274126177)
+        h ^= h >> np.uint32(16)
+        return h / 4294967296.0
+    h = ((ix & 0xFFFFFFFF) * 374761393 + (iy & 0xFFFFFFFF) * 668265263 + salt) & 0xFFFFFFFF
+    h = ((h ^ (h >> 13)) * 1274126177) & 0xFFFFFFFF
+    return (h ^ (h >> 16)) / 4294967296.0
+
+
+def _value_noise(x, y, salt):
+    """Smoothly interpolated lattice noise; x and y are arrays (NumPy) or floats"""
+    if np is not None and isinstance(x, np.ndarray):
+        x0 = np.floor(x)
+        y0 = np.floor(y)
+        ix = x0.astype(np.int64)
+        iy = y0.astype(np.int64)
+    else:
+        x0 = math.floor(x)
+        y0 = math.floor(y)
+        ix = int(x0)
+        iy = int(y0)
+    fx = x - x0
+    fy = y - y0
+    sx = fx * fx * (3 - 2 * fx)
+    sy = fy * fy * (3 - 2 * fy)
+    h00 = _lattice(ix, iy, salt)
+    h10 = _lattice(ix + 1, iy, salt)
+    h01 = _lattice(ix, iy + 1, salt)
+    h11 = _lattice(ix + 1, iy + 1, salt)
+    a = h00 + (h10 - h00) * sx
+    b = h01 + (h11 - h01) * sx
+    return a + (b - a) * sy
+
+
+def fractal_noise(x, y, seed, scale, octaves):
+    """Octaves of value noise with halving amplitude, normalized to [0, 1)"""
+    total = 0
+    norm = 0
+    amplitude = 1.0
+    frequency = 1.0 / scale
+    for octave in range(octaves):
+        salt = (seed * 1013 + octave * 7919) & 0xFFFFFFFF
+        total = total + amplitude * _value_noise(x * frequency, y * frequency, salt)
+        norm += amplitude
+        amplitude *= 0.5
+        frequency *= 2.0
+    return total / norm
+
+
+# -- Chunks --------------------------------------------------------------------
+
+def _shape(value):
+    """Noise value spread around 0.5 and clipped to [0, 1)"""
+    value = (value - 0.5) * NOISE_CONTRAST + 0.5
+    if np is not None and isinstance(value, np.ndarray):
+        return np.clip(value, 0, 0.999999)
+    return min(max(value, 0), 0.999999)
+
+
+def generate_chunk(spec):
+    """Tiles of rows [rowStart, rowEnd) as (text, packed keys, biome codes)
+
+    Runs in a worker process. Offset coordinates (col, row) are converted
+    to axial (q, r) with the map centred on (0, 0).
+    """
+    width = spec['width']
+    col0 = -(width // 2)
+    row0 = -(spec['height'] // 2)
+    seed = spec['seed']
+    scale = spec['scale']
+    octaves = spec['octaves']
+    table = spec['table']
+    templates = spec['templates']
+    half_width = max(width / 2, 1)
+    half_height = max(spec['height'] / 2, 1)
+
+    if np is not None:
+        rows = spec['rowEnd'] - spec['rowStart']
+        q = np.tile(np.arange(col0, col0 + width, dtype=np.int64), rows)
+        row = np.repeat(np.arange(spec['rowStart'], spec['rowEnd'], dtype=np.int64), width) + row0
+        r = row - (q - (q & 1)) // 2
+        x = 1.5 * q
+        y = SQRT3 * (r + q / 2)
+        elevation = fractal_noise(x, y, seed, scale, octaves)
+        moisture = fractal_noise(x, y, seed + 1, scale * 1.5, octaves)
+        if spec['falloff']:
+            edge = np.maximum(np.abs(q / half_width), np.abs(row / half_height))
+            elevation = elevation - spec['falloff'] * edge * edge * edge
+        elevation = _shape(elevation)
+        moisture = np.clip(_shape(moisture) + spec['moisture'], 0, 0.999999)
+        index = (elevation * TABLE_SIZE).astype(np.int64) * TABLE_SIZE + (moisture * TABLE_SIZE).astype(np.int64)
+        codes = np.frombuffer(table, dtype=np.uint8)[index]
+        keys = ((q + COORD_BIAS) << 31) | (r + COORD_BIAS)
+        text = ''.join([templates[code] % (tq, tr, tq, tr)
+                        for code, tq, tr in zip(codes.tolist(), q.tolist(), r.tolist())])
+        return text, keys.tobytes(), codes.tobytes()
+
+    keys = array('q')
+    codes = bytearray()
+    parts = []
+    for row in range(spec['rowStart'] + row0, spec['rowEnd'] + row0):
+        for q in range(col0, col0 + width):
+            r = row - (q - (q & 1)) // 2
+            x = 1.5 * q
+            y = SQRT3 * (r + q / 2)
+            elevation = fractal_noise(x, y, seed, scale, octaves)
+            moisture = fractal_noise(x, y, seed + 1, scale * 1.5, octaves)
+            if spec['falloff']:
+                edge = max(abs(q / half_width), abs(row / half_height))
+                elevation = elevation - spec['falloff'] * edge * edge * edge
+            elevation = _shape(elevation)
+            moisture = min(max(_shape(moisture) + spec['moisture'], 0), 0.999999)
+            code = table[int(elevation * TABLE_SIZE) * TABLE_SIZE + int(moisture * TABLE_SIZE)]
+            keys.append(((q + COORD_BIAS) << 31) | (r + COORD_BIAS))
+            codes.append(code)
+            parts.append(templates[code] % (q, r, q, r))
+    return ''.join(parts), keys.tobytes(), bytes(codes)
+
+
+# -- Maps ----------------------------------------------------------------------
+
+def _number(params, name, kind, low, high):
+    value = params.get(name, DEFAULTS.get(name))
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        value = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number")
+    if not low <= value <= high:
+        raise ValueError(f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def generator_options(params):
+    """Validated generator options from request parameters; raises ValueError"""
+    seed = params.get('seed')
+    options = {
+        'seed': random.randrange(2 ** 31) if seed in (None, '') else _number(params, 'seed', int, 0, 2 ** 32 - 1),
+        'width': _number(params, 'width', int, 1, 65536),
+        'height': _number(params, 'height', int, 1, 65536),
+        'scale': _number(params, 'scale', float, 1, 100000),
+        'octaves': _number(params, 'octaves', int, 1, 12),
+        'seaLevel': _number(params, 'seaLevel', float, 0.05, 0.95),
+        'moisture': _number(params, 'moisture', float, -1, 1),
+        'falloff': _number(params, 'falloff', float, 0, 2)
+    }
+    if options['width'] * options['height'] > MAX_GENERATED_TILES:
+        raise ValueError(f"Maps are limited to {MAX_GENERATED_TILES} tiles")
+    name = params.get('name') or f"generated-{options['seed']}"
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("Map name must be a non-empty string")
+    options['name'] = name
+    return options
+
+
+def generate_map(params, maps_path=MAPS_PATH, workers=None, biomes_path=BIOMES_PATH):
+    """Generate a map and write it to the maps directory
+
+    Returns save_map()'s result plus the options used (including the seed)
+    and the elapsed seconds.
+    """
+    started = time.perf_counter()
+    options = generator_options(params)
+    colors = biome_colors(biomes_path)
+    templates = [tile_template(BIOME_TILE_TYPES[biome], colors[biome], biome) for biome in BIOMES]
+    table = biome_table(options['seaLevel'])
+
+    width = options['width']
+    rows_per_chunk = max(1, CHUNK_TILES // width)
+    specs = [
+        {**options, 'table': table, 'templates': templates,
+         'rowStart': start, 'rowEnd': min(start + rows_per_chunk, options['height'])}
+        for start in range(0, options['height'], rows_per_chunk)
+    ]
+
+    analyzer = MapAnalyzer()
+    names = [(BIOME_TILE_TYPES[biome], biome) for biome in BIOMES]
+
+    def tile_chunks(results):
+        for text, key_bytes, codes in results:
+            keys = array('q')
+            keys.frombytes(key_bytes)
+            analyzer.add_packed(keys, codes, names)
+            yield text
+
+    fields = {'name': options['name'], 'settings': {}}
+    if len(specs) == 1 or workers == 1:
+        saved = write_map(fields, tile_chunks(map(generate_chunk, specs)), analyzer, maps_path)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            saved = write_map(fields, tile_chunks(pool.map(generate_chunk, specs)), analyzer, maps_path)
+
+    options.pop('name')
+    saved['options'] = options
+    saved['elapsed'] = round(time.perf_counter() - started, 3)
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a hex map into assets/maps')
+    parser.add_argument('--name', default=None, help='Map name (default: generated-<seed>)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed (default: random)')
+    parser.add_argument('--width', type=int, default=DEFAULTS['width'], help='Columns')
+    parser.add_argument('--height', type=int, default=DEFAULTS['height'], help='Rows')
+    parser.add_argument('--scale', type=float, default=DEFAULTS['scale'], help='Feature size in tiles')
+    parser.add_argument('--sea-level', type=float, default=DEFAULTS['seaLevel'], help='Share of low elevation under water')
+    parser.add_argument('--moisture', type=float, default=DEFAULTS['moisture'], help='Moisture offset (-1 dry .. 1 wet)')
+    parser.add_argument('--falloff', type=float, default=DEFAULTS['falloff'], help='Lower the edges (islands)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    params = {'name': args.name, 'seed': args.seed, 'width': args.width, 'height': args.height,
+              'scale': args.scale, 'seaLevel': args.sea_level, 'moisture': args.moisture, 'falloff': args.falloff}
+    try:
+        saved = generate_map(params, workers=args.workers)
+    except ValueError as e:
+        print(f"[Generator] {e}")
+        return 1
+    print(f"[Generator] {saved['path']}: {saved['tiles']} tiles, seed {saved['options']['seed']}, "
+          f"{saved['elapsed']}s")
+    print(f"[Generator] Biomes: {saved['analysis']['biomes']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
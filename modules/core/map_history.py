@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map History
+Revisions of the saved maps, stored as content-addressed chunks
+
+Every time a map file is written, its content is recorded as a revision.
+The tile arrays (data.tiles and the arrays in data.layers) are cut into
+chunks of about CHUNK_TILES tiles and every chunk is stored once, zlib
+compressed, under the SHA-256 of its content. A chunk ends after a tile
+whose key hashes to a boundary, so editing, adding or removing tiles only
+changes the chunks around them; all other chunks are shared with earlier
+revisions. A revision's tree (the data object with chunk lists in place of
+the tile arrays) is itself an object, and its manifest holds the map's
+small top-level fields.
+
+Recording, pruning (MAX_REVISIONS / MAX_AGE_DAYS per map) and garbage
+collection of chunks no longer referenced by any revision run one after
+another on a single background thread. Manifests are written, pruned and
+read under the lock of the history directory, which also serializes
+servers sharing it (see file_locks).
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import threading
+from datetime import datetime
+
+from request_body import JsonStream
+from map_store import MAPS_PATH, MAP_FIELDS, map_filename, save_map
+from file_locks import file_locks, replace_file
+
+HISTORY_PATH = os.environ.get('WOODCHUNK_MAP_HISTORY', '.history/maps')
+# Retention per map: the newest revisions kept, and (if set) the maximum age
+MAX_REVISIONS = int(os.environ.get('WOODCHUNK_MAP_REVISIONS', 100))
+MAX_AGE_DAYS = float(os.environ.get('WOODCHUNK_MAP_HISTORY_DAYS', 0))
+# Average and maximum number of tiles per chunk
+CHUNK_TILES = 512
+MAX_CHUNK_TILES = 4 * CHUNK_TILES
+# Fields rewritten on every save; they alone do not make a new revision
+VOLATILE_FIELDS = ('timestamp', 'savedAt', 'analysis')
+SAMPLE_SIZE = 20
+# Unreferenced objects younger than this survive a collection: another
+# process may be recording a revision that uses them
+GC_GRACE_SECONDS = 600
+
+MAP_KEY = re.compile(r'[\w\-][\w\-\.]*')
+
+
+def _compact(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _tile_key(line, is_object):
+    """Key of a chunk line: the tile's "q,r" key, or the line itself"""
+    value = json.loads('{' + line + '}' if is_object else line)
+    if is_object:
+        return next(iter(value))
+    if isinstance(value, list) and value and isinstance(value[0], str):
+        return value[0]
+    return line
+
+
+def _tile_nodes(tree, prefix=''):
+    """(path, node) of every chunked tile array in a tree"""
+    for name, node in tree.get('members', ()):
+        path = prefix + name
+        if 'chunks' in node:
+            yield path, node
+        elif 'members' in node:
+            yield from _tile_nodes(node, path + '/')
+
+
+def _chunk_refs(tree):
+    return [digest for _, node in _tile_nodes(tree) for digest in node['chunks']]
+
+
+class _TextReader:
+    """Binary file-like object over an iterator of text pieces (for JsonStream)"""
+
+    def __init__(self, pieces):
+        self._pieces = iter(pieces)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            piece = next(self._pieces, None)
+            if piece is None:
+                break
+            self._buffer += piece.encode('utf-8')
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class MapHistory:
+    """Revisions of every map plus the shared chunk store"""
+
+    def __init__(self, history_path=HISTORY_PATH, maps_path=MAPS_PATH,
+                 max_revisions=MAX_REVISIONS, max_age_days=MAX_AGE_DAYS):
+        self.history_path = history_path
+        self.maps_path = maps_path
+        self.max_revisions = max_revisions
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._objects = None
+        self.recorded = 0
+        self.pruned = 0
+        self.collected = 0
+
+    # Chunk store
+
+    def _object_path(self, digest):
+        return os.path.join(self.history_path, 'objects', digest[:2], digest[2:])
+
+    def _put(self, text):
+        """Store a text object; returns (digest, bytes written, 0 if it existed)"""
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        try:
+            # Reused objects count as new for the collectors' grace period
+            os.utime(path)
+            return digest, 0
+        except FileNotFoundError:
+            pass
+        packed = zlib.compress(data, 6)
+        replace_file(path, packed)
+        with self._lock:
+            if self._objects is not None:
+                self._objects[0] += 1
+                self._objects[1] += len(packed)
+        return digest, len(packed)
+
+    def _get(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def _object_files(self):
+        """(digest or None for temporary files, path, stat) of every stored object"""
+        root = os.path.join(self.history_path, 'objects')
+        try:
+            prefixes = os.listdir(root)
+        except OSError:
+            return
+        for prefix in prefixes:
+            directory = os.path.join(root, prefix)
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield (None if '.tmp' in name else prefix + name), path, stat
+
+    # Revisions
+
+    def map_key(self, filename):
+        """History key of a map file name (with or without .json); None if it is not one"""
+        key = os.path.basename(filename)
+        if key.endswith('.json'):
+            key = key[:-len('.json')]
+        return key if MAP_KEY.fullmatch(key) else None
+
+    def _map_dir(self, map_key):
+        return os.path.join(self.history_path, 'revisions', map_key)
+
+    def _numbers(self, map_key):
+        try:
+            names = os.listdir(self._map_dir(map_key))
+        except OSError:
+            return []
+        return sorted(int(name[:-len('.json')]) for name in names
+                      if name.endswith('.json') and name[:-len('.json')].isdigit())
+
+    def _manifest(self, map_key, revision):
+        path = os.path.join(self._map_dir(map_key), f'{revision:06d}.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise LookupError(f"Revision {revision} of {map_key} not found") from None
+
+    def revisions(self, map_key):
+        """Manifests of a map's revisions (without their fields), newest first"""
+        if self.map_key(map_key) != map_key:
+            return []
+        revisions = []
+        for number in reversed(self._numbers(map_key)):
+            try:
+                manifest = self._manifest(map_key, number)
+            except (LookupError, ValueError):
+                continue
+            manifest.pop('fields', None)
+            revisions.append(manifest)
+        return revisions
+
+    def revision(self, map_key, revision):
+        """Manifest of one revision; raises LookupError if it does not exist"""
+        if self.map_key(map_key) != map_key:
+            raise LookupError(f"No history for {map_key}")
+        return self._manifest(map_key, revision)
+
+    def _read_tiles(self, stream, written):
+        """Chunk a tile array (or object) from the stream into the store"""
+        is_object = stream.peek() == '{'
+        chunks = []
+        lines = []
+        tiles = 0
+
+        def flush():
+            digest, size = self._put('\n'.join(lines))
+            chunks.append(digest)
+            if size:
+                written[0] += 1
+                written[1] += size
+            lines.clear()
+
+        for member in (stream.iter_object() if is_object else stream.iter_array()):
+            value = stream.value()
+            if is_object:
+                key = member
+                line = _compact(member) + ':' + _compact(value)
+            else:
+                key = value[0] if isinstance(value, list) and value and isinstance(value[0], str) else None
+                line = _compact(value)
+            lines.append(line)
+            tiles += 1
+            boundary = zlib.crc32((line if key is None else key).encode('utf-8')) % CHUNK_TILES == 0
+            if boundary or len(lines) >= MAX_CHUNK_TILES:
+                flush()
+        if lines:
+            flush()
+
+        node = {'chunks': chunks, 'tiles': tiles}
+        if is_object:
+            node['object'] = True
+        return node
+
+    def _read_data(self, stream, written):
+        """Tree of a map's "data" value; tile arrays become chunk lists"""
+        if stream.peek() != '{':
+            return {'value': stream.value()}
+        members = []
+        for name in stream.iter_object():
+            if name == 'tiles' and stream.peek() in ('[', '{'):
+                members.append([name, self._read_tiles(stream, written)])
+            elif name == 'layers' and stream.peek() == '{':
+                layers = []
+                for layer in stream.iter_object():
+                    if stream.peek() in ('[', '{'):
+                        layers.append([layer, self._read_tiles(stream, written)])
+                    else:
+                        layers.append([layer, {'value': stream.value()}])
+                members.append([name, {'members': layers}])
+            else:
+                members.append([name, {'value': stream.value()}])
+        return {'members': members}
+
+    def _record(self, map_key, f):
+        started = time.perf_counter()
+        written = [0, 0]
+        fields = {}
+        tree = None
+        with f:
+            stream = JsonStream(f)
+            for key in stream.iter_object():
+                if key == 'data':
+                    tree = self._read_data(stream, written)
+                else:
+                    fields[key] = stream.value()
+        if tree is None:
+            raise ValueError("Map file has no data")
+
+        tree_digest, tree_size = self._put(_compact(tree))
+        stable = {key: value for key, value in fields.items() if key not in VOLATILE_FIELDS}
+        digest = hashlib.sha256(_compact([tree_digest, stable]).encode('utf-8')).hexdigest()
+
+        with file_locks.locked(self.history_path):
+            numbers = self._numbers(map_key)
+            if numbers:
+                latest = self._manifest(map_key, numbers[-1])
+                if latest.get('digest') == digest:
+                    return latest
+            revision = numbers[-1] + 1 if numbers else 1
+            refs = _chunk_refs(tree)
+            manifest = {
+                'revision': revision,
+                'recordedAt': datetime.now().isoformat(),
+                'time': time.time(),
+                'digest': digest,
+                'tree': tree_digest,
+                'name': fields.get('name'),
+                'tiles': sum(node['tiles'] for _, node in _tile_nodes(tree)),
+                'chunks': len(refs),
+                'newChunks': written[0],
+                'newBytes': written[1] + tree_size,
+                'fields': fields
+            }
+            path = os.path.join(self._map_dir(map_key), f'{revision:06d}.json')
+            replace_file(path, json.dumps(manifest, ensure_ascii=False, separators=(',', ':')))
+            self.recorded += 1
+            pruned = self._prune(map_key)
+
+        print(f"[History] {map_key}: revision {revision} ({manifest['chunks']} chunks, "
+              f"{written[0]} new, {manifest['newBytes']} bytes, {time.perf_counter() - started:.2f}s)")
+        if pruned:
+            self._collect()
+        return manifest
+
+    def _prune(self, map_key):
+        """Delete the revisions of a map outside the retention policy (lock held)"""
+        numbers = self._numbers(map_key)
+        drop = set(numbers[:-self.max_revisions] if self.max_revisions > 0 else [])
+        if self.max_age_days > 0:
+            cutoff = time.time() - self.max_age_days * 86400
+            for number in numbers[:-1]:
+                try:
+                    if self._manifest(map_key, number).get('time', 0) < cutoff:
+                        drop.add(number)
+                except (LookupError, ValueError):
+                    continue
+        for number in drop:
+            try:
+                os.remove(os.path.join(self._map_dir(map_key), f'{number:06d}.json'))
+            except OSError:
+                continue
+        self.pruned += len(drop)
+        return len(drop)
+
+    def _collect(self):
+        """Delete the objects no revision refers to; returns (objects, bytes) removed"""
+        with file_locks.locked(self.history_path):
+            referenced = set()
+            root = os.path.join(self.history_path, 'revisions')
+            try:
+                map_keys = os.listdir(root)
+            except OSError:
+                map_keys = []
+            for map_key in map_keys:
+                for number in self._numbers(map_key):
+                    try:
+                        manifest = self._manifest(map_key, number)
+                        tree = json.loads(self._get(manifest['tree']))
+                    except (LookupError, OSError, ValueError, KeyError, zlib.error) as e:
+                        # Keep everything rather than lose chunks of a revision that could not be read
+                        print(f"[History] Skipping collection, {map_key} revision {number} unreadable: {e}")
+                        return 0, 0
+                    referenced.add(manifest['tree'])
+                    referenced.update(_chunk_refs(tree))
+
+            removed = removed_bytes = objects = total_bytes = 0
+            now = time.time()
+            for digest, path, stat in list(self._object_files()):
+                if digest in referenced or now - stat.st_mtime < GC_GRACE_SECONDS:
+                    if digest is not None:
+                        objects += 1
+                        total_bytes += stat.st_size
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed += 1
+                removed_bytes += stat.st_size
+            with self._lock:
+                self._objects = [objects, total_bytes]
+                self.collected += removed
+        if removed:
+            print(f"[History] Collected {removed} unreferenced objects ({removed_bytes} bytes)")
+        return removed, removed_bytes
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='map-history')
+            self._pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+        if not future.cancelled() and future.exception() is not None:
+            print(f"[History] {future.exception()}")
+
+    def record(self, file_path):
+        """Record a map file's current content as a revision, in the background; never raises
+
+        The file is opened right away (map_store calls this with the file's
+        lock held), so a save that replaces it again before the recording
+        starts does not lose this revision. Returns the future of the
+        revision's manifest, or None.
+        """
+        try:
+            map_key = self.map_key(file_path)
+            if map_key is None:
+                return None
+            f = open(file_path, 'rb')
+        except OSError as e:
+            print(f"[History] Could not open {file_path}: {e}")
+            return None
+        try:
+            return self._submit(self._record, map_key, f)
+        except Exception as e:
+            f.close()
+            print(f"[History] Could not queue {file_path}: {e}")
+            return None
+
+    def baseline(self):
+        """Record every map in the maps directory that has no revision yet"""
+        try:
+            names = sorted(os.listdir(self.maps_path))
+        except OSError:
+            return 0
+        queued = 0
+        for name in names:
+            map_key = self.map_key(name)
+            if name.endswith('.json') and map_key and not self._numbers(map_key):
+                queued += self.record(os.path.join(self.maps_path, name)) is not None
+        return queued
+
+    def collect(self):
+        """Apply the retention policy to every map and collect unreferenced chunks"""
+        def run():
+            with file_locks.locked(self.history_path):
+                try:
+                    map_keys = os.listdir(os.path.join(self.history_path, 'revisions'))
+                except OSError:
+                    map_keys = []
+                pruned = sum(self._prune(map_key) for map_key in map_keys)
+            removed, removed_bytes = self._collect()
+            return {'revisionsPruned': pruned, 'objectsRemoved': removed, 'bytesRemoved': removed_bytes}
+        return self._submit(run).result()
+
+    # Diff and restore
+
+    def _tree(self, manifest):
+        return json.loads(self._get(manifest['tree']))
+
+    def _lines(self, digests):
+        for digest in digests:
+            yield from self._get(digest).split('\n')
+
+    def diff(self, map_key, base, target):
+        """Tiles added, removed and changed from one revision to another
+
+        Chunks shared by both revisions are skipped without being read, so
+        the cost depends on the changed regions only.
+        """
+        with file_locks.locked(self.history_path):
+            old = self.revision(map_key, base)
+            new = self.revision(map_key, target)
+            old_nodes = dict(_tile_nodes(self._tree(old)))
+            new_tree = self._tree(new)
+            new_nodes = dict(_tile_nodes(new_tree))
+
+            layers = {}
+            totals = {'added': 0, 'removed': 0, 'changed': 0}
+            for path in list(old_nodes) + [path for path in new_nodes if path not in old_nodes]:
+                old_node = old_nodes.get(path, {'chunks': []})
+                new_node = new_nodes.get(path, {'chunks': []})
+                shared = set(old_node['chunks']) & set(new_node['chunks'])
+                sides = []
+                for node in (old_node, new_node):
+                    tiles = {}
+                    for line in self._lines(digest for digest in node['chunks'] if digest not in shared):
+                        tiles[_tile_key(line, node.get('object', False))] = line
+                    sides.append(tiles)
+                before, after = sides
+                added = [key for key in after if key not in before]
+                removed = [key for key in before if key not in after]
+                changed = [key for key in after if key in before and before[key] != after[key]]
+                layers[path] = {
+                    'added': len(added),
+                    'removed': len(removed),
+                    'changed': len(changed),
+                    'chunks': {'shared': len(shared),
+                               'removed': len(set(old_node['chunks']) - shared),
+                               'added': len(set(new_node['chunks']) - shared)},
+                    'sample': {'added': added[:SAMPLE_SIZE], 'removed': removed[:SAMPLE_SIZE],
+                               'changed': changed[:SAMPLE_SIZE]}
+                }
+                for name in totals:
+                    totals[name] += layers[path][name]
+
+        old_fields, new_fields = old.get('fields', {}), new.get('fields', {})
+        fields = [key for key in list(old_fields) + [key for key in new_fields if key not in old_fields]
+                  if key not in VOLATILE_FIELDS and old_fields.get(key) != new_fields.get(key)]
+        return {'from': base, 'to': target, 'tiles': totals, 'layers': layers, 'fields': fields,
+                'identical': old.get('digest') == new.get('digest')}
+
+    def _node_text(self, node):
+        if 'value' in node:
+            yield _compact(node['value'])
+        elif 'members' in node:
+            yield '{'
+            for index, (name, child) in enumerate(node['members']):
+                yield (',' if index else '') + _compact(name) + ':'
+                yield from self._node_text(child)
+            yield '}'
+        else:
+            is_object = node.get('object', False)
+            yield '{' if is_object else '['
+            for index, digest in enumerate(node['chunks']):
+                yield (',' if index else '') + self._get(digest).replace('\n', ',')
+            yield '}' if is_object else ']'
+
+    def restore(self, map_key, revision, name=None, overwrite=False):
+        """Write a revision back to the maps directory (as a new save)
+
+        With `name` the revision is saved as a copy under that name (and a
+        new id) instead of replacing the map; FileExistsError is raised if a
+        map of that name exists, unless `overwrite` is set. Returns like
+        map_store.save_map().
+        """
+        with file_locks.locked(self.history_path):
+            manifest = self.revision(map_key, revision)
+            tree = self._tree(manifest)
+            # Reused chunks count as new for the collectors' grace period, so
+            # they outlive a pruning of this revision while it is written out
+            for digest in [manifest['tree']] + _chunk_refs(tree):
+                os.utime(self._object_path(digest))
+        fields = {key: value for key, value in manifest.get('fields', {}).items() if key in MAP_FIELDS}
+        if name is not None:
+            fields['name'] = name
+            fields.pop('id', None)
+
+        def pieces():
+            yield '{'
+            for key, value in fields.items():
+                yield _compact(key) + ':' + _compact(value) + ','
+            yield '"data":'
+            yield from self._node_text(tree)
+            yield '}'
+
+        # Only the map file's lock is held while writing: recording takes the
+        # history lock after it, never the other way round
+        file_path = os.path.join(self.maps_path, map_filename(str(fields.get('name', ''))))
+        with file_locks.locked(file_path):
+            if name is not None and not overwrite and os.path.exists(file_path):
+                raise FileExistsError(f"A map named {name!r} already exists")
+            return save_map(JsonStream(_TextReader(pieces())), self.maps_path)
+
+    def stats(self):
+        with self._lock:
+            counted = self._objects is not None
+        if not counted:
+            # Walk the store without the lock (recording and queueing need it);
+            # objects written meanwhile may be missed until the next collection
+            objects = [0, 0]
+            for digest, _, stat in self._object_files():
+                if digest is not None:
+                    objects[0] += 1
+                    objects[1] += stat.st_size
+            with self._lock:
+                if self._objects is None:
+                    self._objects = objects
+        with self._lock:
+            return {
+                'objects': self._objects[0],
+                'bytes': self._objects[1],
+                'maxRevisions': self.max_revisions,
+                'maxAgeDays': self.max_age_days,
+                'recorded': self.recorded,
+                'pruned': self.pruned,
+                'collected': self.collected,
+                'pending': self._pending
+            }
+
+
+map_history = MapHistory()
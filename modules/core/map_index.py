@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map Index
+Metadata of the saved maps in assets/maps, without their tile data
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+from request_body import JsonStream
+from map_analysis import analyze_file
+from file_locks import file_locks, replace_file
+
+MAPS_PATH = 'assets/maps'
+# Map metadata persisted between runs, so a restart does not re-parse every map
+SNAPSHOT_FILE = '.cache/map_index.json'
+
+
+def read_metadata(file_path):
+    """Top-level fields of a map file except its tile data
+
+    The file is read incrementally and "data" is skipped, so large maps
+    are never loaded as a whole.
+    """
+    with open(file_path, 'rb') as f:
+        stream = JsonStream(f)
+        metadata = {}
+        for key in stream.iter_object():
+            if key == 'data':
+                stream.skip()
+            else:
+                metadata[key] = stream.value()
+        return metadata
+
+
+class MapIndex:
+    """Per-file map metadata, refreshed for files whose mtime or size changed"""
+
+    def __init__(self, maps_path=MAPS_PATH, snapshot_file=SNAPSHOT_FILE):
+        self.maps_path = maps_path
+        self.snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._entries = {}
+        # Entries changed outside a refresh (analyses) that the snapshot lacks
+        self._unsaved = False
+
+    def refresh(self):
+        """Re-read changed map files; returns the current entries"""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        if not os.path.isdir(self.maps_path):
+            with self._lock:
+                self._entries.clear()
+            return {}
+
+        current = {}
+        for name in os.listdir(self.maps_path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.maps_path, name))
+            except OSError:
+                continue
+            current[name] = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            for name in list(self._entries):
+                if name not in current:
+                    del self._entries[name]
+            stale = [name for name, signature in current.items()
+                     if self._entries.get(name, (None,))[0] != signature]
+
+        for name in stale:
+            file_path = os.path.join(self.maps_path, name)
+            try:
+                metadata = read_metadata(file_path)
+            except Exception as e:
+                print(f"[Server] Error reading map file {file_path}: {e}")
+                metadata = None
+            with self._lock:
+                self._entries[name] = (current[name], metadata)
+        with self._lock:
+            unsaved = bool(stale) or self._unsaved
+            self._unsaved = False
+        if unsaved:
+            self.save_snapshot()
+
+        with self._lock:
+            return dict(self._entries)
+
+    def load_snapshot(self):
+        """Seed the entries from the persisted snapshot; False if there is none"""
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = {name: (tuple(signature), metadata) for name, (signature, metadata) in data['maps'].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        with self._lock:
+            if not self._entries:
+                self._entries = entries
+        return True
+
+    def save_snapshot(self):
+        with self._lock:
+            # A copy: saves and refreshes change the entries while it is written
+            data = {'maps': dict(self._entries)}
+        try:
+            text = json.dumps(data, separators=(',', ':'))
+            with file_locks.locked(self.snapshot_file):
+                replace_file(self.snapshot_file, text)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[Server] Could not write map index snapshot: {e}")
+
+    def entries(self):
+        """Metadata of all readable maps, newest first"""
+        maps = []
+        for name, (signature, metadata) in self.refresh().items():
+            if metadata is None:
+                continue
+            entry = dict(metadata)
+            entry['filename'] = name
+            entry['filepath'] = str(os.path.join(self.maps_path, name))
+            entry['fileSize'] = signature[1]
+            maps.append(entry)
+        maps.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+        return maps
+
+    def find(self, map_id):
+        """Index entry of a map by file name (with or without .json) or id"""
+        entries = self.entries()
+        for entry in entries:
+            if map_id in (entry['filename'], entry['filename'][:-len('.json')]):
+                return entry
+        return next((entry for entry in entries if str(entry.get('id')) == map_id), None)
+
+    def analysis(self, filename, recompute=False):
+        """Cached analysis of a map (see map_analysis); None if it is not indexed
+
+        Maps saved by this server carry their analysis in the file. Older
+        maps are analyzed (streamed from disk) the first time they are asked
+        for, and the result is kept with the entry; the next refresh writes
+        it to the snapshot.
+        """
+        self.refresh()
+        with self._lock:
+            signature, metadata = self._entries.get(filename, (None, None))
+        if metadata is None:
+            return None
+        if not recompute and isinstance(metadata.get('analysis'), dict):
+            return metadata['analysis']
+
+        analysis = analyze_file(os.path.join(self.maps_path, filename))
+        with self._lock:
+            # Keep it only if the file did not change meanwhile
+            if self._entries.get(filename, (None,))[0] == signature:
+                self._entries[filename] = (signature, {**metadata, 'analysis': analysis})
+                self._unsaved = True
+        return analysis
+
+    def version(self):
+        """Version stamp over all indexed map files"""
+        with self._lock:
+            signatures = sorted((name, entry[0]) for name, entry in self._entries.items())
+        return hashlib.sha1(repr(signatures).encode('utf-8')).hexdigest()[:16]
+
+    def total_bytes(self):
+        """Combined size of all map files"""
+        with self._lock:
+            return sum(entry[0][1] for entry in self._entries.values())
+
+    def invalidate(self, filename=None):
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filename, None)
+
+
+map_index = MapIndex()
@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map Previews
+Server-side rendering of saved maps to PNG thumbnails and raster tiles
+
+Maps are drawn from their HexGrid (see map_engine) in the editor's flat-top
+layout. Every biome is drawn with its tile image from assets/biomes: as the
+image's average colour while hexes are small, and as the image itself once a
+hex is TEXTURE_MIN_RADIUS pixels or larger. Tiles without a biome image use
+the editor's colour for their type.
+
+The zoomable pyramid is square: level 0 is one TILE_SIZE tile over the whole
+map, every level doubles the tiles per side, down to hexes of MAX_HEX_RADIUS
+pixels. Rendering runs in a process pool; the PNGs are kept in
+.cache/map_previews/<map>-<version>/ (version from the map file's mtime and
+size and the texture signature of the biome files), with the least recently
+used files evicted above MAX_PREVIEW_CACHE.
+"""
+
+import os
+import re
+import json
+import math
+import hashlib
+import time
+import threading
+import weakref
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from image_variants import decode_png, encode_png
+from file_locks import replace_file
+from map_engine import load_grid
+from map_generator import BIOMES_PATH, TILE_COLORS, read_biome_data
+
+PREVIEW_PATH = '.cache/map_previews'
+# Size limit of the preview cache in bytes (WOODCHUNK_PREVIEW_CACHE)
+MAX_PREVIEW_CACHE = int(os.environ.get('WOODCHUNK_PREVIEW_CACHE', 256 * 1024 * 1024))
+TILE_SIZE = 256
+THUMBNAIL_SIZE = 256
+# Hex radius in pixels of the deepest zoom level
+MAX_HEX_RADIUS = 64
+MAX_ZOOM = 16
+# From this hex radius on, biome images are drawn instead of their average colour
+TEXTURE_MIN_RADIUS = 6
+TEXTURE_SIZE = 128
+# Bumped whenever the rendering changes, so cached previews are rebuilt
+RENDER_VERSION = 1
+# Seconds the biome files are trusted unchanged before they are stat'ed again
+TEXTURE_CHECK_INTERVAL = 1.0
+FALLBACK_COLOR = '#9E9E9E'
+
+SQRT3 = math.sqrt(3)
+
+
+def _rgba(color):
+    """'#rrggbb' as RGBA bytes; the fallback grey for anything else"""
+    if not (isinstance(color, str) and re.fullmatch(r'#[0-9a-fA-F]{6}', color)):
+        color = FALLBACK_COLOR
+    return bytes.fromhex(color[1:]) + b'\xff'
+
+
+# -- biome textures ---------------------------------------------------------------
+
+def _biome_images(biome, data, biomes_path):
+    """Candidate paths of a biome's tile image: its first listed tile, then <Biome>/<Biome>.png"""
+    candidates = []
+    tiles = (data or {}).get('tiles')
+    if isinstance(tiles, list) and tiles and isinstance(tiles[0], dict) and isinstance(tiles[0].get('image'), str):
+        candidates.append(tiles[0]['image'].replace('\\', '/'))
+    candidates.append(os.path.join(biomes_path, biome, f'{biome}.png'))
+    return candidates
+
+
+def _biome_image(biome, data, biomes_path):
+    """Path of a biome's tile image (the first candidate that exists)"""
+    return next((path for path in _biome_images(biome, data, biomes_path) if os.path.isfile(path)), None)
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Biome data file -> (its signature, image candidates), so unchanged files are not re-parsed
+_image_candidates = {}
+
+
+def texture_signature(biomes_path=BIOMES_PATH):
+    """Hash over the signatures of the biome data files and images the textures come from"""
+    try:
+        biomes = sorted(name for name in os.listdir(biomes_path) if os.path.isdir(os.path.join(biomes_path, name)))
+    except OSError:
+        biomes = []
+    parts = []
+    for biome in biomes:
+        data_path = os.path.join(biomes_path, biome, f'{biome}.js')
+        data_signature = _signature(data_path)
+        known = _image_candidates.get(data_path)
+        if known is None or known[0] != data_signature:
+            known = _image_candidates[data_path] = (
+                data_signature, _biome_images(biome, read_biome_data(biome, biomes_path), biomes_path))
+        image = next(((path, signature) for path, signature in ((path, _signature(path)) for path in known[1])
+                      if signature is not None), None)
+        parts.append((biome, data_signature, image))
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:12]
+
+
+def _build_texture(image_path):
+    """Mean colour and a TEXTURE_SIZE x TEXTURE_SIZE nearest-neighbour resample (RGBA)"""
+    with open(image_path, 'rb') as f:
+        width, height, pixels = decode_png(f.read())
+    texture = bytearray(TEXTURE_SIZE * TEXTURE_SIZE * 4)
+    totals = [0, 0, 0]
+    opaque = 0
+    for v in range(TEXTURE_SIZE):
+        row = int((v + 0.5) * height / TEXTURE_SIZE) * width
+        for u in range(TEXTURE_SIZE):
+            source = (row + int((u + 0.5) * width / TEXTURE_SIZE)) * 4
+            target = (v * TEXTURE_SIZE + u) * 4
+            texel = pixels[source:source + 4]
+            texture[target:target + 4] = texel
+            if texel[3] >= 128:
+                totals[0] += texel[0]
+                totals[1] += texel[1]
+                totals[2] += texel[2]
+                opaque += 1
+    if not opaque:
+        return None, bytes(texture)
+    return bytes([total // opaque for total in totals]) + b'\xff', bytes(texture)
+
+
+def load_textures(biomes_path=BIOMES_PATH, cache_path=PREVIEW_PATH):
+    """Lower-case biome name -> (mean RGBA, texture RGBA or None)
+
+    Decoded textures are kept under <cache>/textures, keyed by the image's
+    mtime and size, as decoding PNGs without Pillow is slow.
+    """
+    textures = {}
+    try:
+        biomes = sorted(name for name in os.listdir(biomes_path) if os.path.isdir(os.path.join(biomes_path, name)))
+    except OSError:
+        return textures
+    for biome in biomes:
+        data = read_biome_data(biome, biomes_path)
+        color = _rgba((data or {}).get('color')) if (data or {}).get('color') else None
+        image_path = _biome_image(biome, data, biomes_path)
+        texture = None
+        if image_path is not None:
+            stat = os.stat(image_path)
+            cached = os.path.join(cache_path, 'textures',
+                                  f'{biome}-{stat.st_mtime_ns}-{stat.st_size}-{TEXTURE_SIZE}.rgba')
+            try:
+                with open(cached, 'rb') as f:
+                    blob = f.read()
+                mean, texture = blob[:4], blob[4:]
+                mean = mean if mean[3] else None
+            except OSError:
+                try:
+                    mean, texture = _build_texture(image_path)
+                except (OSError, ValueError) as e:
+                    print(f"[Previews] Could not read {image_path}: {e}")
+                    mean = texture = None
+                else:
+                    replace_file(cached, (mean or bytes(4)) + texture)
+            color = mean or color
+        if color is not None:
+            textures[biome.lower()] = (color, texture)
+    return textures
+
+
+# -- rendering --------------------------------------------------------------------
+
+_prepared = weakref.WeakKeyDictionary()
+_textures = {}
+
+
+def _textures_for(biomes_path, cache_path, signature):
+    key = (biomes_path, cache_path, signature)
+    if key not in _textures:
+        # Textures of older signatures are not needed again
+        _textures.clear()
+        _textures[key] = load_textures(biomes_path, cache_path)
+    return _textures[key]
+
+
+def prepare(grid, textures):
+    """Palette, per-cell palette index and world bounds of a grid (cached per grid)"""
+    cached = _prepared.get(grid)
+    if cached is not None and cached['textures'] is textures:
+        return cached
+
+    # Palette entry 0 is "no tile" (transparent)
+    colors = [bytes(4)]
+    texture_of = [-1]
+    texture_list = []
+    biome_lut = [-1]
+    for name in grid.biomes.names:
+        entry = textures.get(name.lower()) if isinstance(name, str) else None
+        if entry is None:
+            biome_lut.append(-1)
+            continue
+        biome_lut.append(len(colors))
+        colors.append(entry[0])
+        if entry[1] is not None:
+            texture_of.append(len(texture_list))
+            texture_list.append(entry[1])
+        else:
+            texture_of.append(-1)
+    type_lut = [0]
+    for name in grid.types.names:
+        type_lut.append(len(colors))
+        colors.append(_rgba(TILE_COLORS.get(name) if isinstance(name, str) else None))
+        texture_of.append(-1)
+
+    if np is not None and isinstance(grid.cell_type, np.ndarray):
+        biome_index = np.array(biome_lut, dtype=np.int32)[grid.cell_biome]
+        cells = np.where(biome_index >= 0, biome_index, np.array(type_lut, dtype=np.int32)[grid.cell_type])
+        cells = np.where(grid.cell_type == 0, 0, cells).astype(np.uint16)
+        occupied = np.nonzero(grid.cell_type)[0]
+        qs = occupied % grid.width + grid.q_min
+        rs = occupied // grid.width + grid.r_min
+        xs = 1.5 * qs
+        ys = SQRT3 * (rs + qs / 2)
+        bounds = (float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())) if len(occupied) else None
+    else:
+        cells = array('H', bytes(2 * len(grid.cell_type)))
+        x_min = y_min = math.inf
+        x_max = y_max = -math.inf
+        for index, tile_type in enumerate(grid.cell_type):
+            if not tile_type:
+                continue
+            biome_index = biome_lut[grid.cell_biome[index]]
+            cells[index] = biome_index if biome_index >= 0 else type_lut[tile_type]
+            q = index % grid.width + grid.q_min
+            r = index // grid.width + grid.r_min
+            x = 1.5 * q
+            y = SQRT3 * (r + q / 2)
+            x_min, x_max = min(x_min, x), max(x_max, x)
+            y_min, y_max = min(y_min, y), max(y_max, y)
+        bounds = (x_min, y_min, x_max, y_max) if x_min != math.inf else None
+    if bounds is not None:
+        # Tile centres to hex extents (size 1: corner radius 1, half height sqrt(3)/2)
+        bounds = (bounds[0] - 1, bounds[1] - SQRT3 / 2, bounds[2] + 1, bounds[3] + SQRT3 / 2)
+
+    prepared = {
+        'textures': textures,
+        'colors': colors,
+        'textureOf': texture_of,
+        'textureList': texture_list,
+        'cells': cells,
+        'bounds': bounds
+    }
+    if np is not None:
+        prepared['colorArray'] = np.frombuffer(b''.join(colors), dtype=np.uint8).reshape(-1, 4)
+        prepared['textureOfArray'] = np.array(texture_of, dtype=np.int32)
+        prepared['textureArray'] = (
+            np.frombuffer(b''.join(texture_list), dtype=np.uint8).reshape(-1, TEXTURE_SIZE, TEXTURE_SIZE, 4)
+            if texture_list else None)
+    _prepared[grid] = prepared
+    return prepared
+
+
+def render(grid, prepared, x0, y0, scale, width, height):
+    """RGBA pixels of a viewport; pixel (px, py) shows the world point
+    (x0 + (px + 0.5) * scale, y0 + (py + 0.5) * scale) in hex-size-1 units"""
+    textured = 1 / scale >= TEXTURE_MIN_RADIUS and prepared['textureList']
+    cells = prepared['cells']
+
+    if np is not None and isinstance(cells, np.ndarray):
+        wx, wy = np.meshgrid(x0 + (np.arange(width) + 0.5) * scale, y0 + (np.arange(height) + 0.5) * scale)
+        qf = wx * (2 / 3)
+        rf = wy / SQRT3 - wx / 3
+        sf = -qf - rf
+        q = np.rint(qf)
+        r = np.rint(rf)
+        s = np.rint(sf)
+        dq = np.abs(q - qf)
+        dr = np.abs(r - rf)
+        ds = np.abs(s - sf)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        q = np.where(fix_q, -r - s, q)
+        r = np.where(fix_r, -q - s, r)
+        column = q.astype(np.int64) - grid.q_min
+        row = r.astype(np.int64) - grid.r_min
+        inside = (column >= 0) & (column < grid.width) & (row >= 0) & (row < grid.height)
+        palette = cells[np.where(inside, row * grid.width + column, 0)]
+        pixels = prepared['colorArray'][palette]
+        if textured:
+            texture_index = prepared['textureOfArray'][palette]
+            mask = texture_index >= 0
+            dx = wx - 1.5 * q
+            dy = wy - SQRT3 * (r + q / 2)
+            u = np.clip(((dx + 1) / 2 * TEXTURE_SIZE).astype(np.int64), 0, TEXTURE_SIZE - 1)
+            v = np.clip(((dy / SQRT3 + 0.5) * TEXTURE_SIZE).astype(np.int64), 0, TEXTURE_SIZE - 1)
+            texels = prepared['textureArray'][np.maximum(texture_index, 0), v, u]
+            mask &= texels[..., 3] >= 128
+            pixels[mask] = texels[mask]
+        return pixels.tobytes()
+
+    colors = prepared['colors']
+    texture_of = prepared['textureOf']
+    texture_list = prepared['textureList']
+    grid_width = grid.width
+    q_min = grid.q_min
+    r_min = grid.r_min
+    out = bytearray(width * height * 4)
+    offset = 0
+    for py in range(height):
+        wy = y0 + (py + 0.5) * scale
+        for px in range(width):
+            wx = x0 + (px + 0.5) * scale
+            qf = wx * (2 / 3)
+            rf = wy / SQRT3 - wx / 3
+            sf = -qf - rf
+            q = round(qf)
+            r = round(rf)
+            s = round(sf)
+            dq = abs(q - qf)
+            dr = abs(r - rf)
+            ds = abs(s - sf)
+            if dq > dr and dq > ds:
+                q = -r - s
+            elif dr > ds:
+                r = -q - s
+            column = q - q_min
+            row = r - r_min
+            if 0 <= column < grid_width and 0 <= row < grid.height:
+                entry = cells[row * grid_width + column]
+                if entry:
+                    color = colors[entry]
+                    if textured and texture_of[entry] >= 0:
+                        dx = wx - 1.5 * q
+                        dy = wy - SQRT3 * (r + q / 2)
+                        u = min(max(int((dx + 1) / 2 * TEXTURE_SIZE), 0), TEXTURE_SIZE - 1)
+                        v = min(max(int((dy / SQRT3 + 0.5) * TEXTURE_SIZE), 0), TEXTURE_SIZE - 1)
+                        texel_offset = (v * TEXTURE_SIZE + u) * 4
+                        texel = texture_list[texture_of[entry]][texel_offset:texel_offset + 4]
+                        if texel[3] >= 128:
+                            color = texel
+                    out[offset:offset + 4] = color
+            offset += 4
+    return bytes(out)
+
+
+# -- pyramid ------------------------------------------------------------------------
+
+def describe(prepared):
+    """Geometry of a map's preview pyramid"""
+    bounds = prepared['bounds']
+    if bounds is None:
+        return {'bounds': None, 'size': 0, 'maxZoom': 0, 'tileSize': TILE_SIZE}
+    size = max(bounds[2] - bounds[0], bounds[3] - bounds[1])
+    max_zoom = max(0, min(MAX_ZOOM, math.ceil(math.log2(size * MAX_HEX_RADIUS / TILE_SIZE))))
+    return {
+        'bounds': [round(value, 4) for value in bounds],
+        'size': round(size, 4),
+        'maxZoom': max_zoom,
+        'tileSize': TILE_SIZE
+    }
+
+
+def viewport(prepared, view):
+    """(x0, y0, scale, width, height) of ('thumbnail',) or ('tile', z, x, y); None if out of range"""
+    geometry = describe(prepared)
+    bounds = prepared['bounds']
+    if bounds is None:
+        return None
+    map_width = bounds[2] - bounds[0]
+    map_height = bounds[3] - bounds[1]
+    if view[0] == 'thumbnail':
+        scale = geometry['size'] / THUMBNAIL_SIZE
+        return (bounds[0], bounds[1], scale,
+                max(1, math.ceil(map_width / scale)), max(1, math.ceil(map_height / scale)))
+
+    _, z, x, y = view
+    if z > geometry['maxZoom']:
+        return None
+    span = geometry['size'] / (1 << z)
+    # Tiles wholly outside the (non-square) map do not exist
+    if x * span >= map_width or y * span >= map_height:
+        return None
+    return bounds[0] + x * span, bounds[1] + y * span, span / TILE_SIZE, TILE_SIZE, TILE_SIZE
+
+
+def render_preview(file_path, view, out_path, biomes_path=BIOMES_PATH, cache_path=PREVIEW_PATH, textures=None):
+    """Render one preview PNG to out_path; returns its size, None if the view does not exist
+
+    Runs in a worker process; grids stay cached there, and textures while
+    their signature (texture_signature()) is unchanged.
+    """
+    grid = load_grid(file_path)
+    if textures is None:
+        textures = texture_signature(biomes_path)
+    prepared = prepare(grid, _textures_for(biomes_path, cache_path, textures))
+    if view[0] == 'info':
+        data = json.dumps(describe(prepared)).encode('utf-8')
+        replace_file(out_path, data)
+        return len(data)
+    area = viewport(prepared, view)
+    if area is None:
+        return None
+    x0, y0, scale, width, height = area
+    png = encode_png(width, height, render(grid, prepared, x0, y0, scale, width, height))
+    replace_file(out_path, png)
+    return len(png)
+
+
+# -- cache --------------------------------------------------------------------------
+
+class MapPreviews:
+    """Rendered previews on disk, produced on demand by a process pool"""
+
+    def __init__(self, cache_path=PREVIEW_PATH, max_bytes=MAX_PREVIEW_CACHE, workers=None,
+                 biomes_path=BIOMES_PATH):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.biomes_path = biomes_path
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = {}
+        self._bytes = None
+        # (texture signature, time it was computed)
+        self._textures = None
+        self.renders = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def texture_signature(self):
+        """Signature of the biome textures, re-checked at most every TEXTURE_CHECK_INTERVAL"""
+        now = time.monotonic()
+        with self._lock:
+            if self._textures is not None and now - self._textures[1] < TEXTURE_CHECK_INTERVAL:
+                return self._textures[0]
+        signature = texture_signature(self.biomes_path)
+        with self._lock:
+            self._textures = (signature, now)
+        return signature
+
+    def version(self, file_path, textures=None):
+        """Version of a map file's previews; changes with the file and the biome textures"""
+        stat = os.stat(file_path)
+        textures = textures or self.texture_signature()
+        key = f'{stat.st_mtime_ns}-{stat.st_size}-{RENDER_VERSION}-{TILE_SIZE}-{textures}'
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+    def _map_dir(self, file_path, version):
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self.cache_path, f'{stem}-{version}')
+
+    def _submit(self, view, file_path, out_path, textures):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.workers or min(4, os.cpu_count() or 1))
+            future = self._pending.get(out_path)
+            if future is not None:
+                return future, False
+            future = self._executor.submit(render_preview, file_path, view, out_path,
+                                           self.biomes_path, self.cache_path, textures)
+            self._pending[out_path] = future
+        future.add_done_callback(lambda done: self._finished(out_path, done))
+        return future, True
+
+    def _finished(self, out_path, future):
+        with self._lock:
+            self._pending.pop(out_path, None)
+        try:
+            size = future.result()
+        except Exception as e:
+            print(f"[Previews] Rendering {out_path} failed: {e}")
+            return
+        if size:
+            with self._lock:
+                self.renders += 1
+            self._account(size)
+
+    def _get(self, file_path, view, name):
+        """Path of a rendered preview file, rendering it if needed; None if the view does not exist"""
+        textures = self.texture_signature()
+        version = self.version(file_path, textures)
+        map_dir = self._map_dir(file_path, version)
+        out_path = os.path.join(map_dir, name)
+        if os.path.exists(out_path):
+            try:
+                # Recently used files survive eviction
+                os.utime(out_path)
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            return out_path
+
+        future, started = self._submit(view, file_path, out_path, textures)
+        if started:
+            self._drop_versions(file_path, version)
+        if future.result() is None:
+            return None
+        return out_path
+
+    def thumbnail(self, file_path):
+        return self._get(file_path, ('thumbnail',), 'thumbnail.png')
+
+    def tile(self, file_path, z, x, y):
+        return self._get(file_path, ('tile', z, x, y), f'{z}-{x}-{y}.png')
+
+    def info(self, file_path):
+        """Pyramid geometry of a map (bounds, maxZoom, tileSize) plus its version"""
+        path = self._get(file_path, ('info',), 'info.json')
+        with open(path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        info['version'] = self.version(file_path)
+        return info
+
+    def enqueue_thumbnail(self, file_path):
+        """Render a map's thumbnail in the background (after a save); never raises"""
+        try:
+            textures = self.texture_signature()
+            version = self.version(file_path, textures)
+            out_path = os.path.join(self._map_dir(file_path, version), 'thumbnail.png')
+            if not os.path.exists(out_path):
+                _, started = self._submit(('thumbnail',), file_path, out_path, textures)
+                if started:
+                    self._drop_versions(file_path, version)
+        except Exception as e:
+            print(f"[Previews] Could not queue thumbnail of {file_path}: {e}")
+
+    def _drop_versions(self, file_path, version):
+        """Remove the previews of a map's earlier versions"""
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        pattern = re.compile(re.escape(stem) + r'-[0-9a-f]{12}')
+        try:
+            names = os.listdir(self.cache_path)
+        except OSError:
+            return
+        for name in names:
+            if name != f'{stem}-{version}' and pattern.fullmatch(name):
+                self._remove_tree(os.path.join(self.cache_path, name))
+
+    def _remove_tree(self, path):
+        removed = 0
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    removed += os.path.getsize(file_path)
+                    os.remove(file_path)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+        self._account(-removed)
+
+    def _files(self):
+        """(mtime, size, path) of every cached preview file"""
+        files = []
+        try:
+            names = os.listdir(self.cache_path)
+        except OSError:
+            return files
+        for name in names:
+            map_dir = os.path.join(self.cache_path, name)
+            if name == 'textures' or not os.path.isdir(map_dir):
+                continue
+            for file_name in os.listdir(map_dir):
+                try:
+                    stat = os.stat(os.path.join(map_dir, file_name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, os.path.join(map_dir, file_name)))
+        return files
+
+    def _account(self, size):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(entry[1] for entry in self._files())
+            else:
+                self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self):
+        """Delete the least recently used previews down to 80% of the limit"""
+        files = sorted(self._files())
+        total = sum(entry[1] for entry in files)
+        target = self.max_bytes * 0.8
+        evicted = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = total
+            self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(entry[1] for entry in self._files())
+            return {
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'renders': self.renders,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'pending': len(self._pending)
+            }
+
+
+map_previews = MapPreviews()
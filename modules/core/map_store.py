@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Map Store
+Writes uploaded maps to assets/maps while they are being received
+
+The request body is parsed with JsonStream and the map file is written in
+the same pass, one tile at a time, to a temporary file that replaces the
+map only once the whole upload was valid. Memory use therefore depends on
+the size of a single tile, not on the size of the map.
+
+Replacing a map file takes the file's lock (see file_locks), so saves of
+the same map from several threads or processes land one after another;
+commit hooks run while the lock is held and see each version in turn.
+"""
+
+import os
+import re
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from map_analysis import MapAnalyzer
+from file_locks import file_locks
+
+MAPS_PATH = 'assets/maps'
+# Top-level fields of a save request that end up in the map file
+MAP_FIELDS = ('id', 'name', 'timestamp', 'tilesCount', 'settings')
+FILE_VERSION = '1.0'
+
+_hooks_lock = threading.Lock()
+_commit_hooks = []
+
+
+class MapValidationError(ValueError):
+    """A strict save whose map did not pass the analysis"""
+
+    def __init__(self, analysis):
+        super().__init__('; '.join(analysis['issues']))
+        self.analysis = analysis
+
+
+def register_commit_hook(callback):
+    """Register callback(file_path) to run after a map file was replaced
+
+    Called with the file's lock held, before the next save of the same map
+    can replace it; callbacks must not block for long.
+    """
+    with _hooks_lock:
+        _commit_hooks.append(callback)
+
+
+def _committed(file_path):
+    with _hooks_lock:
+        hooks = list(_commit_hooks)
+    for callback in hooks:
+        try:
+            callback(str(file_path))
+        except Exception as e:
+            print(f"[Server] Map commit hook error: {e}")
+
+
+def map_filename(name):
+    """File name of a map (sanitized for the filesystem)"""
+    safe_name = re.sub(r'[^\w\-_\.]', '_', name)
+    return f"{safe_name}.json"
+
+
+def _dump(value, level):
+    """Value formatted like json.dump(indent=2) at the given nesting level"""
+    return json.dumps(value, ensure_ascii=False, indent=2).replace('\n', '\n' + '  ' * level)
+
+
+class _MapWriter:
+    """Emits the members of the map file object with json.dump(indent=2) layout"""
+
+    def __init__(self, out):
+        self.out = out
+        self.first = True
+
+    def key(self, name, level=1):
+        self.out.write(('\n' if self.first else ',\n') + '  ' * level + json.dumps(name, ensure_ascii=False) + ': ')
+        self.first = False
+
+    def member(self, name, value):
+        self.key(name)
+        self.out.write(_dump(value, 1))
+
+
+def _write_tiles(stream, out, level, add):
+    """Copy a tile array one tile at a time, passing each tile to add()"""
+    tiles = 0
+    out.write('[')
+    for index in stream.iter_array():
+        tile = stream.value()
+        out.write(('\n' if index == 0 else ',\n') + '  ' * (level + 1) + _dump(tile, level + 1))
+        add(tile)
+        tiles += 1
+    out.write('\n' + '  ' * level + ']' if tiles else ']')
+
+
+def _write_data(stream, out, analyzer):
+    """Copy the request's "data" value, streaming its tile arrays into the analyzer"""
+    if stream.peek() != '{':
+        out.write(_dump(stream.value(), 1))
+        return
+
+    writer = _MapWriter(out)
+    out.write('{')
+    for key in stream.iter_object():
+        writer.key(key, level=2)
+        if key == 'tiles' and stream.peek() == '[':
+            _write_tiles(stream, out, 2, analyzer.add)
+        elif key == 'layers' and stream.peek() == '{':
+            layers = _MapWriter(out)
+            out.write('{')
+            for layer in stream.iter_object():
+                layers.key(layer, level=3)
+                if stream.peek() == '[':
+                    _write_tiles(stream, out, 3, lambda tile, layer=layer: analyzer.add(tile, layer))
+                else:
+                    out.write(_dump(stream.value(), 3))
+            out.write('\n    }' if not layers.first else '}')
+        else:
+            out.write(_dump(stream.value(), 2))
+    out.write('\n  }' if not writer.first else '}')
+
+
+def _store(maps_path, write_members):
+    """Write a map file through a temporary file and move it into place
+
+    write_members(out, writer) writes the data member and returns the map's
+    fields and analysis; the metadata members follow.
+    """
+    maps_dir = Path(maps_path)
+    maps_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = maps_dir / f'.upload-{os.getpid()}-{threading.get_ident()}.json.tmp'
+
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as out:
+            writer = _MapWriter(out)
+            out.write('{')
+            fields, analysis = write_members(out, writer)
+
+            # Metadata follows the (streamed) data
+            now = datetime.now()
+            writer.member('id', fields.get('id', str(int(now.timestamp() * 1000))))
+            writer.member('name', fields['name'])
+            writer.member('timestamp', fields.get('timestamp', int(now.timestamp() * 1000)))
+            writer.member('tilesCount', analysis['tiles'])
+            writer.member('settings', fields.get('settings', {}))
+            writer.member('version', FILE_VERSION)
+            writer.member('savedAt', now.isoformat())
+            writer.member('analysis', analysis)
+            out.write('\n}')
+
+        filename = map_filename(fields['name'])
+        file_path = maps_dir / filename
+        with file_locks.locked(file_path):
+            os.replace(temp_path, file_path)
+            _committed(file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    return {'name': fields['name'], 'filename': filename, 'path': str(file_path),
+            'tiles': analysis['tiles'], 'analysis': analysis}
+
+
+def save_map(stream, maps_path=MAPS_PATH, strict=False):
+    """Write the map from a save request (a JsonStream) to the maps directory
+
+    Returns {'name', 'filename', 'path', 'tiles', 'analysis'}; raises
+    ValueError if the request is not a valid map, or MapValidationError if
+    `strict` is set and the analysis found issues. Fields other than data
+    are small and kept; unknown top-level fields are skipped. tilesCount is
+    the counted number of tiles, and the analysis is stored with the map.
+    """
+    def write_members(out, writer):
+        fields = {}
+        has_data = False
+        analyzer = MapAnalyzer()
+        if stream.peek() != '{':
+            raise ValueError("Expected a JSON object")
+        for key in stream.iter_object():
+            if key == 'data' and not has_data:
+                writer.key('data')
+                _write_data(stream, out, analyzer)
+                has_data = True
+            elif key in MAP_FIELDS:
+                fields[key] = stream.value()
+            else:
+                stream.skip()
+        stream.end()
+
+        if 'name' not in fields or not has_data:
+            raise ValueError("Missing required fields: name and data")
+        if not isinstance(fields['name'], str) or not fields['name'].strip():
+            raise ValueError("Map name must be a non-empty string")
+
+        declared = fields.get('tilesCount')
+        analysis = analyzer.finish(declared if isinstance(declared, int) and not isinstance(declared, bool) else None)
+        if strict and not analysis['valid']:
+            raise MapValidationError(analysis)
+        return fields, analysis
+
+    return _store(maps_path, write_members)
+
+
+def write_map(fields, tile_chunks, analyzer, maps_path=MAPS_PATH):
+    """Write a map whose data.tiles come as pre-formatted text chunks
+
+    Each chunk is a run of tiles formatted with tile_template(), every tile
+    preceded by a separator; the analyzer must have been fed the same
+    tiles by the time the chunks are exhausted. Returns like save_map().
+    """
+    def write_members(out, writer):
+        writer.key('data')
+        out.write('{\n    "tiles": [')
+        empty = True
+        for chunk in tile_chunks:
+            if chunk:
+                out.write(chunk[1:] if empty else chunk)
+                empty = False
+        out.write(']\n  }' if empty else '\n    ]\n  }')
+        return fields, analyzer.finish()
+
+    return _store(maps_path, write_members)
+
+
+def tile_template(tile_type, color, biome_name):
+    """%-format of one tile in a data.tiles chunk for write_map(); arguments (q, r, q, r)"""
+    tile = ['\x01', {'position': {'q': -1111111111, 'r': -2222222222}, 'type': tile_type,
+                     'color': color, 'biomeName': biome_name}]
+    text = ',\n      ' + _dump(tile, 3).replace('%', '%%')
+    return text.replace('"\\u0001"', '"%d,%d"').replace('-1111111111', '%d').replace('-2222222222', '%d')
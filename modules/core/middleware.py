@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Middleware
+Pipeline of layers wrapped around every routed request
+
+A layer is a callable layer(handler, route, call_next) that runs code
+before and after call_next(handler, route). BufferResponses holds the
+response of a route back (status, headers and body) in handler.response
+until the layers inside it have seen it, so response caching, conditional
+GET and compression work the same for every route, whether the handler
+wrote the response itself or through json_response. Responses that are
+streamed (chunked, unframed, larger than BUFFER_LIMIT or a file too large
+for the asset cache) are passed through untouched; handler.response is
+then marked as streaming.
+
+Handlers run unchanged on a socket and behind request_bridge: the buffer
+stands in for the handler's send_response_only/send_header/end_headers
+and wfile while it is installed.
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from json_response import JsonResponseCache, accepts_gzip, etag_matches, gzip_etag
+
+# Largest response body held back for the layers
+BUFFER_LIMIT = 4 * 1024 * 1024
+# Bodies below this size are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = int(os.environ.get('WOODCHUNK_GZIP_LEVEL', 6))
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+# Compressed bodies kept per ETag, and responses kept by the response cache
+GZIP_CACHE_BYTES = 16 * 1024 * 1024
+RESPONSE_CACHE_BYTES = 16 * 1024 * 1024
+# Routes listed in stats(), by total time
+STATS_ROUTES = 10
+# Request headers besides the URL that select a response variant
+VARY_HEADERS = ('Accept', 'Accept-Encoding')
+
+
+class BufferedResponse:
+    """Response of one request, held back until the pipeline emits it"""
+
+    def __init__(self, handler, limit=BUFFER_LIMIT):
+        self.handler = handler
+        self.limit = limit
+        self.status = None
+        self.reason = None
+        self.headers = []
+        self.body = b''
+        self.streaming = False
+        self._buffer = bytearray()
+        self._headers_done = False
+        self._wfile = handler.wfile
+        handler.send_response_only = self._send_response_only
+        handler.send_header = self._send_header
+        handler.end_headers = self._end_headers
+        handler.stream_file_body = self._stream_file_body
+        handler.wfile = self
+
+    # -- stand-ins for the handler's response methods ---------------------------
+
+    def _send_response_only(self, code, message=None):
+        if message is None:
+            message = self.handler.responses.get(code, ('',))[0]
+        self.status = code
+        self.reason = message
+        self.headers = []
+        self.body = b''
+        self._buffer.clear()
+        self._headers_done = False
+
+    def _send_header(self, keyword, value):
+        self.headers.append((keyword, str(value)))
+
+    def _end_headers(self):
+        self._headers_done = True
+        length = self.get_header('Content-Length')
+        if (length is None or int(length) > self.limit
+                or (self.get_header('Transfer-Encoding') or '').lower() == 'chunked'):
+            self._pass_through()
+
+    def _stream_file_body(self, file_path):
+        # Files the asset cache does not hold are streamed from disk as before
+        self._pass_through()
+        self.handler.stream_file_body(file_path)
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) > self.limit:
+            self._pass_through()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    # -- header access for the layers ---------------------------------------------
+
+    def get_header(self, name):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def set_header(self, name, value):
+        self.remove_header(name)
+        self.headers.append((name, str(value)))
+
+    def remove_header(self, name):
+        name = name.lower()
+        self.headers = [(key, value) for key, value in self.headers if key.lower() != name]
+
+    @property
+    def buffered(self):
+        """True while the layers can still change the response"""
+        return not self.streaming and self.status is not None and self._headers_done
+
+    # -- output ---------------------------------------------------------------------
+
+    def _restore(self):
+        handler = self.handler
+        for name in ('send_response_only', 'send_header', 'end_headers', 'stream_file_body'):
+            handler.__dict__.pop(name, None)
+        handler.wfile = self._wfile
+
+    def _emit(self, body):
+        handler = self.handler
+        handler.send_response_only(self.status, self.reason)
+        for keyword, value in self.headers:
+            handler.send_header(keyword, value)
+        handler.end_headers()
+        if body:
+            handler.wfile.write(body)
+
+    def _pass_through(self):
+        """Send what is held back and let the rest of the response through"""
+        if self.streaming:
+            return
+        self.streaming = True
+        self._restore()
+        if self.status is None:
+            if self._buffer:
+                self.handler.wfile.write(bytes(self._buffer))
+        elif self._headers_done:
+            self._emit(bytes(self._buffer))
+        else:
+            # Headers still to come: the handler finishes them itself
+            self.handler.send_response_only(self.status, self.reason)
+            for keyword, value in self.headers:
+                self.handler.send_header(keyword, value)
+        self._buffer.clear()
+
+    def take_body(self):
+        """Move the written body into .body, where the layers read and replace it"""
+        if self._buffer:
+            self.body = bytes(self._buffer)
+            self._buffer.clear()
+
+    def snapshot(self):
+        """(status, headers, body) for replay(); Server and Date are sent anew"""
+        headers = [(keyword, value) for keyword, value in self.headers
+                   if keyword.lower() not in ('server', 'date')]
+        return self.status, headers, self.body
+
+    def replay(self, status, headers, body):
+        """Answer the request with a stored snapshot instead of running the route"""
+        handler = self.handler
+        handler.send_response(status)
+        for keyword, value in headers:
+            handler.send_header(keyword, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def finish(self):
+        """Send the (possibly rewritten) response to the client"""
+        if self.streaming:
+            return
+        self.take_body()
+        self._restore()
+        self.streaming = True
+        if self.status is not None:
+            self.handler.response_status = self.status
+            self._emit(b'' if self.status == 304 else self.body)
+
+    def abandon(self):
+        """Drop the held back response (the handler failed before finishing it)"""
+        if not self.streaming:
+            self._restore()
+            self.streaming = True
+
+
+class Pipeline:
+    """Layers around an endpoint; the first layer added is the outermost"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.layers = []
+        self._chain = endpoint
+
+    def use(self, layer):
+        self.layers.append(layer)
+        chain = self.endpoint
+        for outer in reversed(self.layers):
+            chain = _link(outer, chain)
+        self._chain = chain
+        return layer
+
+    def __call__(self, handler, route):
+        self._chain(handler, route)
+
+    def stats(self):
+        return {layer.name: layer.stats() for layer in self.layers if hasattr(layer, 'stats')}
+
+
+def _link(layer, call_next):
+    return lambda handler, route: layer(handler, route, call_next)
+
+
+def variant_key(handler):
+    """Key of the response variant a request asks for: its URL and VARY_HEADERS"""
+    return (handler.path, *(handler.headers.get(name) for name in VARY_HEADERS))
+
+
+def buffered_response(handler):
+    """The buffered response of a request, or None if it is not held back"""
+    response = getattr(handler, 'response', None)
+    if response is None:
+        return None
+    response.take_body()
+    return response if response.buffered else None
+
+
+class BufferResponses:
+    """Holds responses back for the inner layers; routes with stream=True are never held"""
+
+    name = 'buffer'
+
+    def __init__(self, limit=BUFFER_LIMIT):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.buffered = 0
+        self.streamed = 0
+
+    def __call__(self, handler, route, call_next):
+        if route.options.get('stream'):
+            handler.response = None
+            call_next(handler, route)
+            return
+        response = handler.response = BufferedResponse(handler, self.limit)
+        try:
+            call_next(handler, route)
+        except BaseException:
+            response.abandon()
+            raise
+        streamed = response.streaming
+        response.finish()
+        with self._lock:
+            if streamed:
+                self.streamed += 1
+            else:
+                self.buffered += 1
+
+    def stats(self):
+        with self._lock:
+            return {'buffered': self.buffered, 'streamed': self.streamed, 'limit': self.limit}
+
+
+class RouteMetrics:
+    """Request count, status classes and time per route"""
+
+    name = 'metrics'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def __call__(self, handler, route, call_next):
+        started = time.perf_counter()
+        handler.response_status = None
+        try:
+            call_next(handler, route)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            status = handler.response_status if isinstance(handler.response_status, int) else 500
+            with self._lock:
+                entry = self._routes.get(route)
+                if entry is None:
+                    entry = self._routes[route] = {'count': 0, 'clientErrors': 0, 'serverErrors': 0,
+                                                   'totalMs': 0.0, 'maxMs': 0.0}
+                entry['count'] += 1
+                if 400 <= status < 500:
+                    entry['clientErrors'] += 1
+                elif status >= 500:
+                    entry['serverErrors'] += 1
+                entry['totalMs'] += elapsed
+                entry['maxMs'] = max(entry['maxMs'], elapsed)
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._routes.items())
+        slowest = sorted(entries, key=lambda item: item[1]['totalMs'], reverse=True)[:STATS_ROUTES]
+        return {
+            'requests': sum(entry['count'] for _, entry in entries),
+            'serverErrors': sum(entry['serverErrors'] for _, entry in entries),
+            'slowest': [{
+                'route': f'{route.method} {route.pattern}',
+                'count': entry['count'],
+                'clientErrors': entry['clientErrors'],
+                'serverErrors': entry['serverErrors'],
+                'totalMs': round(entry['totalMs'], 2),
+                'avgMs': round(entry['totalMs'] / entry['count'], 3),
+                'maxMs': round(entry['maxMs'], 2)
+            } for route, entry in slowest]
+        }
+
+
+class ResponseCache:
+    """Whole GET responses of routes with a version=callable(handler) option
+
+    Responses are keyed by variant_key() (path, query string and the
+    Accept headers) and kept while the route's version is unchanged; a
+    version of None bypasses the cache.
+    """
+
+    name = 'responseCache'
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, handler, route, call_next):
+        version_of = route.options.get('version')
+        version = version_of(handler) if version_of is not None and handler.command == 'GET' else None
+        if version is None or getattr(handler, 'response', None) is None:
+            call_next(handler, route)
+            return
+
+        key = variant_key(handler)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry is not None:
+            handler.response.replay(*entry[1:])
+            return
+
+        call_next(handler, route)
+        response = buffered_response(handler)
+        # One response may take at most an eighth of the cache
+        if response is None or response.status != 200 or len(response.body) > self.max_bytes // 8:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[3])
+            self._entries[key] = (version, *response.snapshot())
+            self._bytes += len(response.body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[3])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def body_etag(body):
+    """ETag derived from a response body"""
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+class ConditionalGet:
+    """ETags for GET responses that have none, and 304 for matching If-None-Match
+
+    Runs outside Compression, so a gzip body is compared under its own ETag
+    and a 304 never stands for the other encoding.
+    """
+
+    name = 'conditional'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.not_modified = 0
+
+    def __call__(self, handler, route, call_next):
+        call_next(handler, route)
+        if handler.command != 'GET':
+            return
+        response = buffered_response(handler)
+        if response is None or response.status != 200:
+            return
+        etag = response.get_header('ETag')
+        if etag is None:
+            etag = body_etag(response.body)
+            response.set_header('ETag', etag)
+        if etag_matches(handler.headers.get('If-None-Match'), etag):
+            response.status = 304
+            response.reason = handler.responses[304][0]
+            response.body = b''
+            for name in ('Content-Length', 'Content-Type', 'Content-Encoding'):
+                response.remove_header(name)
+            with self._lock:
+                self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            return {'notModified': self.not_modified}
+
+
+class Compression:
+    """gzip for compressible response bodies, cached per ETag
+
+    A gzip body gets the ETag of the identity body with the suffix -gz
+    (see gzip_etag), so the two encodings never share an ETag.
+    """
+
+    name = 'compression'
+
+    def __init__(self, level=COMPRESS_LEVEL, min_size=COMPRESS_MIN_SIZE):
+        self.level = level
+        self.min_size = min_size
+        self._cache = JsonResponseCache(max_bytes=GZIP_CACHE_BYTES, max_entry=BUFFER_LIMIT)
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __call__(self, handler, route, call_next):
+        call_next(handler, route)
+        response = buffered_response(handler)
+        if (response is None or response.status != 200 or len(response.body) < self.min_size
+                or response.get_header('Content-Encoding') is not None
+                or not (response.get_header('Content-Type') or '').startswith(COMPRESSIBLE_TYPES)):
+            return
+        vary = response.get_header('Vary')
+        response.set_header('Vary', f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding')
+        if not accepts_gzip(handler.headers.get('Accept-Encoding')):
+            return
+
+        # The identity body's ETag, also the cache key; ETags are only
+        # unique per URL (static files use their mtime)
+        etag = response.get_header('ETag')
+        if etag is None:
+            etag = body_etag(response.body)
+            response.set_header('ETag', etag)
+        key = f"{handler.path.split('?', 1)[0]} {etag}"
+        body = self._cache.get(key, len(response.body))
+        if body is None:
+            body = gzip.compress(response.body, self.level, mtime=0)
+            self._cache.put(key, len(response.body), body)
+        if len(body) >= len(response.body):
+            return
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += len(response.body)
+            self.bytes_out += len(body)
+        response.body = body
+        response.set_header('Content-Encoding', 'gzip')
+        response.set_header('Content-Length', len(body))
+        response.set_header('ETag', gzip_etag(etag))
+
+    def stats(self):
+        with self._lock:
+            return {'level': self.level, 'compressed': self.compressed,
+                    'bytesIn': self.bytes_in, 'bytesOut': self.bytes_out}
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Request Bodies
+Size-limited, streaming access to request bodies
+
+Bodies are read from the handler's rfile in pieces instead of in one go.
+Content-Length is checked against a limit before anything is read, gzip
+request bodies (Content-Encoding: gzip) are inflated on the fly with the
+limit applied to the inflated size, and JSON can be parsed either whole
+(small bodies) or value by value with JsonStream (large map uploads).
+"""
+
+import os
+import json
+import zlib
+import codecs
+
+from json_response import loads
+
+# Limits in bytes, after decompression (WOODCHUNK_MAX_BODY / WOODCHUNK_MAX_MAP_BODY)
+MAX_JSON_BODY = int(os.environ.get('WOODCHUNK_MAX_BODY', 16 * 1024 * 1024))
+MAX_MAP_BODY = int(os.environ.get('WOODCHUNK_MAX_MAP_BODY', 1024 * 1024 * 1024))
+MAX_UPLOAD_BODY = int(os.environ.get('WOODCHUNK_MAX_UPLOAD', 64 * 1024 * 1024))
+# Largest body any route accepts; the asyncio backend rejects bigger ones up front
+MAX_REQUEST_BODY = max(MAX_JSON_BODY, MAX_MAP_BODY, MAX_UPLOAD_BODY)
+READ_CHUNK_SIZE = 64 * 1024
+# Largest single value JsonStream.value() buffers (one tile, one map field)
+MAX_JSON_VALUE = MAX_JSON_BODY
+# A literal cut off at the end of the buffer ('-Infinity' is the longest)
+# fails up to this many characters before the end
+_LITERAL_TAIL = 8
+
+
+class BodyError(Exception):
+    """A request body that cannot be accepted; carries the HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def content_length(headers):
+    """Declared body length; None if the header is missing"""
+    value = headers.get('Content-Length')
+    if value is None:
+        return None
+    try:
+        length = int(value)
+    except ValueError:
+        raise BodyError(400, "Invalid Content-Length")
+    if length < 0:
+        raise BodyError(400, "Invalid Content-Length")
+    return length
+
+
+class BodyReader:
+    """File-like reader of one request body, inflating gzip and enforcing a limit"""
+
+    def __init__(self, rfile, length, limit, encoding=None):
+        self.rfile = rfile
+        self.remaining = length
+        self.limit = limit
+        self.produced = 0
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == 'gzip' else None
+        self._pending = b''
+
+    def _read_raw(self, size):
+        if self.remaining <= 0:
+            return b''
+        data = self.rfile.read(min(size, self.remaining))
+        if not data:
+            raise BodyError(400, "Request body ended early")
+        self.remaining -= len(data)
+        return data
+
+    def _count(self, data):
+        self.produced += len(data)
+        if self.produced > self.limit:
+            raise BodyError(413, f"Request body exceeds {self.limit} bytes")
+        return data
+
+    def read(self, size=-1):
+        """Up to size bytes of the (inflated) body; b'' at the end"""
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(READ_CHUNK_SIZE), b''))
+        if self._inflater is None:
+            return self._count(self._read_raw(size))
+
+        while True:
+            if self._pending:
+                source, self._pending = self._pending, b''
+            elif self._inflater.eof or self.remaining <= 0:
+                if not self._inflater.eof:
+                    raise BodyError(400, "Truncated gzip body")
+                return b''
+            else:
+                source = self._read_raw(READ_CHUNK_SIZE)
+            try:
+                data = self._inflater.decompress(source, size)
+            except zlib.error as e:
+                raise BodyError(400, f"Invalid gzip body: {e}")
+            self._pending = self._inflater.unconsumed_tail
+            if data:
+                return self._count(data)
+
+
+def open_body(handler, limit=MAX_JSON_BODY):
+    """BodyReader over the handler's request body; raises BodyError"""
+    length = content_length(handler.headers)
+    if length is None:
+        raise BodyError(411, "Content-Length required")
+    encoding = (handler.headers.get('Content-Encoding') or 'identity').strip().lower()
+    if encoding not in ('identity', 'gzip'):
+        raise BodyError(415, f"Unsupported Content-Encoding: {encoding}")
+    # Compressed bodies are at most as large as their inflated form
+    if length > limit:
+        raise BodyError(413, f"Request body exceeds {limit} bytes")
+    return BodyReader(handler.rfile, length, limit, encoding if encoding == 'gzip' else None)
+
+
+def read_body(handler, limit=MAX_JSON_BODY):
+    """The whole request body as bytes"""
+    return open_body(handler, limit).read()
+
+
+def read_json(handler, limit=MAX_JSON_BODY, empty=None):
+    """Decode a JSON request body; returns `empty` if there is no body
+
+    Raises BodyError for missing, oversized or badly encoded bodies and
+    json.JSONDecodeError for invalid JSON.
+    """
+    if empty is not None and not content_length(handler.headers):
+        return empty
+    return loads(read_body(handler, limit))
+
+
+class JsonStream:
+    """Incremental JSON reader over a file-like object
+
+    Containers are walked with iter_object()/iter_array(); each key or
+    element they yield must be consumed with value(), skip() or a nested
+    iter_*() before the iteration continues. Leaf values (one tile, for
+    example) are decoded by the json module's C scanner, so only the value
+    being decoded has to fit in memory.
+    """
+
+    _decoder = json.JSONDecoder()
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, stream, chunk_size=READ_CHUNK_SIZE, max_value=MAX_JSON_VALUE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_value = max_value
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        """Append more text to the buffer; False at the end of the stream"""
+        if self._eof:
+            return False
+        data = self.stream.read(size or self.chunk_size)
+        if not data:
+            self._eof = True
+            self._buffer = self._buffer[self._pos:] + self._text.decode(b'', final=True)
+            self._pos = 0
+            return False
+        self._buffer = self._buffer[self._pos:] + self._text.decode(data)
+        self._pos = 0
+        return True
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def peek(self):
+        """Next non-whitespace character, '' at the end"""
+        while True:
+            buffer = self._buffer
+            pos = self._pos
+            while pos < len(buffer) and buffer[pos] in self._whitespace:
+                pos += 1
+            self._pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self.peek() != char:
+            raise self._error(f"Expected '{char}'")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete value"""
+        if not self.peek():
+            raise self._error("Unexpected end of data")
+        while True:
+            try:
+                result, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                # Only a value cut off by the end of the buffer is read further;
+                # a syntax error inside the buffer fails right away
+                truncated = (e.pos >= len(self._buffer) - _LITERAL_TAIL
+                             or e.msg.startswith('Unterminated string'))
+                if not truncated:
+                    raise
+                pending = len(self._buffer) - self._pos
+                if pending > self.max_value:
+                    raise BodyError(413, f"JSON value exceeds {self.max_value} bytes")
+                # Read as much again as is buffered so a large value is
+                # re-scanned only a few times
+                if self._fill(max(self.chunk_size, pending)):
+                    continue
+                raise
+            if (not self._eof and not isinstance(result, (str, dict, list))
+                    and not self._buffer[end:].strip('0123456789.eE+-')):
+                # A number at the end of the buffer may continue ('1.' + '5e3')
+                if self._fill():
+                    continue
+            self._pos = end
+            return result
+
+    def skip(self, depth=2):
+        """Consume the next value without keeping it
+
+        The outer `depth` levels of containers are walked member by member;
+        anything nested deeper is decoded whole and dropped.
+        """
+        char = self.peek()
+        if depth > 0 and char == '{':
+            for _ in self.iter_object():
+                self.skip(depth - 1)
+        elif depth > 0 and char == '[':
+            for _ in self.iter_array():
+                self.skip(depth - 1)
+        else:
+            self.value()
+
+    def _separator(self, first, closing):
+        """Consume ',' or the closing bracket; True if another member follows"""
+        char = self.peek()
+        if char == closing:
+            self._pos += 1
+            return False
+        if not first:
+            if char != ',':
+                raise self._error(f"Expected ',' or '{closing}'")
+            self._pos += 1
+            if self.peek() == closing:
+                raise self._error("Trailing comma")
+        return True
+
+    def iter_object(self):
+        """Yield the keys of the next object"""
+        self._expect('{')
+        first = True
+        while self._separator(first, '}'):
+            first = False
+            if self.peek() != '"':
+                raise self._error("Expected an object key")
+            key = self.value()
+            self._expect(':')
+            yield key
+
+    def iter_array(self):
+        """Yield once per element of the next array"""
+        self._expect('[')
+        first = True
+        index = 0
+        while self._separator(first, ']'):
+            first = False
+            yield index
+            index += 1
+
+    def end(self):
+        """Check that nothing but whitespace follows"""
+        if self.peek():
+            raise self._error("Extra data after the JSON value")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Request Bridge
+Runs the regular request handler routes against an in-memory request so
+other front ends (asyncio server, batch requests) reuse the same code paths
+"""
+
+import io
+import http.client
+
+
+class _BridgeOutput:
+    """File-like object that receives the response body from a handler"""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def write(self, data):
+        self.handler.write_body(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class BridgeMixin:
+    """Replaces the socket I/O of a BaseHTTPRequestHandler
+
+    The handler is never attached to a socket. Status line and headers are
+    recorded instead of written, and the body goes to a sink object with
+    `start(status, reason, headers)`, `write(data)` and optionally
+    `send_file(path)` for files the handler would stream from disk. Without
+    a sink the whole response is collected in memory and exposed as
+    `status`, `response_headers` and `body`.
+    """
+
+    def __init__(self, method, path, headers=None, body=b'', client_address=('127.0.0.1', 0),
+                 server=None, sink=None, version='HTTP/1.1'):
+        # Deliberately no super().__init__() - that would start reading a socket
+        self.command = method
+        self.path = path
+        self.request_version = version
+        self.requestline = f'{method} {path} {version}'
+        # Sinks speak HTTP/1.1 and pass chunked bodies through; collected
+        # responses are plain bodies, so handlers must not chunk them
+        self.protocol_version = 'HTTP/1.1' if sink is not None else 'HTTP/1.0'
+        self.headers = headers if headers is not None else http.client.HTTPMessage()
+        # The body is bytes or an already opened file (spooled uploads)
+        self.rfile = body if hasattr(body, 'read') else io.BytesIO(body or b'')
+        self.wfile = _BridgeOutput(self)
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = False
+
+        self.status = None
+        self.reason = ''
+        self.response_headers = []
+        self.file_body = None
+        self._sink = sink
+        self._buffer = io.BytesIO()
+        self._headers_done = False
+        self._streaming = False
+
+    # -- response recording -------------------------------------------------
+
+    def send_response_only(self, code, message=None):
+        """Record the status line"""
+        if message is None:
+            message = self.responses.get(code, ('',))[0]
+        self.status = code
+        self.reason = message
+        self.response_headers = []
+        self._headers_done = False
+
+    def send_header(self, keyword, value):
+        """Record a response header"""
+        self.response_headers.append((keyword, str(value)))
+        if keyword.lower() == 'connection':
+            if value.lower() == 'close':
+                self.close_connection = True
+            elif value.lower() == 'keep-alive':
+                self.close_connection = False
+
+    def end_headers(self):
+        """Finish the header block, starting the sink if the body is framed"""
+        self._headers_done = True
+        if self._sink is not None and self._has_framing():
+            # The handler framed the body itself (Content-Length or chunked),
+            # so the body can be passed through as it is produced
+            self._streaming = True
+            self._sink.start(self.status, self.reason, list(self.response_headers))
+
+    def flush_headers(self):
+        pass
+
+    def get_header(self, name):
+        """Return the first recorded response header with the given name"""
+        name = name.lower()
+        for key, value in self.response_headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def _has_framing(self):
+        if self.get_header('Content-Length') is not None:
+            return True
+        return (self.get_header('Transfer-Encoding') or '').lower() == 'chunked'
+
+    def write_body(self, data):
+        if self._streaming:
+            self._sink.write(data)
+        else:
+            self._buffer.write(data)
+
+    def stream_file_body(self, file_path):
+        """Defer uncached file bodies to the sink so it can stream them itself"""
+        if self._sink is None or not hasattr(self._sink, 'send_file'):
+            super().stream_file_body(file_path)
+            return
+        self.file_body = file_path
+        if self._streaming:
+            self._sink.send_file(file_path)
+
+    # -- execution ------------------------------------------------------------
+
+    def run(self):
+        """Dispatch the request and finalize the response"""
+        method = getattr(self, 'do_' + self.command, None)
+        if method is None:
+            self.send_error(501, f"Unsupported method ({self.command})")
+        else:
+            method()
+        self.finish_response()
+        return self
+
+    def finish_response(self):
+        """Hand any buffered body to the sink with an explicit length"""
+        if self.status is None:
+            self.send_error(500, "Handler produced no response")
+        if self._sink is None or self._streaming:
+            return
+        body = self._buffer.getvalue()
+        headers = list(self.response_headers)
+        if self.file_body is None and self.get_header('Content-Length') is None:
+            headers.append(('Content-Length', str(len(body))))
+        self._sink.start(self.status, self.reason, headers)
+        if self.file_body is not None:
+            self._sink.send_file(self.file_body)
+        elif body:
+            self._sink.write(body)
+
+    @property
+    def body(self):
+        return self._buffer.getvalue()
+
+
+_bridge_classes = {}
+
+
+def bridge_class_for(handler_class):
+    """Return (and cache) the bridged subclass of a request handler class"""
+    bridge_class = _bridge_classes.get(handler_class)
+    if bridge_class is None:
+        bridge_class = type(f'Bridged{handler_class.__name__}', (BridgeMixin, handler_class), {})
+        _bridge_classes[handler_class] = bridge_class
+    return bridge_class
+
+
+def build_headers(pairs):
+    """Build an HTTPMessage from (name, value) pairs"""
+    message = http.client.HTTPMessage()
+    for name, value in pairs:
+        message[name] = value
+    return message
+
+
+def run_request(handler_class, method, path, headers=None, body=b'', client_address=('127.0.0.1', 0),
+                server=None, sink=None, version='HTTP/1.1'):
+    """Run one request through handler_class and return the bridge handler"""
+    if headers is None or isinstance(headers, (list, tuple, dict)):
+        pairs = headers.items() if isinstance(headers, dict) else (headers or [])
+        headers = build_headers(pairs)
+    bridge = bridge_class_for(handler_class)(
+        method, path, headers=headers, body=body, client_address=client_address,
+        server=server, sink=sink, version=version
+    )
+    return bridge.run()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Router
+Method and path pattern dispatch for the request handler
+
+Patterns are split into path segments and compiled into a tree. Literal
+segments are dict lookups, so matching a path costs the same however many
+routes are registered; only the parameter segments at one level are tried
+in turn. Parameters are written in braces and may carry a converter:
+
+    /api/maps/{map_id}/history/{revision:int}
+    /api/maps/{map_id}/tiles/{z:int}/{x:int}/{y:int}.png
+    /{file_path:path}                 (the rest of the path, at the end only)
+
+Parameter values are URL-decoded. A `path` parameter only matches a
+relative path: no '..' segments, no leading '/', no backslashes, drive
+prefixes or NUL characters (see is_relative_path). Literal segments win
+over parameters.
+"""
+
+import re
+from urllib.parse import unquote
+
+PARAM = re.compile(r'\{(\w+)(?::(\w+))?\}')
+DRIVE_PREFIX = re.compile(r'^[A-Za-z]:')
+CONVERTERS = {
+    'str': (r'[^/]+', str),
+    'int': (r'\d+', int),
+}
+
+
+def is_relative_path(path):
+    """True if a decoded path stays below the directory it is joined to, on any OS"""
+    if path.startswith('/') or '\\' in path or '\0' in path or DRIVE_PREFIX.match(path):
+        return False
+    return '..' not in path.split('/')
+
+
+class Route:
+    """A registered route; options are free-form settings read by middleware"""
+
+    __slots__ = ('method', 'pattern', 'handler', 'options')
+
+    def __init__(self, method, pattern, handler, options):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        self.options = options
+
+    def __repr__(self):
+        return f'<Route {self.method} {self.pattern} -> {self.handler}>'
+
+
+class _Node:
+    __slots__ = ('static', 'dynamic', 'tail', 'routes')
+
+    def __init__(self):
+        self.static = {}
+        # (segment source, regex, converters, child) in registration order
+        self.dynamic = []
+        # (parameter name, {method: route}) of a trailing path parameter
+        self.tail = None
+        self.routes = {}
+
+
+def _compile_segment(segment):
+    """Regex and (name, converter) list of a segment with parameters"""
+    pattern, converters, position = '', [], 0
+    for match in PARAM.finditer(segment):
+        name, kind = match.group(1), match.group(2) or 'str'
+        if kind not in CONVERTERS:
+            raise ValueError(f"Unknown converter {kind!r} in {segment!r}")
+        regex, convert = CONVERTERS[kind]
+        pattern += re.escape(segment[position:match.start()]) + f'({regex})'
+        converters.append((name, convert))
+        position = match.end()
+    pattern += re.escape(segment[position:])
+    return re.compile(pattern), converters
+
+
+class Router:
+    """Compiled route table"""
+
+    def __init__(self):
+        self._root = _Node()
+        self.routes = []
+
+    def add(self, method, pattern, handler, **options):
+        """Register handler (a handler method name) for method and pattern"""
+        if not pattern.startswith('/'):
+            raise ValueError(f"Route pattern must start with '/': {pattern}")
+        route = Route(method.upper(), pattern, handler, options)
+        node = self._root
+        segments = pattern[1:].split('/')
+        for index, segment in enumerate(segments):
+            tail = re.fullmatch(r'\{(\w+):path\}', segment)
+            if tail:
+                if index != len(segments) - 1:
+                    raise ValueError(f"Path parameter must come last: {pattern}")
+                if node.tail is None:
+                    node.tail = (tail.group(1), {})
+                elif node.tail[0] != tail.group(1):
+                    raise ValueError(f"Conflicting path parameter in {pattern}")
+                routes = node.tail[1]
+                break
+            if '{' not in segment:
+                node = node.static.setdefault(segment, _Node())
+                continue
+            for source, _, _, child in node.dynamic:
+                if source == segment:
+                    node = child
+                    break
+            else:
+                regex, converters = _compile_segment(segment)
+                child = _Node()
+                node.dynamic.append((segment, regex, converters, child))
+                node = child
+        else:
+            routes = node.routes
+        if route.method in routes:
+            raise ValueError(f"Duplicate route: {route.method} {pattern}")
+        routes[route.method] = route
+        self.routes.append(route)
+        return route
+
+    def match(self, method, path):
+        """Return (route, params) for a request path (without query string)
+
+        On a miss the route is None and params is the sorted list of methods
+        the path does support (empty if it matches no route at all).
+        """
+        found = self._find(self._root, path[1:].split('/'), 0, {})
+        if found is None:
+            return None, []
+        routes, params = found
+        route = routes.get(method)
+        if route is None:
+            return None, sorted(routes)
+        return route, params
+
+    def _find(self, node, segments, index, params):
+        if index == len(segments):
+            if node.routes:
+                return node.routes, params
+            return None
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._find(child, segments, index + 1, params)
+            if found is not None:
+                return found
+        for _, regex, converters, child in node.dynamic:
+            match = regex.fullmatch(segment)
+            if match is None:
+                continue
+            values = dict(params)
+            for (name, convert), value in zip(converters, match.groups()):
+                values[name] = convert(unquote(value))
+            found = self._find(child, segments, index + 1, values)
+            if found is not None:
+                return found
+        if node.tail is not None:
+            rest = unquote('/'.join(segments[index:]))
+            if is_relative_path(rest):
+                return node.tail[1], {**params, node.tail[0]: rest}
+        return None
@@ -5,99 +5,307 @@ Simple HTTP server for development and file serving
 """
 
 import os
+import sys
 import json
 import re
+import shutil
+import hashlib
+import argparse
 import socketserver
 import http.server
 import traceback
+from stat import S_ISREG
 from pathlib import Path
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlsplit, parse_qs, quote
 from datetime import datetime
 
+import events
+import bundler
+import caches
+import batch
+from asset_cache import asset_cache
+from tile_index import tile_index
+from image_variants import image_variants
+from tile_store import tile_store
+from asset_manifest import asset_manifest
+from hash_index import hash_index
+from warmup import warmup
+from map_index import map_index
+from data_store import data_store, parse_query
+import map_engine
+from json_response import (
+    JSON_BACKEND, send_json, send_cached_json, files_stamp, read_json_file, StreamedList, Deferred,
+    etag_matches, variant_etag
+)
+from request_body import BodyError, JsonStream, open_body, read_json, MAX_MAP_BODY
+import map_store
+import map_generator
+from map_preview import map_previews
+from map_history import map_history
+from file_locks import file_locks, replace_file, LockTimeout, LOCK_METHOD
+from router import Router
+from middleware import Pipeline, RouteMetrics, BufferResponses, Compression, ConditionalGet, ResponseCache
+from admission import RateLimit, Coalesce
+
+# TileEditor routes are mounted into this server (modules/tileEditor/api_server.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tileEditor'))
+from api_server import TileEditorRoutes
+
 # Server configuration
 HOST = 'localhost'
 PORT = 8080
 
-class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
+# Ability categories and ids saved as assets/abilities/<category>/<id>.js
+ABILITY_FILE_NAME = re.compile(r'[\w-]+')
+
+# Content types of static files by extension
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.js': 'application/javascript',
+    '.css': 'text/css',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+    '.json': 'application/json',
+    '.txt': 'text/plain'
+}
+
+
+def inside_root(file_path):
+    """True if a file path resolves (symlinks included) to a place inside the served directory"""
+    root = os.path.realpath(os.getcwd())
+    return os.path.realpath(file_path).startswith(os.path.join(root, ''))
+
+
+def biome_folders_version(handler):
+    """The biome folder list changes only with the entries of assets/biomes"""
+    try:
+        return os.stat('assets/biomes').st_mtime_ns
+    except OSError:
+        return None
+
+
+# Route options: rate class and coalescing (admission), stream and version
+# (middleware). Filesystem scans are rate limited hardest and coalesced,
+# static files are not limited at all.
+SCAN = {'limit': 'scan', 'coalesce': True}
+WRITE = {'limit': 'write'}
+STATIC = {'limit': None}
+
+# (method, pattern, handler method, options) - see router for the pattern syntax
+ROUTES = (
+    ('GET', '/api/status', 'handle_status', {}),
+    ('GET', '/api/scan-items', 'handle_scan_items', SCAN),
+    ('GET', '/api/load-abilities', 'handle_load_abilities', SCAN),
+    ('GET', '/api/scan-abilities', 'handle_scan_abilities', SCAN),
+    ('GET', '/api/biomes/folders', 'handle_biome_folders', {'version': biome_folders_version}),
+    ('GET', '/api/biomes/categories', 'handle_biome_categories', {}),
+    ('GET', '/api/biomes/tiles', 'handle_biome_tiles', SCAN),
+    ('GET', '/api/maps', 'handle_load_maps', SCAN),
+    ('POST', '/api/maps/save', 'handle_save_map', WRITE),
+    ('POST', '/api/maps/generate', 'handle_generate_map', WRITE),
+    ('POST', '/api/maps/history/gc', 'handle_map_history_gc', WRITE),
+    ('GET', '/api/maps/{map_id}/query', 'handle_map_query', {}),
+    ('POST', '/api/maps/{map_id}/query', 'handle_map_query', {}),
+    ('GET', '/api/maps/{map_id}/analysis', 'handle_map_analysis', {}),
+    ('GET', '/api/maps/{map_id}/preview', 'handle_map_preview', {}),
+    ('GET', '/api/maps/{map_id}/thumbnail.png', 'handle_map_preview', {}),
+    ('GET', '/api/maps/{map_id}/tiles/{z:int}/{x:int}/{y:int}.png', 'handle_map_preview', {}),
+    ('GET', '/api/maps/{map_id}/history', 'handle_map_history', {}),
+    ('GET', '/api/maps/{map_id}/history/diff', 'handle_map_history', {}),
+    ('GET', '/api/maps/{map_id}/history/{revision:int}', 'handle_map_history', {}),
+    ('POST', '/api/maps/{map_id}/history/{revision:int}/restore', 'handle_map_history', WRITE),
+    ('GET', '/api/events', 'handle_events', {'stream': True}),
+    ('GET', '/api/tiles/duplicates', 'handle_tile_duplicates', SCAN),
+    ('POST', '/api/tiles/dedupe', 'handle_tile_dedupe', WRITE),
+    ('GET', '/api/assets/manifest', 'handle_asset_manifest', {}),
+    ('GET', '/api/batch', 'handle_batch', {}),
+    ('POST', '/api/batch', 'handle_batch', {}),
+    ('GET', '/api/items', 'handle_data_query', {}),
+    ('GET', '/api/abilities', 'handle_data_query', {}),
+    ('GET', '/api/peoples', 'handle_data_query', {}),
+    ('GET', '/api/bundle/{name:path}', 'handle_bundle', {}),
+    ('POST', '/api/save-abilities', 'handle_save_abilities', WRITE),
+    ('POST', '/api/save-peoples', 'handle_save_peoples', WRITE),
+    # Unknown API paths are 404s for every method, never static files
+    ('GET', '/api/{rest:path}', 'handle_unknown_api', {}),
+    ('POST', '/api/{rest:path}', 'handle_unknown_api', {}),
+    ('GET', '/blobs/{name}', 'handle_blob', STATIC),
+    ('GET', '/{file_path:path}', 'handle_static', STATIC),
+)
+
+router = Router()
+for method, pattern, handler_name, options in ROUTES:
+    router.add(method, pattern, handler_name, **options)
+for method, routes, options in (('GET', TileEditorRoutes.TILE_EDITOR_GET_ROUTES, SCAN),
+                                ('POST', TileEditorRoutes.TILE_EDITOR_POST_ROUTES, WRITE)):
+    for pattern, handler_name in routes.items():
+        router.add(method, pattern, handler_name, **options)
+
+# Outermost layer first: metrics see the final status (429s included), rate
+# limits reject before any work, conditional GET compares the ETag of the
+# encoding actually sent, and coalesced requests and the response cache
+# share uncompressed bodies
+pipeline = Pipeline(lambda handler, route: getattr(handler, route.handler)())
+pipeline.use(RouteMetrics())
+pipeline.use(RateLimit())
+pipeline.use(BufferResponses())
+pipeline.use(ConditionalGet())
+pipeline.use(Compression())
+pipeline.use(Coalesce())
+pipeline.use(ResponseCache())
+
+# Data files changed by any route re-sync the game data store
+caches.register_invalidator(data_store.invalidate)
+# Every committed map file becomes a revision in the map history
+map_store.register_commit_hook(map_history.record)
+
+# Server backends selectable at startup (--backend or WOODCHUNK_BACKEND)
+BACKENDS = ('sync', 'threaded', 'asyncio')
+DEFAULT_BACKEND = os.environ.get('WOODCHUNK_BACKEND', 'sync')
+
+class WoodChunkHandler(TileEditorRoutes, http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests"""
+        self.dispatch_request()
+    
+    def do_POST(self):
+        """Handle POST requests"""
+        self.dispatch_request()
+    
+    def dispatch_request(self):
+        """Match the request to a route and run it through the middleware pipeline
         
-        # Handle API endpoints
-        if self.path.startswith('/api/'):
-            self.handle_api_get()
+        The path and query string are parsed once here: handlers read
+        self.request_path, self.query_params (parse_qs) and self.path_params.
+        """
+        url = urlsplit(self.path)
+        self.request_path = url.path
+        self.query_params = parse_qs(url.query)
+        self.response = None
+        route, params = router.match(self.command, url.path)
+        if route is None:
+            if params:
+                self.send_response(405)
+                self.send_header('Allow', ', '.join(params))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif url.path.startswith('/api/'):
+                self.send_error(404, f"API endpoint not found: {url.path}")
+            else:
+                self.send_error(404, f"File not found: {url.path}")
             return
         
-        # Handle root path
-        if self.path == '/':
-            self.path = '/index.html'
-        
-        # Handle cache busting for all files
-        if '?' in self.path:
-            # Extract the actual file path without query parameters
-            actual_path = self.path.split('?')[0]
-            if os.path.exists(actual_path.lstrip('/')):
-                self.path = actual_path
-        
-        # Check if file exists before serving
-        file_path = self.path.lstrip('/')
-        
-        if os.path.exists(file_path):
-            self.serve_file(file_path)
-            return
-        else:
-            self.send_error(404, f"File not found: {self.path}")
-            return
+        self.path_params = params
+        try:
+            pipeline(self, route)
+        except Exception as e:
+            print(f"[Server] API Error: {e}")
+            self.send_error(500, f"Internal server error: {e}")
     
-    def do_POST(self):
-        """Handle POST requests"""
+    def log_request(self, code='-', size='-'):
+        """Log the response status (also read by the route metrics)"""
+        self.response_status = code
+        super().log_request(code, size)
+    
+    def handle_unknown_api(self):
+        """Answer /api/ paths that have no route"""
+        self.send_error(404, f"API endpoint not found: {self.request_path}")
+    
+    def handle_static(self):
+        """Serve a file of the tree; / serves index.html
         
-        # Handle API endpoints
-        if self.path.startswith('/api/'):
-            self.handle_api_post()
+        Pages requested with ?bundle=1 load their scripts as bundles.
+        Query strings (cache busting) are ignored otherwise.
+        """
+        file_path = self.path_params['file_path'] or 'index.html'
+        if self.query_params.get('bundle') == ['1'] and file_path.endswith('.html'):
+            self.serve_bundled_page(file_path)
             return
-        else:
-            self.send_error(404, f"POST endpoint not found: {self.path}")
+        
+        stat = None
+        if inside_root(file_path):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                pass
+        if stat is None or not S_ISREG(stat.st_mode):
+            self.send_error(404, f"File not found: {self.request_path}")
             return
+        self.serve_file(file_path, stat=stat)
     
-    def serve_file(self, file_path):
-        """Serve a file with proper headers"""
+    def serve_file(self, file_path, cache_control=None, stat=None):
+        """Serve a file with proper headers; stat is the file's os.stat() if already known"""
         try:
             # Get file extension for content type
             file_ext = os.path.splitext(file_path)[1].lower()
             content_type = self.get_content_type(file_ext)
+            if stat is None:
+                stat = os.stat(file_path)
+            size = stat.st_size
+            
+            # PNGs are served from their optimized variant (WebP if the
+            # client accepts it) once the image pipeline has built one
+            body_path = file_path
+            if file_ext == '.png':
+                variant = image_variants.variant_for(file_path, self.headers.get('Accept', ''))
+                if variant is not None:
+                    body_path, content_type = variant
+                    size = os.path.getsize(body_path)
             
             # Set response headers
             self.send_response(200)
             self.send_header('Content-Type', content_type)
-            self.set_cache_headers(file_path)
+            self.send_header('Content-Length', str(size))
+            if file_ext == '.png':
+                self.send_header('Vary', 'Accept')
+            if cache_control:
+                self.send_header('Cache-Control', cache_control)
+            else:
+                self.set_cache_headers(file_path, stat.st_mtime)
             self.end_headers()
             
             # Read and send file content
-            with open(file_path, 'rb') as f:
-                self.wfile.write(f.read())
+            self.send_file_body(body_path)
                 
         except Exception as e:
             self.send_error(500, f"Error serving file: {e}")
     
+    def handle_blob(self):
+        """Handle /blobs/<sha256>.<ext> - one canonical URL per distinct tile image"""
+        name = self.path_params['name']
+        digest, ext = os.path.splitext(name)
+        file_path = tile_store.path_for(digest) if re.fullmatch(r'[0-9a-f]{64}', digest) else None
+        if (file_path is None or os.path.splitext(file_path)[1].lower() != ext.lower()
+                or not inside_root(file_path)):
+            self.send_error(404, f"Blob not found: {name}")
+            return
+        
+        # The URL names the content, so it can be cached forever
+        self.serve_file(file_path, cache_control='public, max-age=31536000, immutable')
+    
+    def send_file_body(self, file_path):
+        """Send file content from the shared asset cache or from disk"""
+        data = asset_cache.get(file_path)
+        if data is not None:
+            self.wfile.write(data)
+        else:
+            self.stream_file_body(file_path)
+    
+    def stream_file_body(self, file_path):
+        """Stream a (large) file to the client"""
+        with open(file_path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+    
     def get_content_type(self, file_ext):
         """Get MIME content type for file extension"""
-        content_types = {
-            '.html': 'text/html',
-            '.htm': 'text/html',
-            '.js': 'application/javascript',
-            '.css': 'text/css',
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.svg': 'image/svg+xml',
-            '.ico': 'image/x-icon',
-            '.json': 'application/json',
-            '.txt': 'text/plain'
-        }
-        return content_types.get(file_ext, 'application/octet-stream')
+        return CONTENT_TYPES.get(file_ext, 'application/octet-stream')
     
-    def set_cache_headers(self, file_path):
+    def set_cache_headers(self, file_path, mtime=None):
         """Set appropriate cache headers based on file type"""
         # Get file extension
         file_ext = os.path.splitext(file_path)[1].lower()
@@ -110,7 +318,9 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
         elif file_ext in ['.js', '.css']:
             # JS/CSS files: cache for 1 hour with version query param
             self.send_header('Cache-Control', 'public, max-age=3600')
-            self.send_header('ETag', f'"v1.0-{os.path.getmtime(file_path)}"')
+            if mtime is None:
+                mtime = os.path.getmtime(file_path)
+            self.send_header('ETag', f'"v1.0-{mtime}"')
         elif file_ext in ['.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico']:
             # Images: cache for 1 day
             self.send_header('Cache-Control', 'public, max-age=86400')
@@ -118,71 +328,234 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
             # Default: no cache
             self.send_header('Cache-Control', 'no-cache')
     
-    def handle_api_get(self):
-        """Handle API GET requests"""
-        try:
-            if self.path == '/api/status':
-                self.handle_status()
-            elif self.path == '/api/scan-items':
-                self.handle_scan_items()
-            elif self.path == '/api/load-abilities':
-                self.handle_load_abilities()
-            elif self.path == '/api/scan-abilities':
-                self.handle_scan_abilities()
-            elif self.path.startswith('/api/biomes'):
-                self.handle_biomes_api()
-            elif self.path == '/api/maps':
-                self.handle_load_maps()
-            else:
-                self.send_error(404, f"API endpoint not found: {self.path}")
-        except Exception as e:
-            print(f"[Server] API Error: {e}")
-            self.send_error(500, f"Internal server error: {e}")
-    
-    def handle_api_post(self):
-        """Handle API POST requests"""
-        try:
-            if self.path == '/api/maps/save':
-                self.handle_save_map()
-            elif self.path == '/api/save-peoples':
-                self.handle_save_peoples()
-            else:
-                self.send_error(404, f"POST API endpoint not found: {self.path}")
-        except Exception as e:
-            print(f"[Server] POST API Error: {e}")
-            self.send_error(500, f"Internal server error: {e}")
-    
     def handle_status(self):
         """Handle /api/status endpoint"""
         try:
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
             status_data = {
                 'status': 'running',
                 'timestamp': datetime.now().isoformat(),
-                'server': 'WoodChunk 1.5'
+                'server': 'WoodChunk 1.5',
+                'backend': getattr(self.server, 'backend_name', 'sync'),
+                'assetCache': asset_cache.stats(),
+                'jsonBackend': JSON_BACKEND,
+                'imageVariants': image_variants.stats(),
+                'tileStore': tile_store.stats(),
+                'assetManifest': asset_manifest.stats(),
+                'dataStore': data_store.stats(),
+                'mapPreviews': map_previews.stats(),
+                'mapHistory': map_history.stats(),
+                'fileLocks': file_locks.stats(),
+                'router': {'routes': len(router.routes), **pipeline.stats()},
+                'ready': warmup.ready(),
+                'indexes': warmup.status()
             }
             
-            self.wfile.write(json.dumps(status_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, status_data)
             
         except Exception as e:
             self.send_error(500, f"Error serving status: {e}")
     
-    def handle_biomes_api(self):
-        """Handle biome-related API endpoints"""
+    def handle_asset_manifest(self):
+        """Handle /api/assets/manifest[?from=<version>] endpoint"""
+        try:
+            params = self.query_params
+            since = params.get('from', [None])[0]
+            version = asset_manifest.version()
+            
+            if since is None:
+                send_cached_json(self, 'asset-manifest', version,
+                                 lambda: {'success': True, **asset_manifest.full()})
+                return
+            
+            try:
+                since = int(since)
+            except ValueError:
+                self.send_error(400, f"Invalid manifest version: {since}")
+                return
+            
+            # Only the entries changed after `since` (the full list if it is too old)
+            send_cached_json(self, f'asset-manifest-from-{since}', version,
+                             lambda: {'success': True, **asset_manifest.diff(since)})
+            
+        except Exception as e:
+            print(f"[Server] Error building asset manifest: {e}")
+            self.send_error(500, f"Error building asset manifest: {e}")
+    
+    def handle_tile_duplicates(self):
+        """Handle /api/tiles/duplicates endpoint"""
+        try:
+            send_json(self, {'success': True, **tile_store.duplicates()})
+            
+        except Exception as e:
+            print(f"[Server] Error scanning tile duplicates: {e}")
+            self.send_error(500, f"Error scanning tile duplicates: {e}")
+    
+    def handle_tile_dedupe(self):
+        """Handle /api/tiles/dedupe POST endpoint - hardlink identical tile images"""
+        try:
+            options = read_json(self, empty={})
+            
+            result = tile_store.dedupe(dry_run=bool(options.get('dryRun')))
+            if result['linked'] and not result['dryRun']:
+                caches.invalidate_paths(result['linked'], reason='tiles-changed')
+            
+            print(f"[Server] Tile dedupe: {len(result['linked'])} files linked, {result['savedBytes']} bytes saved")
+            send_json(self, {'success': True, **result})
+            
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except json.JSONDecodeError as e:
+            self.send_error(400, f"Invalid JSON data: {e}")
+        except Exception as e:
+            print(f"[Server] Error deduplicating tiles: {e}")
+            self.send_error(500, f"Error deduplicating tiles: {e}")
+    
+    def handle_batch(self):
+        """Handle /api/batch - several GET API requests in one round-trip
+        
+        POST a JSON list of paths (or {"requests": [{"id", "path", "headers"}]}),
+        or GET /api/batch?path=...&path=...
+        """
+        try:
+            if self.command == 'POST':
+                data = read_json(self)
+            else:
+                data = self.query_params.get('path', [])
+            
+            try:
+                items = batch.parse_items(data)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            
+            responses = batch.run_batch(WoodChunkHandler, items, self.headers,
+                                        server=self.server, client_address=self.client_address)
+            send_json(self, {'success': True, 'responses': responses, 'count': len(items)})
+            
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except json.JSONDecodeError as e:
+            self.send_error(400, f"Invalid JSON data: {e}")
+        except Exception as e:
+            print(f"[Server] Error running batch: {e}")
+            self.send_error(500, f"Error running batch: {e}")
+    
+    def handle_events(self):
+        """Handle /api/events endpoint (Server-Sent Events)"""
+        # Holding an event stream open would pin one of the blocking server's
+        # threads per client, so streams are only offered by the asyncio backend
+        self.send_error(501, "Event stream requires the asyncio backend (--backend asyncio)")
+    
+    def handle_bundle(self):
+        """Handle /api/bundle/<editor>[.js|.js.map] endpoints"""
         try:
-            if self.path == '/api/biomes/folders':
-                self.handle_biome_folders()
-            elif self.path == '/api/biomes/categories':
-                self.handle_biome_categories()
-            elif self.path == '/api/biomes/tiles':
-                self.handle_biome_tiles()
+            params = self.query_params
+            name = self.path_params['name']
+            
+            kind = 'manifest'
+            for suffix, suffix_kind in (('.js.map', 'map'), ('.js', 'code')):
+                if name.endswith(suffix):
+                    name, kind = name[:-len(suffix)], suffix_kind
+                    break
+            
+            page_path = bundler.resolve_editor_page(name)
+            if page_path is None:
+                self.send_error(404, f"Unknown editor: {name}")
+                return
+            
+            if kind == 'manifest':
+                bundles = bundler.bundle_cache.versions(page_path)
+                response_data = {
+                    'success': True,
+                    'editor': name,
+                    'page': page_path,
+                    'segments': [{
+                        'part': part,
+                        'version': bundle.version,
+                        'url': f'/api/bundle/{name}.js?part={part}&v={bundle.version}',
+                        'files': bundle.files
+                    } for part, bundle in enumerate(bundles)]
+                }
+                send_json(self, response_data, headers={'Cache-Control': 'no-cache'})
+                return
+            
+            try:
+                part = int(params.get('part', ['0'])[0])
+            except ValueError:
+                self.send_error(400, "Invalid part parameter")
+                return
+            
+            bundle = bundler.bundle_cache.get(page_path, part)
+            if bundle is None:
+                self.send_error(404, f"Bundle part {part} not found for {name}")
+                return
+            
+            isolate = params.get('isolate', ['0'])[0] == '1'
+            if kind == 'code' and isolate:
+                kind = 'isolated'
+            etag = f'"{bundle.version}-{kind}"'
+            variant = variant_etag(self, etag)
+            if etag_matches(self.headers.get('If-None-Match'), variant):
+                self.send_response(304)
+                self.send_header('ETag', variant)
+                if variant != etag:
+                    self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+            
+            if kind == 'map':
+                body = bundle.source_map(f'{name.split("/")[-1]}.js')
+                content_type = 'application/json'
+            elif kind == 'isolated':
+                body = bundle.isolated_code()
+                content_type = 'application/javascript'
+            else:
+                body = bundle.code
+                if bundler.BUNDLE_SOURCE_MAPS and params.get('sourcemap', ['1'])[0] != '0':
+                    map_url = f'/api/bundle/{name}.js.map?part={part}&v={bundle.version}'
+                    body += f'\n//# sourceMappingURL={map_url}\n'.encode('utf-8')
+                content_type = 'application/javascript'
+            
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            if params.get('v', [None])[0] == bundle.version:
+                # Versioned URLs never change content
+                self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
             else:
-                self.send_error(404, f"Biome API endpoint not found: {self.path}")
+                self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(body)
+        
+        except Exception as e:
+            print(f"[Server] Error serving bundle: {e}")
+            self.send_error(500, f"Error serving bundle: {e}")
+    
+    def serve_bundled_page(self, page_path):
+        """Serve an editor page with its script segments replaced by bundles"""
+        try:
+            if not inside_root(page_path) or not os.path.isfile(page_path):
+                self.send_error(404, f"File not found: {page_path}")
+                return
+            
+            with open(page_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            
+            bundles = bundler.bundle_cache.versions(page_path)
+            isolate = self.query_params.get('isolate') == ['1']
+            body = bundler.rewrite_page(page_path, html, bundles, isolate).encode('utf-8')
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.set_cache_headers(page_path)
+            self.end_headers()
+            self.wfile.write(body)
+        
         except Exception as e:
-            self.send_error(500, f"Biome API error: {e}")
+            print(f"[Server] Error serving bundled page: {e}")
+            self.send_error(500, f"Error serving bundled page: {e}")
     
     def handle_biome_folders(self):
         """Handle /api/biomes/folders endpoint"""
@@ -208,10 +581,7 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
                 'biomes': biome_folders
             }
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, response_data)
             
         except Exception as e:
             print(f"[Server] Error serving biomes folders: {e}")
@@ -221,41 +591,65 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
         """Handle /api/biomes/categories endpoint"""
         try:
             # Simple implementation - can be enhanced later
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
             response_data = {
                 'success': True,
                 'categories': [],
                 'message': 'Categories endpoint - to be implemented'
             }
             
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, response_data)
             
         except Exception as e:
             self.send_error(500, f"Error serving categories: {e}")
     
+    def handle_data_query(self):
+        """Handle /api/items, /api/abilities and /api/peoples filtered queries
+        
+        e.g. /api/abilities?availableFor=elves&level<=3 or
+        /api/items?category=weapons,armor&sort=-level&limit=20
+        """
+        try:
+            if not data_store.available:
+                self.send_error(503, "Game data store requires sqlite3")
+                return
+            
+            table = self.request_path[len('/api/'):]
+            query = urlsplit(self.path).query
+            try:
+                filters, options = parse_query(table, query)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            
+            def build_response():
+                records, total = data_store.query(table, filters, **options)
+                # Records embed their stored JSON as is (RawJson)
+                return {'success': True, table: StreamedList(records), 'count': len(records), 'total': total}
+            
+            key = f"{table}-{hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]}"
+            send_cached_json(self, key, data_store.sync(), build_response)
+            
+        except Exception as e:
+            print(f"[Server] Error querying {table}: {e}")
+            self.send_error(500, f"Error querying {table}: {e}")
+    
     def handle_load_abilities(self):
         """Handle /api/load-abilities endpoint"""
         try:
             abilities_path = Path('assets/abilities/abilities.json')
             
             if abilities_path.exists():
-                with open(abilities_path, 'r', encoding='utf-8') as f:
-                    abilities_data = json.load(f)
+                version, size = files_stamp(str(abilities_path))
                 
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                
-                response_data = {
-                    'status': 'success',
-                    'abilities': abilities_data.get('abilities', []),
-                    'message': f'Loaded {len(abilities_data.get("abilities", []))} abilities'
-                }
+                def build_response():
+                    abilities_data = read_json_file(abilities_path)
+                    return {
+                        'status': 'success',
+                        'abilities': abilities_data.get('abilities', []),
+                        'message': f'Loaded {len(abilities_data.get("abilities", []))} abilities'
+                    }
                 
-                self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+                send_cached_json(self, 'load-abilities', version, build_response, size_hint=size)
             else:
                 self.send_error(404, 'abilities.json not found')
                 
@@ -266,60 +660,62 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
     def handle_scan_abilities(self):
         """Handle /api/scan-abilities endpoint"""
         try:
-            abilities_dir = Path('assets/abilities')
-            abilities_data = {}
-            
-            if abilities_dir.exists():
-                # Scan each category directory
-                for category_dir in abilities_dir.iterdir():
-                    if category_dir.is_dir() and category_dir.name != 'abilities':
-                        category_name = category_dir.name
-                        abilities_data[category_name] = {
-                            'abilities': []
-                        }
-                        
-                        # Scan JS files in category directory and load their content
-                        for js_file in category_dir.glob('*.js'):
-                            try:
-                                # Read the JS file content
-                                with open(js_file, 'r', encoding='utf-8') as f:
-                                    content = f.read()
-                                    
-                                # Parse the JS object (remove parentheses and parse as JSON)
-                                json_content = content.strip()
-                                if json_content.startswith('({') and json_content.endswith('})'):
-                                    json_content = json_content[1:-1]  # Remove outer parentheses
-                                
-                                ability_data = json.loads(json_content)
-                                
-                                abilities_data[category_name]['abilities'].append({
-                                    'file': js_file.name,
-                                    'path': str(js_file).replace('\\', '/'),
-                                    'data': ability_data
-                                })
-                            except Exception as e:
-                                print(f"[Server] Error reading ability file {js_file.name}: {e}")
-                                # Fallback: just add file info without data
-                                abilities_data[category_name]['abilities'].append({
-                                    'file': js_file.name,
-                                    'path': str(js_file).replace('\\', '/')
-                                })
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
-            response_data = {
-                'status': 'success',
-                'abilities': abilities_data,
-                'message': f'Scanned {len(abilities_data)} ability categories'
-            }
-            
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            # Served from the response cache until an ability file changes
+            version, size = files_stamp('assets/abilities', extensions=('.js',))
+            send_cached_json(self, 'scan-abilities', version, self.scan_abilities, size_hint=size)
             
         except Exception as e:
             print(f"[Server] Error scanning abilities: {e}")
             self.send_error(500, f"Error scanning abilities: {e}")
+    
+    def scan_abilities(self):
+        """Parse the ability JS files of every category folder"""
+        abilities_dir = Path('assets/abilities')
+        abilities_data = {}
+        
+        if abilities_dir.exists():
+            # Scan each category directory
+            for category_dir in abilities_dir.iterdir():
+                if category_dir.is_dir() and category_dir.name != 'abilities':
+                    category_name = category_dir.name
+                    abilities_data[category_name] = {
+                        'abilities': []
+                    }
+                    
+                    # Scan JS files in category directory and load their content
+                    for js_file in category_dir.glob('*.js'):
+                        try:
+                            # Read the JS file content
+                            with open(js_file, 'r', encoding='utf-8') as f:
+                                content = f.read()
+                                
+                            # Parse the JS object (remove parentheses and parse as JSON)
+                            json_content = content.strip()
+                            if json_content.startswith('({') and json_content.endswith('})'):
+                                json_content = json_content[1:-1]  # Remove outer parentheses
+                            
+                            ability_data = json.loads(json_content)
+                            
+                            abilities_data[category_name]['abilities'].append({
+                                'file': js_file.name,
+                                'path': str(js_file).replace('\\', '/'),
+                                'data': ability_data
+                            })
+                        except Exception as e:
+                            print(f"[Server] Error reading ability file {js_file.name}: {e}")
+                            # Fallback: just add file info without data
+                            abilities_data[category_name]['abilities'].append({
+                                'file': js_file.name,
+                                'path': str(js_file).replace('\\', '/')
+                            })
+        
+        response_data = {
+            'status': 'success',
+            'abilities': abilities_data,
+            'message': f'Scanned {len(abilities_data)} ability categories'
+        }
+        
+        return response_data
 
     def handle_scan_items(self):
         """Handle /api/scan-items endpoint"""
@@ -329,198 +725,482 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_error(404, "Items directory not found")
                 return
             
-            # Scan all item categories
-            items_data = {}
-            materials_list = []
-            
-            for category in os.listdir(items_path):
-                category_path = os.path.join(items_path, category)
-                if os.path.isdir(category_path) and category != 'classes':
-                    category_items = []
-                    
-                    # Scan all JS files in the category
-                    for file_name in os.listdir(category_path):
-                        if file_name.endswith('.js') and file_name != 'columns.js':
-                            file_path = os.path.join(category_path, file_name)
-                            relative_path = f'assets/items/{category}/{file_name}'
-                            
-                            category_items.append({
-                                'file': file_name,
-                                'path': relative_path
-                            })
-                            
-                            # If it's a materials category, also add to materials list
-                            if category == 'materials':
-                                try:
-                                    with open(file_path, 'r', encoding='utf-8') as f:
-                                        content = f.read()
-                                        # Extract material name from JS file
-                                        name_match = re.search(r'name:\s*["\']([^"\']+)["\']', content)
-                                        material_match = re.search(r'material:\s*["\']([^"\']+)["\']', content)
-                                        
-                                        if name_match and material_match:
-                                            materials_list.append({
-                                                'name': name_match.group(1),
-                                                'material': material_match.group(1)
-                                            })
-                                except Exception as e:
-                                    print(f"[Server] Error reading material file {file_name}: {e}")
-                    
-                    items_data[category] = {
-                        'items': category_items
-                    }
-            
-            # Return the items data
-            response_data = {
-                'status': 'success',
-                'items': items_data,
-                'materials': materials_list
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            # Served from the response cache until an item file changes
+            version, size = files_stamp(items_path, extensions=('.js',))
+            send_cached_json(self, 'scan-items', version, self.scan_items,
+                             headers={'Access-Control-Allow-Origin': '*'}, size_hint=size)
             
         except Exception as e:
             print(f"[Server] Error scanning items: {e}")
             self.send_error(500, f"Error scanning items: {e}")
     
+    def scan_items(self):
+        """List the item JS files of every category and collect the materials"""
+        items_path = 'assets/items'
+        
+        # Scan all item categories
+        items_data = {}
+        materials_list = []
+        
+        for category in os.listdir(items_path):
+            category_path = os.path.join(items_path, category)
+            if os.path.isdir(category_path) and category != 'classes':
+                category_items = []
+                
+                # Scan all JS files in the category
+                for file_name in os.listdir(category_path):
+                    if file_name.endswith('.js') and file_name != 'columns.js':
+                        file_path = os.path.join(category_path, file_name)
+                        relative_path = f'assets/items/{category}/{file_name}'
+                        
+                        category_items.append({
+                            'file': file_name,
+                            'path': relative_path
+                        })
+                        
+                        # If it's a materials category, also add to materials list
+                        if category == 'materials':
+                            try:
+                                with open(file_path, 'r', encoding='utf-8') as f:
+                                    content = f.read()
+                                    # Extract material name from JS file
+                                    name_match = re.search(r'name:\s*["\']([^"\']+)["\']', content)
+                                    material_match = re.search(r'material:\s*["\']([^"\']+)["\']', content)
+                                    
+                                    if name_match and material_match:
+                                        materials_list.append({
+                                            'name': name_match.group(1),
+                                            'material': material_match.group(1)
+                                        })
+                            except Exception as e:
+                                print(f"[Server] Error reading material file {file_name}: {e}")
+                
+                items_data[category] = {
+                    'items': category_items
+                }
+        
+        # Return the items data
+        response_data = {
+            'status': 'success',
+            'items': items_data,
+            'materials': materials_list
+        }
+        
+        return response_data
+    
     def handle_biome_tiles(self):
         """Handle /api/biomes/tiles endpoint"""
         try:
-            # Simple implementation - can be enhanced later
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
+            # Tile images of all biomes from the shared tile index, each with
+            # the canonical URL of its content
+            all_images = tile_index.all_images()
+            blobs = tile_store.blob_urls([path for paths in all_images.values() for path in paths])
+            tiles = [
+                {'biome': biome, 'path': path, 'blob': blobs.get(path)}
+                for biome, paths in all_images.items()
+                for path in paths
+            ]
             
             response_data = {
                 'success': True,
-                'tiles': [],
-                'message': 'Tiles endpoint - to be implemented'
+                'tiles': tiles,
+                'count': len(tiles)
             }
             
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, response_data)
             
         except Exception as e:
             self.send_error(500, f"Error serving tiles: {e}")
     
     def handle_save_map(self):
-        """Handle /api/maps/save POST endpoint"""
+        """Handle /api/maps/save POST endpoint
+        
+        The body is parsed and written to the map file as it arrives (see
+        map_store), so large maps are never held in memory as a whole. The
+        map is analyzed in the same pass; with ?strict=1 a map with issues
+        (duplicate coordinates, orphaned streets, ...) is rejected with 422.
+        """
         try:
-            # Read request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
-            # Parse JSON data
-            map_data = json.loads(post_data.decode('utf-8'))
-            
-            # Validate required fields
-            if 'name' not in map_data or 'data' not in map_data:
-                self.send_error(400, "Missing required fields: name and data")
+            strict = self.query_params.get('strict', ['0'])[-1] not in ('0', 'false', '')
+            stream = JsonStream(open_body(self, MAX_MAP_BODY))
+            try:
+                saved = map_store.save_map(stream, strict=strict)
+            except map_store.MapValidationError as e:
+                send_json(self, {'success': False, 'error': str(e), 'analysis': e.analysis}, status=422)
                 return
             
-            # Ensure maps directory exists
-            maps_dir = Path('assets/maps')
-            maps_dir.mkdir(exist_ok=True)
-            
-            # Create filename from map name (sanitize for filesystem)
-            safe_name = re.sub(r'[^\w\-_\.]', '_', map_data['name'])
-            filename = f"{safe_name}.json"
-            file_path = maps_dir / filename
-            
-            # Add metadata
-            map_file_data = {
-                'id': map_data.get('id', str(int(datetime.now().timestamp() * 1000))),
-                'name': map_data['name'],
-                'timestamp': map_data.get('timestamp', int(datetime.now().timestamp() * 1000)),
-                'data': map_data['data'],
-                'tilesCount': map_data.get('tilesCount', 0),
-                'settings': map_data.get('settings', {}),
-                'version': '1.0',
-                'savedAt': datetime.now().isoformat()
-            }
-            
-            # Write map file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(map_file_data, f, ensure_ascii=False, indent=2)
-            
             # Send success response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
             response_data = {
                 'success': True,
-                'message': f'Map "{map_data["name"]}" saved successfully',
-                'filename': filename,
-                'path': str(file_path)
+                'message': f'Map "{saved["name"]}" saved successfully',
+                'filename': saved['filename'],
+                'path': saved['path'],
+                'analysis': saved['analysis']
             }
             
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, response_data)
             
-            print(f"[Server] Map saved: {file_path}")
+            issues = saved['analysis']['issues']
+            print(f"[Server] Map saved: {saved['path']} ({saved['tiles']} tiles"
+                  + (f", {len(issues)} issues)" if issues else ")"))
+            map_index.invalidate(saved['filename'])
+            map_previews.enqueue_thumbnail(saved['path'])
+            events.publish('map-saved', {'name': saved['name'], 'filename': saved['filename']})
             
+        except BodyError as e:
+            self.send_error(e.status, e.message)
         except json.JSONDecodeError as e:
             self.send_error(400, f"Invalid JSON data: {e}")
+        except ValueError as e:
+            self.send_error(400, str(e))
+        except LockTimeout as e:
+            self.send_error(503, str(e))
         except Exception as e:
             print(f"[Server] Error saving map: {e}")
             self.send_error(500, f"Error saving map: {e}")
     
+    def handle_generate_map(self):
+        """Handle /api/maps/generate POST endpoint - procedural map from a seed
+        
+        Body: {"name", "seed", "width", "height", "scale", "seaLevel",
+        "moisture", "falloff"}, all optional (see map_generator). The map is
+        written like a saved map; the response includes the seed used.
+        """
+        try:
+            params = read_json(self, empty={})
+            if not isinstance(params, dict):
+                self.send_error(400, "Expected a JSON object")
+                return
+            
+            saved = map_generator.generate_map(params)
+            
+            send_json(self, {
+                'success': True,
+                'message': f'Map "{saved["name"]}" generated',
+                'filename': saved['filename'],
+                'path': saved['path'],
+                'tiles': saved['tiles'],
+                'options': saved['options'],
+                'elapsed': saved['elapsed'],
+                'analysis': saved['analysis']
+            })
+            
+            print(f"[Server] Map generated: {saved['path']} ({saved['tiles']} tiles, "
+                  f"seed {saved['options']['seed']}, {saved['elapsed']}s)")
+            map_index.invalidate(saved['filename'])
+            map_previews.enqueue_thumbnail(saved['path'])
+            events.publish('map-saved', {'name': saved['name'], 'filename': saved['filename']})
+            
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except json.JSONDecodeError as e:
+            self.send_error(400, f"Invalid JSON data: {e}")
+        except ValueError as e:
+            self.send_error(400, str(e))
+        except LockTimeout as e:
+            self.send_error(503, str(e))
+        except Exception as e:
+            print(f"[Server] Error generating map: {e}")
+            self.send_error(500, f"Error generating map: {e}")
+    
     def handle_load_maps(self):
-        """Handle /api/maps GET endpoint"""
+        """Handle /api/maps GET endpoint
+        
+        ?summary=1 lists the index metadata with each map's analysis instead
+        of the full maps, so no tile data is read for maps already analyzed.
+        """
         try:
-            maps_dir = Path('assets/maps')
+            if self.query_params.get('summary', ['0'])[-1] not in ('0', 'false', ''):
+                self.handle_map_summaries()
+                return
             
-            if not maps_dir.exists():
-                # Return empty list if maps directory doesn't exist
-                maps_list = []
-            else:
-                maps_list = []
-                
-                # Scan for JSON files in maps directory
-                for json_file in maps_dir.glob('*.json'):
+            # Metadata comes from the map index (newest first); full maps are
+            # read and encoded one at a time so large listings stream out
+            entries = map_index.entries()
+            
+            def iter_maps():
+                for entry in entries:
                     try:
-                        with open(json_file, 'r', encoding='utf-8') as f:
-                            map_data = json.load(f)
-                        
-                        # Add file info
-                        map_data['filename'] = json_file.name
-                        map_data['filepath'] = str(json_file)
-                        maps_list.append(map_data)
-                        
+                        map_data = read_json_file(entry['filepath'])
                     except Exception as e:
-                        print(f"[Server] Error reading map file {json_file}: {e}")
+                        print(f"[Server] Error reading map file {entry['filepath']}: {e}")
                         continue
-                
-                # Sort by timestamp (newest first)
-                maps_list.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+                    
+                    # Add file info
+                    map_data['filename'] = entry['filename']
+                    map_data['filepath'] = entry['filepath']
+                    yield map_data
+            
+            def build_response():
+                maps_list = StreamedList(iter_maps())
+                return {
+                    'success': True,
+                    'maps': maps_list,
+                    'count': Deferred(lambda: maps_list.count)
+                }
+            
+            send_cached_json(self, 'maps', map_index.version(), build_response,
+                             size_hint=map_index.total_bytes())
+            
+        except Exception as e:
+            print(f"[Server] Error loading maps: {e}")
+            self.send_error(500, f"Error loading maps: {e}")
+    
+    def handle_map_summaries(self):
+        """Map listing without tiles: index metadata plus analysis"""
+        def build_response():
+            maps_list = []
+            for entry in map_index.entries():
+                file_path = entry.pop('filepath')
+                entry['thumbnail'] = (f"/api/maps/{quote(entry['filename'])}/thumbnail.png"
+                                      f"?v={map_previews.version(file_path)}")
+                try:
+                    entry['analysis'] = map_index.analysis(entry['filename'])
+                except Exception as e:
+                    print(f"[Server] Error analyzing map {entry['filename']}: {e}")
+                    entry['analysis'] = None
+                maps_list.append(entry)
+            return {'success': True, 'maps': maps_list, 'count': len(maps_list)}
+        
+        send_cached_json(self, 'map-summaries', map_index.version(), build_response)
+    
+    def handle_map_analysis(self):
+        """Handle /api/maps/<id>/analysis - tile statistics and validation of one map
+        
+        Served from the map index; ?refresh=1 re-analyzes the map file.
+        """
+        try:
+            map_id = self.path_params['map_id']
+            refresh = self.query_params.get('refresh', ['0'])[-1] not in ('0', 'false', '')
+            entry = map_index.find(map_id)
+            if entry is None:
+                self.send_error(404, f"Map not found: {map_id}")
+                return
+            
+            analysis = map_index.analysis(entry['filename'], recompute=refresh)
+            if analysis is None:
+                self.send_error(404, f"Map not found: {map_id}")
+                return
+            send_json(self, {'success': True, 'map': entry['filename'], 'analysis': analysis})
+            
+        except Exception as e:
+            print(f"[Server] Error analyzing map: {e}")
+            self.send_error(500, f"Error analyzing map: {e}")
+    
+    def handle_map_preview(self):
+        """Handle /api/maps/<id>/preview, /thumbnail.png and /tiles/<z>/<x>/<y>.png
+        
+        Images are rendered on first request (see map_preview) and served
+        from the preview cache; URLs with ?v=<version> are immutable.
+        """
+        try:
+            map_id = self.path_params['map_id']
+            tile = [self.path_params[name] for name in ('z', 'x', 'y') if name in self.path_params]
+            view = self.request_path.rsplit('/', 1)[-1] if not tile else 'tiles-{}-{}-{}.png'.format(*tile)
+            entry = map_index.find(map_id)
+            if entry is None:
+                self.send_error(404, f"Map not found: {map_id}")
+                return
+            file_path = entry['filepath']
+            version = map_previews.version(file_path)
+            
+            if view == 'preview':
+                base = f"/api/maps/{quote(entry['filename'])}"
+                info = map_previews.info(file_path)
+                info['thumbnail'] = f'{base}/thumbnail.png?v={version}'
+                info['tiles'] = f'{base}/tiles/{{z}}/{{x}}/{{y}}.png?v={version}'
+                send_json(self, {'success': True, 'map': entry['filename'], **info})
+                return
+            
+            etag = f'"{version}-{view}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
             
-            # Send response
+            try:
+                if tile:
+                    image_path = map_previews.tile(file_path, *tile)
+                else:
+                    image_path = map_previews.thumbnail(file_path)
+            except map_engine.QueryError as e:
+                self.send_error(400, str(e))
+                return
+            if image_path is None:
+                self.send_error(404, f"Preview tile not found: {view}")
+                return
+            
+            with open(image_path, 'rb') as f:
+                body = f.read()
             self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            if self.query_params.get('v', [None])[0] == version:
+                # Versioned URLs never change content
+                self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            else:
+                self.send_header('Cache-Control', 'no-cache')
             self.end_headers()
+            self.wfile.write(body)
             
-            response_data = {
-                'success': True,
-                'maps': maps_list,
-                'count': len(maps_list)
-            }
+        except Exception as e:
+            print(f"[Server] Error serving map preview: {e}")
+            self.send_error(500, f"Error serving map preview: {e}")
+    
+    def handle_map_history(self):
+        """Handle /api/maps/<id>/history - revisions of a map (see map_history)
+        
+        GET .../history lists the revisions, .../history/<n> returns one
+        revision's manifest and .../history/diff?from=<n>&to=<n> compares two
+        (default: the latest against the one before). POST
+        .../history/<n>/restore writes a revision back as a new save; with
+        {"name": ...} in the body it is saved as a copy, which fails with 409
+        if that map exists unless the body also has "overwrite": true. The
+        history of a deleted map can still be listed and restored by its
+        file name.
+        """
+        try:
+            map_id = self.path_params['map_id']
+            target = self.path_params.get('revision')
+            if self.request_path.endswith('/history/diff'):
+                target = 'diff'
+            restore = self.command == 'POST'
+            
+            entry = map_index.find(map_id)
+            map_key = map_history.map_key(entry['filename'] if entry else map_id)
+            revisions = map_history.revisions(map_key) if map_key else []
+            if not revisions:
+                self.send_error(404, f"No history for map: {map_id}")
+                return
+            
+            if target is None:
+                send_json(self, {
+                    'success': True,
+                    'map': map_key,
+                    'revisions': revisions,
+                    'count': len(revisions),
+                    'retention': {'maxRevisions': map_history.max_revisions,
+                                  'maxAgeDays': map_history.max_age_days}
+                })
+            elif target == 'diff':
+                params = self.query_params
+                numbers = [revision['revision'] for revision in revisions]
+                try:
+                    to = int(params.get('to', [numbers[0]])[-1])
+                    older = [number for number in numbers if number < to]
+                    base = int(params.get('from', [older[0] if older else to])[-1])
+                except ValueError:
+                    self.send_error(400, "Revisions must be integers")
+                    return
+                try:
+                    diff = map_history.diff(map_key, base, to)
+                except LookupError as e:
+                    self.send_error(404, str(e))
+                    return
+                send_json(self, {'success': True, 'map': map_key, **diff})
+            elif not restore:
+                try:
+                    manifest = map_history.revision(map_key, target)
+                except LookupError as e:
+                    self.send_error(404, str(e))
+                    return
+                send_json(self, {'success': True, 'map': map_key, 'revision': manifest})
+            else:
+                body = read_json(self, empty={})
+                name = body.get('name') if isinstance(body, dict) else None
+                if name is not None and (not isinstance(name, str) or not name.strip()):
+                    self.send_error(400, "Map name must be a non-empty string")
+                    return
+                overwrite = isinstance(body, dict) and body.get('overwrite') is True
+                try:
+                    saved = map_history.restore(map_key, target, name=name, overwrite=overwrite)
+                except LookupError as e:
+                    self.send_error(404, str(e))
+                    return
+                except FileExistsError as e:
+                    self.send_error(409, f"{e}; send \"overwrite\": true to replace it")
+                    return
+                
+                send_json(self, {
+                    'success': True,
+                    'message': f'Map "{saved["name"]}" restored from revision {target}',
+                    'filename': saved['filename'],
+                    'path': saved['path'],
+                    'restoredFrom': target,
+                    'analysis': saved['analysis']
+                })
+                
+                print(f"[Server] Map restored: {saved['path']} from revision {target} of {map_key}")
+                map_index.invalidate(saved['filename'])
+                map_previews.enqueue_thumbnail(saved['path'])
+                events.publish('map-saved', {'name': saved['name'], 'filename': saved['filename']})
+        
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except json.JSONDecodeError as e:
+            self.send_error(400, f"Invalid JSON data: {e}")
+        except ValueError as e:
+            self.send_error(400, str(e))
+        except LockTimeout as e:
+            self.send_error(503, str(e))
+        except Exception as e:
+            print(f"[Server] Error serving map history: {e}")
+            self.send_error(500, f"Error serving map history: {e}")
+    
+    def handle_map_history_gc(self):
+        """Handle /api/maps/history/gc POST endpoint - apply the retention policy now"""
+        try:
+            result = map_history.collect()
+            send_json(self, {'success': True, **result, 'history': map_history.stats()})
+        except Exception as e:
+            print(f"[Server] Error collecting map history: {e}")
+            self.send_error(500, f"Error collecting map history: {e}")
+    
+    def handle_map_query(self):
+        """Handle /api/maps/<id>/query - radius, flood, components and path queries
+        
+        Parameters come from the query string (GET) or a JSON body (POST),
+        e.g. ?op=radius&q=0&r=0&radius=3 or {"op": "path", "from": [0, 0], "to": [5, 2]}.
+        """
+        try:
+            map_id = self.path_params['map_id']
+            if self.command == 'POST':
+                params = read_json(self)
+                if not isinstance(params, dict):
+                    self.send_error(400, "Expected a JSON object")
+                    return
+            else:
+                params = {name: values[-1] for name, values in self.query_params.items()}
+            
+            entry = map_index.find(map_id)
+            if entry is None:
+                self.send_error(404, f"Map not found: {map_id}")
+                return
+            
+            try:
+                grid = map_engine.load_grid(entry['filepath'])
+                result = map_engine.run_query(grid, params)
+            except map_engine.QueryError as e:
+                self.send_error(400, str(e))
+                return
             
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, {'success': True, 'map': entry['filename'], **result})
             
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except json.JSONDecodeError as e:
+            self.send_error(400, f"Invalid JSON data: {e}")
         except Exception as e:
-            print(f"[Server] Error loading maps: {e}")
-            self.send_error(500, f"Error loading maps: {e}")
-
+            print(f"[Server] Error querying map: {e}")
+            self.send_error(500, f"Error querying map: {e}")
+    
     def handle_save_abilities(self):
         """Handle /api/save-abilities POST endpoint - Save to individual .js files"""
         try:
             # Read JSON data from request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            abilities_data = json.loads(post_data.decode('utf-8'))
+            abilities_data = read_json(self)
             
             # Validate the data structure
             if 'abilities' not in abilities_data:
@@ -538,19 +1218,31 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
                 abilities_by_category[category].append(ability)
             
             saved_files = []
+            abilities_file = os.path.join(os.getcwd(), 'assets', 'abilities', 'abilities.json')
             
-            # Save each ability to its individual .js file
+            # Target file of every ability, from characterData.id; both names
+            # become path components, so they are limited to plain file names
+            targets = []
             for category, abilities in abilities_by_category.items():
+                if not isinstance(category, str) or not ABILITY_FILE_NAME.fullmatch(category):
+                    self.send_error(400, f"Invalid ability category: {category}")
+                    return
                 category_dir = os.path.join(os.getcwd(), 'assets', 'abilities', category)
-                
-                if not os.path.exists(category_dir):
-                    print(f"[Server] Creating category directory: {category_dir}")
-                    os.makedirs(category_dir)
-                
                 for ability in abilities:
-                    # Get the original file name from characterData.id
                     ability_id = ability.get('characterData', {}).get('id', ability.get('name', 'unknown').lower().replace(' ', '_'))
-                    js_file_path = os.path.join(category_dir, f"{ability_id}.js")
+                    if not isinstance(ability_id, str) or not ABILITY_FILE_NAME.fullmatch(ability_id):
+                        self.send_error(400, f"Invalid ability id: {ability_id}")
+                        return
+                    targets.append((category_dir, ability, os.path.join(category_dir, f"{ability_id}.js")))
+            
+            # All files of the save are locked together, so concurrent saves
+            # (other threads or server processes) cannot interleave
+            with file_locks.locked(abilities_file, *(path for _, _, path in targets)):
+                # Save each ability to its individual .js file
+                for category_dir, ability, js_file_path in targets:
+                    if not os.path.exists(category_dir):
+                        print(f"[Server] Creating category directory: {category_dir}")
+                        os.makedirs(category_dir, exist_ok=True)
                     
                     # Create the JS object content
                     js_content = self.create_ability_js_content(ability)
@@ -558,35 +1250,28 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
                     # Create backup if file exists
                     if os.path.exists(js_file_path):
                         backup_path = js_file_path + '.backup'
-                        import shutil
                         shutil.copy2(js_file_path, backup_path)
                         print(f"[Server] Created backup: {backup_path}")
                     
                     # Write the JS file
-                    with open(js_file_path, 'w', encoding='utf-8') as f:
-                        f.write(js_content)
+                    replace_file(js_file_path, js_content)
                     
                     saved_files.append(js_file_path)
                     print(f"[Server] Saved ability '{ability.get('name', 'Unknown')}' to {js_file_path}")
-            
-            # Also save to abilities.json as backup
-            abilities_file = os.path.join(os.getcwd(), 'assets', 'abilities', 'abilities.json')
-            backup_file = abilities_file + '.backup'
-            if os.path.exists(abilities_file):
-                import shutil
-                shutil.copy2(abilities_file, backup_file)
-                print(f"[Server] Created abilities.json backup: {backup_file}")
-            
-            with open(abilities_file, 'w', encoding='utf-8') as f:
-                json.dump(abilities_data, f, ensure_ascii=False, indent=2)
+                
+                # Also save to abilities.json as backup
+                backup_file = abilities_file + '.backup'
+                if os.path.exists(abilities_file):
+                    shutil.copy2(abilities_file, backup_file)
+                    print(f"[Server] Created abilities.json backup: {backup_file}")
+                
+                replace_file(abilities_file, json.dumps(abilities_data, ensure_ascii=False, indent=2))
             
             print(f"[Server] Also saved to abilities.json as backup")
+            caches.invalidate_paths([os.path.relpath(path) for path in saved_files + [abilities_file]],
+                                    reason='files-changed')
             
             # Send success response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
             response_data = {
                 'success': True,
                 'message': f'Abilities saved to {len(saved_files)} individual .js files',
@@ -595,11 +1280,15 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
                 'categories': list(abilities_by_category.keys())
             }
             
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, response_data)
             
+        except BodyError as e:
+            self.send_error(e.status, e.message)
         except json.JSONDecodeError as e:
             print(f"[Server] JSON decode error: {e}")
             self.send_error(400, f"Invalid JSON data: {e}")
+        except LockTimeout as e:
+            self.send_error(503, str(e))
         except Exception as e:
             print(f"[Server] Error saving abilities: {e}")
             self.send_error(500, f"Error saving abilities: {e}")
@@ -638,9 +1327,7 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
         """Handle /api/save-peoples POST endpoint - Save peoples.json"""
         try:
             # Read JSON data from request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            peoples_data = json.loads(post_data.decode('utf-8'))
+            peoples_data = read_json(self)
             
             # Validate the data structure
             if 'peoples' not in peoples_data:
@@ -652,91 +1339,97 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
             # Path to peoples.json file
             peoples_file = os.path.join(os.getcwd(), 'assets', 'peoples', 'peoples.json')
             
-            # Create backup of original file
-            backup_file = peoples_file + '.backup'
-            if os.path.exists(peoples_file):
-                import shutil
-                shutil.copy2(peoples_file, backup_file)
-                print(f"[Server] Created backup: {backup_file}")
-            
-            # Write new data to file
-            with open(peoples_file, 'w', encoding='utf-8') as f:
-                json.dump(peoples_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"[Server] Successfully saved peoples to {peoples_file}")
+            # Map German class names to English file names
+            class_name_mapping = {
+                'Zwerg Schmied': 'dwarf_blacksmith',
+                'Zwerg Bergarbeiter': 'dwarf_miner', 
+                'Zwerg Krieger': 'dwarf_warrior',
+                'Elfen Bogenschütze': 'elven_archer',
+                'Elfen Magier': 'elven_mage',
+                'Elfen Waldläufer': 'elven_ranger',
+                'Goblin Kundschafter': 'goblin_scout',
+                'Goblin Schamane': 'goblin_shaman',
+                'Goblin Krieger': 'goblin_warrior',
+                'Menschlicher Ritter': 'human_knight',
+                'Menschlicher Magier': 'human_mage',
+                'Menschlicher Händler': 'human_merchant',
+                'Ork Berserker': 'orc_berserker',
+                'Ork Häuptling': 'orc_chieftain',
+                'Ork Schamane': 'orc_shaman'
+            }
             
-            # Update individual class files
-            updated_files = []
+            # Determine the individual class file of every people
+            class_files = []
             for people in peoples_data['peoples']:
                 try:
-                    # Determine the individual class file path
                     race = people.get('race', '').lower()
                     class_name = people.get('name', '')
-                    
-                    # Map German class names to English file names
-                    class_name_mapping = {
-                        'Zwerg Schmied': 'dwarf_blacksmith',
-                        'Zwerg Bergarbeiter': 'dwarf_miner', 
-                        'Zwerg Krieger': 'dwarf_warrior',
-                        'Elfen Bogenschütze': 'elven_archer',
-                        'Elfen Magier': 'elven_mage',
-                        'Elfen Waldläufer': 'elven_ranger',
-                        'Goblin Kundschafter': 'goblin_scout',
-                        'Goblin Schamane': 'goblin_shaman',
-                        'Goblin Krieger': 'goblin_warrior',
-                        'Menschlicher Ritter': 'human_knight',
-                        'Menschlicher Magier': 'human_mage',
-                        'Menschlicher Händler': 'human_merchant',
-                        'Ork Berserker': 'orc_berserker',
-                        'Ork Häuptling': 'orc_chieftain',
-                        'Ork Schamane': 'orc_shaman'
-                    }
-                    
                     mapped_class_name = class_name_mapping.get(class_name, class_name.replace(' ', '_').lower())
-                    
-                    print(f"[Server] Processing class: {class_name} -> race: {race}, mapped_class_name: {mapped_class_name}")
-                    
-                    if race and mapped_class_name:
-                        class_file_path = os.path.join(os.getcwd(), 'assets', 'peoples', race, f"{mapped_class_name}.js")
-                        print(f"[Server] Looking for class file: {class_file_path}")
-                        print(f"[Server] File exists: {os.path.exists(class_file_path)}")
-                        
-                        if os.path.exists(class_file_path):
-                            # Read current class file
-                            with open(class_file_path, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                            
-                            # Parse the JS object
-                            json_content = content.strip()
-                            if json_content.startswith('({') and json_content.endswith('})'):
-                                json_content = json_content[1:-1]  # Remove outer parentheses
-                            
-                            class_data = json.loads(json_content)
-                            
-                            # Update abilities field
-                            if 'assignedAbilities' in people and people['assignedAbilities']:
-                                abilities_string = ', '.join(people['assignedAbilities'])
-                                class_data['abilities'] = abilities_string
-                                print(f"[Server] Updated {class_name}.js abilities: {abilities_string}")
-                            else:
-                                class_data['abilities'] = ""
-                                print(f"[Server] Cleared {class_name}.js abilities")
-                            
-                            # Write back to file
-                            with open(class_file_path, 'w', encoding='utf-8') as f:
-                                f.write('(' + json.dumps(class_data, ensure_ascii=False, indent=4) + ')')
-                            
-                            updated_files.append(class_file_path)
-                            
                 except Exception as e:
-                    print(f"[Server] Error updating class file for {people.get('name', 'unknown')}: {e}")
+                    print(f"[Server] Skipping class entry {people!r}: {e}")
                     continue
+                
+                print(f"[Server] Processing class: {class_name} -> race: {race}, mapped_class_name: {mapped_class_name}")
+                
+                if race and mapped_class_name:
+                    class_file_path = os.path.join(os.getcwd(), 'assets', 'peoples', race, f"{mapped_class_name}.js")
+                    print(f"[Server] Looking for class file: {class_file_path}")
+                    print(f"[Server] File exists: {os.path.exists(class_file_path)}")
+                    if os.path.exists(class_file_path):
+                        class_files.append((people, class_file_path))
+            
+            # All files are locked up front: a LockTimeout fails the request
+            # before anything is written instead of leaving a partial save
+            updated_files = []
+            with file_locks.locked(peoples_file, *[path for _, path in class_files]):
+                # Create backup of original file
+                backup_file = peoples_file + '.backup'
+                if os.path.exists(peoples_file):
+                    shutil.copy2(peoples_file, backup_file)
+                    print(f"[Server] Created backup: {backup_file}")
+                
+                # Write new data to file
+                replace_file(peoples_file, json.dumps(peoples_data, ensure_ascii=False, indent=2))
+                print(f"[Server] Successfully saved peoples to {peoples_file}")
+                
+                # Update individual class files
+                for people, class_file_path in class_files:
+                    class_name = people.get('name', '')
+                    try:
+                        # Read current class file
+                        with open(class_file_path, 'r', encoding='utf-8') as f:
+                            content = f.read()
+                        
+                        # Parse the JS object
+                        json_content = content.strip()
+                        if json_content.startswith('({') and json_content.endswith('})'):
+                            json_content = json_content[1:-1]  # Remove outer parentheses
+                        
+                        class_data = json.loads(json_content)
+                        
+                        # Update abilities field
+                        if 'assignedAbilities' in people and people['assignedAbilities']:
+                            abilities_string = ', '.join(people['assignedAbilities'])
+                            class_data['abilities'] = abilities_string
+                            print(f"[Server] Updated {class_name}.js abilities: {abilities_string}")
+                        else:
+                            class_data['abilities'] = ""
+                            print(f"[Server] Cleared {class_name}.js abilities")
+                        
+                        # Write back to file
+                        replace_file(class_file_path, '(' + json.dumps(class_data, ensure_ascii=False, indent=4) + ')')
+                        
+                        updated_files.append(class_file_path)
+                        
+                    except Exception as e:
+                        print(f"[Server] Error updating class file for {class_name or 'unknown'}: {e}")
+                        continue
+            caches.invalidate_paths([os.path.relpath(path) for path in [peoples_file] + updated_files],
+                                    reason='files-changed')
+            events.publish('peoples-saved', {'total_peoples': len(peoples_data['peoples']),
+                                             'updated_class_files': len(updated_files)})
             
             # Send success response
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            
             response_data = {
                 'success': True,
                 'message': 'Peoples and individual class files saved successfully',
@@ -747,25 +1440,64 @@ class WoodChunkHandler(http.server.SimpleHTTPRequestHandler):
                 'updated_files': updated_files
             }
             
-            self.wfile.write(json.dumps(response_data, ensure_ascii=False).encode('utf-8'))
+            send_json(self, response_data)
             
+        except BodyError as e:
+            self.send_error(e.status, e.message)
         except json.JSONDecodeError as e:
             print(f"[Server] JSON decode error: {e}")
             self.send_error(400, f"Invalid JSON data: {e}")
+        except LockTimeout as e:
+            self.send_error(503, str(e))
         except Exception as e:
             print(f"[Server] Error saving peoples: {e}")
             self.send_error(500, f"Error saving peoples: {e}")
 
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description='WoodChunk development server')
+    parser.add_argument('--host', default=HOST, help=f'Interface to bind (default: {HOST})')
+    parser.add_argument('--port', type=int, default=PORT, help=f'Port to listen on (default: {PORT})')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help='sync: one request at a time, threaded: thread per connection, '
+                             'asyncio: event loop with worker pool (default: %(default)s)')
+    return parser.parse_args(argv)
+
+def start_index_warmup():
+    """Build the indexes in background threads once the socket is bound"""
+    warmup.register('hashIndex', hash_index.refresh, load_snapshot=hash_index.load_snapshot)
+    warmup.register('tileStore', tile_store.refresh, after='hashIndex')
+    warmup.register('assetManifest', asset_manifest.refresh, after='hashIndex')
+    warmup.register('tileIndex', tile_index.all_images)
+    warmup.register('mapIndex', map_index.refresh, load_snapshot=map_index.load_snapshot)
+    warmup.register('mapHistory', map_history.baseline)
+    warmup.register('imageVariants', image_variants.manifest)
+    if data_store.available:
+        warmup.register('dataStore', data_store.sync)
+    warmup.start()
+
 def main():
     """Start the server"""
-    print(f"[Server] 🚀 Starting WoodChunk 1.5 server on {HOST}:{PORT}")
+    args = parse_args()
+    print(f"[Server] 🚀 Starting WoodChunk 1.5 server on {args.host}:{args.port}")
     print(f"[Server] 📁 Serving files from: {os.getcwd()}")
-    print(f"[Server] 🌐 Server will be available at: http://{HOST}:{PORT}")
+    if LOCK_METHOD is None:
+        print("[Server] Warning: no fcntl or msvcrt - file locks only serialize writers within this process")
+    print(f"[Server] 🌐 Server will be available at: http://{args.host}:{args.port}")
+    print(f"[Server] ⚙️  Backend: {args.backend}")
     print(f"[Server] ⏹️  Press Ctrl+C to stop the server")
     print()
     
     try:
-        with socketserver.TCPServer((HOST, PORT), WoodChunkHandler) as httpd:
+        if args.backend == 'asyncio':
+            import async_server
+            async_server.serve(WoodChunkHandler, args.host, args.port, on_bound=start_index_warmup)
+            return
+        
+        server_class = http.server.ThreadingHTTPServer if args.backend == 'threaded' else socketserver.TCPServer
+        with server_class((args.host, args.port), WoodChunkHandler) as httpd:
+            httpd.backend_name = args.backend
+            start_index_warmup()
             print(f"[Server] ✅ Server started successfully!")
             httpd.serve_forever()
     except KeyboardInterrupt:
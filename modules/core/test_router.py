@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Router tests
+Run with: python -m unittest test_router (from modules/core)
+"""
+
+import unittest
+
+from router import Router, is_relative_path
+
+
+class RouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = Router()
+        self.router.add('GET', '/api/maps/{map_id}/history/{revision:int}', 'handle_map_history')
+        self.router.add('POST', '/api/maps/history/gc', 'handle_map_history_gc')
+        self.router.add('GET', '/{file_path:path}', 'handle_static')
+
+    def test_parameters(self):
+        route, params = self.router.match('GET', '/api/maps/a%20b.json/history/3')
+        self.assertEqual(route.handler, 'handle_map_history')
+        self.assertEqual(params, {'map_id': 'a b.json', 'revision': 3})
+
+    def test_literal_before_parameter(self):
+        route, _ = self.router.match('POST', '/api/maps/history/gc')
+        self.assertEqual(route.handler, 'handle_map_history_gc')
+        route, params = self.router.match('GET', '/api/maps/history/history/1')
+        self.assertEqual(params['map_id'], 'history')
+
+    def test_static_path(self):
+        route, params = self.router.match('GET', '/modules/core/styles.css')
+        self.assertEqual(route.handler, 'handle_static')
+        self.assertEqual(params, {'file_path': 'modules/core/styles.css'})
+
+    def test_path_escapes_rejected(self):
+        for path in ('/../etc/passwd', '/modules/%2e%2e/%2e%2e/etc/passwd', '/%2Fetc/passwd',
+                     '//etc/passwd', '/..%5C..%5Cwindows%5Cwin.ini', '/C:%5Cwindows%5Cwin.ini',
+                     '/C:/windows/win.ini', '/index.html%00.png'):
+            self.assertEqual(self.router.match('GET', path), (None, []), path)
+
+    def test_is_relative_path(self):
+        self.assertTrue(is_relative_path('assets/maps/a..b.json'))
+        for path in ('/etc/passwd', 'a/../../b', 'a\\b', 'c:/x', 'a\0b'):
+            self.assertFalse(is_relative_path(path), path)
+
+
+if __name__ == '__main__':
+    unittest.main()
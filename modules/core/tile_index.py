@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Tile Index
+Index of the tile images of every biome folder (assets/biomes/<biome>/tiles)
+"""
+
+import os
+import threading
+
+BIOMES_PATH = 'assets/biomes'
+TILE_EXTENSIONS = ('.png',)
+
+
+def is_valid_biome_name(name):
+    """Biome names are single path components"""
+    return bool(name) and name not in ('.', '..') and '/' not in name and '\\' not in name
+
+
+class TileIndex:
+    """Per-biome tile image lists
+
+    Each biome entry remembers the mtime of its tiles directory, so files
+    added or removed behind the server's back are picked up on the next
+    lookup; writes made through the server invalidate entries explicitly.
+    """
+
+    def __init__(self, biomes_path=BIOMES_PATH):
+        self.biomes_path = biomes_path
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def tiles_dir(self, biome):
+        return os.path.join(self.biomes_path, biome, 'tiles')
+
+    def biomes(self):
+        """Names of all biome folders"""
+        if not os.path.isdir(self.biomes_path):
+            return []
+        return sorted(
+            name for name in os.listdir(self.biomes_path)
+            if os.path.isdir(os.path.join(self.biomes_path, name))
+        )
+
+    def images(self, biome):
+        """Relative paths of the tile images of one biome"""
+        if not is_valid_biome_name(biome):
+            return []
+        tiles_dir = self.tiles_dir(biome)
+        try:
+            signature = os.stat(tiles_dir).st_mtime_ns
+        except OSError:
+            with self._lock:
+                self._entries.pop(biome, None)
+            return []
+
+        with self._lock:
+            entry = self._entries.get(biome)
+            if entry is not None and entry[0] == signature:
+                return list(entry[1])
+
+        images = sorted(
+            f'{self.biomes_path}/{biome}/tiles/{name}'
+            for name in os.listdir(tiles_dir)
+            if name.lower().endswith(TILE_EXTENSIONS)
+        )
+        with self._lock:
+            self._entries[biome] = (signature, images)
+        return list(images)
+
+    def all_images(self):
+        """Tile image paths of every biome"""
+        return {biome: self.images(biome) for biome in self.biomes()}
+
+    def invalidate(self, biome=None):
+        """Forget one biome (or all of them)"""
+        with self._lock:
+            if biome is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(biome, None)
+
+    def invalidate_path(self, path):
+        """Forget the biome a changed file belongs to"""
+        parts = os.path.normpath(path).replace('\\', '/').split('/')
+        base = self.biomes_path.split('/')
+        if parts[:len(base)] == base and len(parts) > len(base):
+            self.invalidate(parts[len(base)])
+
+
+tile_index = TileIndex()
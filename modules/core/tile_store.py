@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Tile Store
+Content-addressed index of the tile images under assets/
+
+Every image is hashed (SHA-256) into a hash -> paths index. Identical
+images get one canonical, immutable URL (/blobs/<hash>.png), duplicates
+are reported, and dedupe() replaces duplicate files with hardlinks to one
+copy so they share disk space and asset cache entries.
+"""
+
+import os
+import threading
+
+from hash_index import hash_index, hash_file
+
+ASSETS_PATH = 'assets'
+TILE_EXTENSIONS = ('.png',)
+BLOB_URL_PREFIX = '/blobs/'
+
+
+def blob_url(digest, extension='.png'):
+    return f'{BLOB_URL_PREFIX}{digest}{extension}'
+
+
+class TileStore:
+    """Hash -> paths index over the image files below a root directory
+
+    Hashing is done by the shared hash index; the store keeps the image
+    subset and its reverse (hash -> paths) mapping per index generation.
+    """
+
+    def __init__(self, root=ASSETS_PATH, extensions=TILE_EXTENSIONS, index=hash_index):
+        self.root = root
+        self.extensions = extensions
+        self.index = index
+        self._lock = threading.Lock()
+        # path -> ((mtime, size, inode), hash)
+        self._files = {}
+        self._blobs = {}
+        self._generation = None
+
+    def refresh(self, force=False):
+        """Pick up changes from the hash index"""
+        if force:
+            self.index.refresh(force=True)
+        generation, indexed = self.index.snapshot()
+        with self._lock:
+            if generation == self._generation:
+                return
+        prefix = self.root.rstrip('/') + '/'
+        files = {
+            path: entry for path, entry in indexed.items()
+            if path.startswith(prefix) and path.lower().endswith(self.extensions)
+        }
+        blobs = {}
+        for path, (_, digest) in files.items():
+            blobs.setdefault(digest, []).append(path)
+
+        with self._lock:
+            self._files = files
+            self._blobs = blobs
+            self._generation = generation
+
+    def invalidate(self, paths=None):
+        """Mark the underlying index stale"""
+        self.index.invalidate(paths)
+
+    def hash_for(self, path):
+        """Content hash of one file, or None if it is not indexed"""
+        self.refresh()
+        path = os.path.normpath(path).replace('\\', '/')
+        with self._lock:
+            entry = self._files.get(path)
+        return entry[1] if entry else None
+
+    def blob_urls(self, paths):
+        """Canonical blob URL for each of the given paths"""
+        self.refresh()
+        with self._lock:
+            return {
+                path: blob_url(self._files[path][1], os.path.splitext(path)[1].lower())
+                for path in paths if path in self._files
+            }
+
+    def path_for(self, digest):
+        """An existing file with the given content hash, or None"""
+        self.refresh()
+        with self._lock:
+            paths = list(self._blobs.get(digest, ()))
+        for path in paths:
+            if os.path.exists(path):
+                return path
+        if paths:
+            # The index is behind the disk - rescan once and retry
+            self.refresh(force=True)
+            with self._lock:
+                paths = list(self._blobs.get(digest, ()))
+            return next((path for path in paths if os.path.exists(path)), None)
+        return None
+
+    def duplicates(self):
+        """Report of all hashes stored under more than one path"""
+        self.refresh()
+        with self._lock:
+            files = dict(self._files)
+            blob_count = len(self._blobs)
+            groups = [(digest, sorted(paths)) for digest, paths in self._blobs.items() if len(paths) > 1]
+
+        report = []
+        reclaimable = 0
+        for digest, paths in sorted(groups, key=lambda group: group[1][0]):
+            size = files[paths[0]][0][1]
+            inodes = {files[path][0][2] for path in paths}
+            # Paths already hardlinked together take no extra space
+            wasted = size * (len(inodes) - 1)
+            reclaimable += wasted
+            report.append({
+                'hash': digest,
+                'url': blob_url(digest, os.path.splitext(paths[0])[1].lower()),
+                'size': size,
+                'paths': paths,
+                'copies': len(inodes),
+                'reclaimableBytes': wasted
+            })
+        return {
+            'files': len(files),
+            'blobs': blob_count,
+            'duplicateGroups': len(report),
+            'reclaimableBytes': reclaimable,
+            'groups': report
+        }
+
+    def dedupe(self, dry_run=False):
+        """Replace duplicate files with hardlinks to the first path of each group
+
+        Returns the linked paths and the bytes saved. Files on different
+        devices (or filesystems without hardlinks) are skipped.
+        """
+        report = self.duplicates()
+        linked = []
+        skipped = []
+        saved = 0
+        for group in report['groups']:
+            canonical = group['paths'][0]
+            canonical_stat = os.stat(canonical)
+            for path in group['paths'][1:]:
+                stat = os.stat(path)
+                if (stat.st_dev, stat.st_ino) == (canonical_stat.st_dev, canonical_stat.st_ino):
+                    continue
+                if dry_run:
+                    linked.append(path)
+                    saved += group['size']
+                    continue
+                # Recheck the content right before replacing the file
+                if hash_file(path) != group['hash'] or hash_file(canonical) != group['hash']:
+                    skipped.append({'path': path, 'reason': 'changed'})
+                    continue
+                temp_path = f'{path}.link{os.getpid()}'
+                try:
+                    os.link(canonical, temp_path)
+                    os.replace(temp_path, path)
+                except OSError as e:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    skipped.append({'path': path, 'reason': str(e)})
+                    continue
+                linked.append(path)
+                saved += group['size']
+
+        if linked and not dry_run:
+            self.invalidate()
+        return {'linked': linked, 'skipped': skipped, 'savedBytes': saved, 'dryRun': dry_run}
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._files), 'blobs': len(self._blobs)}
+
+
+tile_store = TileStore()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+WoodChunk - Index Warm-up
+Builds the server's indexes in background threads after the socket is bound
+
+Each index registers a build function and optionally a snapshot loader.
+Snapshots persisted by a previous run are loaded first, so a restart only
+has to validate them against the files on disk. Requests that arrive
+before an index is ready simply build (or wait for) it on demand.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class IndexWarmup:
+    """Registry of indexes and their readiness"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._started = False
+
+    def register(self, name, build, load_snapshot=None, after=None):
+        """Register an index; `after` names an index that must be ready first"""
+        with self._lock:
+            self._indexes[name] = {
+                'build': build,
+                'load_snapshot': load_snapshot,
+                'after': after,
+                'state': 'pending',
+                'snapshot': False,
+                'buildMs': None,
+                'error': None,
+                'ready': threading.Event()
+            }
+
+    def start(self):
+        """Build every registered index, one background thread each"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            names = list(self._indexes)
+        for name in names:
+            threading.Thread(target=self._build, args=(name,), name=f'warmup-{name}', daemon=True).start()
+
+    def _build(self, name):
+        index = self._indexes[name]
+        if index['after'] in self._indexes:
+            self._indexes[index['after']]['ready'].wait()
+        started = time.perf_counter()
+        with self._lock:
+            index['state'] = 'building'
+        try:
+            if index['load_snapshot'] is not None:
+                index['snapshot'] = bool(index['load_snapshot']())
+            index['build']()
+            state, error = 'ready', None
+        except Exception as e:
+            print(f"[Server] Warm-up of {name} failed: {e}")
+            state, error = 'failed', str(e)
+        with self._lock:
+            index['state'] = state
+            index['error'] = error
+            index['buildMs'] = round((time.perf_counter() - started) * 1000, 1)
+        index['ready'].set()
+
+    def wait(self, timeout=None):
+        """Block until every index finished building; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for index in list(self._indexes.values()):
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not index['ready'].wait(remaining):
+                return False
+        return True
+
+    def status(self):
+        """Readiness and build time of every index for /api/status"""
+        with self._lock:
+            return {
+                name: {
+                    'state': index['state'],
+                    'fromSnapshot': index['snapshot'],
+                    'buildMs': index['buildMs'],
+                    **({'error': index['error']} if index['error'] else {})
+                }
+                for name, index in self._indexes.items()
+            }
+
+    def ready(self):
+        with self._lock:
+            return all(index['state'] in ('ready', 'failed') for index in self._indexes.values())
+
+
+warmup = IndexWarmup()
@@ -1385,7 +1385,7 @@ class MapsModule {
         
         mapsList.innerHTML = sortedMaps.map(map => `
             <div class="map-list-item" data-map-id="${map.id}">
-                <span class="map-item-icon">🗺️</span>
+                <span class="map-item-icon">${map.filename ? `<img src="/api/maps/${encodeURIComponent(map.filename)}/thumbnail.png" alt="" loading="lazy" style="width: 48px; height: 48px; object-fit: contain; border-radius: 3px; vertical-align: middle;" onerror="this.replaceWith('🗺️')">` : '🗺️'}</span>
                 <span class="map-item-name">${map.name}</span>
                 <span class="map-item-tiles">🔲 ${map.tilesCount}</span>
                 <span class="map-item-date">📅 ${new Date(map.timestamp).toLocaleDateString()}</span>
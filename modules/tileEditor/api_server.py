@@ -1,46 +1,89 @@
 #!/usr/bin/env python3
 """
 Simple API server for TileEditor file operations
+
+The routes live in TileEditorRoutes so the core server can mount them and
+share its caches; running this file starts the standalone server on 8081.
 """
 
 import os
+import sys
 import json
-import shutil
 from pathlib import Path
+from email.parser import BytesParser
+from email.policy import HTTP
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
-import cgi
 
-class TileEditorAPIHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        """Handle POST requests for file operations"""
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        if path == '/api/rename-tile-file':
-            self.handle_rename_tile_file()
-        elif path == '/api/upload-biome-image':
-            self.handle_upload_biome_image()
-        else:
-            self.send_error(404, "API endpoint not found")
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+CORE_DIR = BASE_DIR / 'modules' / 'core'
+if str(CORE_DIR) not in sys.path:
+    sys.path.insert(0, str(CORE_DIR))
+
+import caches
+from request_body import BodyError, read_body, read_json, MAX_UPLOAD_BODY
+from tile_moves import apply_moves, MoveError
+from tile_index import tile_index, is_valid_biome_name
+from image_variants import image_variants
+from tile_store import tile_store
+from file_locks import file_locks, replace_file, LockTimeout
+
+
+def parse_multipart(headers, body):
+    """Parse a multipart/form-data body into {name: (filename, bytes or str)}"""
+    content_type = headers.get('Content-Type', '')
+    message = BytesParser(policy=HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body
+    )
+    fields = {}
+    if not message.is_multipart():
+        return fields
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if not name:
+            continue
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True) or b''
+        if filename is None:
+            payload = payload.decode(part.get_content_charset() or 'utf-8')
+        fields[name] = (filename, payload)
+    return fields
+
+
+class TileEditorRoutes:
+    """TileEditor file operations, mountable into any request handler"""
     
-    def do_GET(self):
-        """Handle GET requests"""
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        if path == '/api/scan-biome-images':
-            self.handle_scan_biome_images()
-        else:
-            self.send_error(404, "API endpoint not found")
+    TILE_EDITOR_GET_ROUTES = {
+        '/api/scan-biome-images': 'handle_scan_biome_images',
+    }
+    TILE_EDITOR_POST_ROUTES = {
+        '/api/rename-tile-file': 'handle_rename_tile_file',
+        '/api/upload-biome-image': 'handle_upload_biome_image',
+        '/api/move-tile-files': 'handle_move_tile_files',
+    }
+    
+    def dispatch_tile_editor_route(self):
+        """Run the TileEditor route for this request; False if there is none"""
+        routes = self.TILE_EDITOR_POST_ROUTES if self.command == 'POST' else self.TILE_EDITOR_GET_ROUTES
+        handler_name = routes.get(urlparse(self.path).path)
+        if handler_name is None:
+            return False
+        getattr(self, handler_name)()
+        return True
+    
+    def send_tile_editor_json(self, response, status=200):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def handle_rename_tile_file(self):
         """Rename a tile file"""
         try:
             # Parse JSON request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            data = read_json(self)
             
             biome_name = data.get('biomeName')
             old_path = data.get('oldPath')
@@ -50,27 +93,17 @@ class TileEditorAPIHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "Missing required parameters")
                 return
             
-            # Convert relative paths to absolute paths
-            base_dir = Path(__file__).parent.parent.parent
-            old_abs_path = base_dir / old_path.lstrip('/')
-            new_abs_path = base_dir / new_path.lstrip('/')
-            
-            # Ensure the directory exists
-            new_abs_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # Check if old file exists
-            if not old_abs_path.exists():
-                self.send_error(404, f"Source file not found: {old_path}")
+            # Same transaction as the bulk move, so manifests stay in sync
+            try:
+                _, changed, documents = apply_moves([{'oldPath': old_path, 'newPath': new_path}], BASE_DIR)
+            except MoveError as e:
+                error = e.results[0].get('error', str(e))
+                self.send_error(404 if error.startswith('Source file not found') else 400, error)
                 return
-            
-            # Rename the file
-            shutil.move(str(old_abs_path), str(new_abs_path))
+            caches.invalidate_paths(changed + documents, reason='tiles-changed')
+            image_variants.enqueue(changed[1])
             
             # Send success response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
             response = {
                 'success': True,
                 'message': f'File renamed from {old_path} to {new_path}',
@@ -78,46 +111,97 @@ class TileEditorAPIHandler(BaseHTTPRequestHandler):
                 'newPath': new_path
             }
             
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-            
+            self.send_tile_editor_json(response)
+        
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except LockTimeout as e:
+            self.send_error(503, str(e))
         except Exception as e:
             print(f"Error renaming tile file: {e}")
             self.send_error(500, f"Internal server error: {str(e)}")
     
+    def handle_move_tile_files(self):
+        """Move/rename many tile files in one transaction"""
+        try:
+            data = read_json(self)
+            moves = data.get('moves')
+            
+            if not isinstance(moves, list) or not moves:
+                self.send_error(400, "Missing moves")
+                return
+            
+            dry_run = bool(data.get('dryRun'))
+            try:
+                results, changed, documents = apply_moves(moves, BASE_DIR, dry_run=dry_run)
+            except MoveError as e:
+                # Nothing was changed (or everything was rolled back)
+                self.send_tile_editor_json({
+                    'success': False,
+                    'message': str(e),
+                    'results': e.results
+                }, status=409)
+                return
+            
+            if changed:
+                caches.invalidate_paths(changed + documents, reason='tiles-changed')
+                for path in changed[1::2]:
+                    image_variants.enqueue(path)
+            
+            response = {
+                'success': True,
+                'message': f'{len(results)} files {"checked" if dry_run else "moved"}',
+                'dryRun': dry_run,
+                'results': results,
+                'updatedFiles': documents
+            }
+            
+            self.send_tile_editor_json(response)
+        
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except LockTimeout as e:
+            self.send_error(503, str(e))
+        except Exception as e:
+            print(f"Error moving tile files: {e}")
+            self.send_error(500, f"Internal server error: {str(e)}")
+    
     def handle_upload_biome_image(self):
         """Upload a biome image"""
         try:
             # Parse multipart form data
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD': 'POST'}
-            )
+            form = parse_multipart(self.headers, read_body(self, MAX_UPLOAD_BODY))
             
             # Get form data
-            image_file = form['image']
-            biome_name = form.getvalue('biomeName')
-            file_name = form.getvalue('fileName')
+            image_file = form.get('image', (None, None))[1]
+            biome_name = form.get('biomeName', (None, None))[1]
+            file_name = form.get('fileName', (None, None))[1]
             
             if not all([image_file, biome_name, file_name]):
                 self.send_error(400, "Missing required parameters")
                 return
             
+            if not is_valid_biome_name(biome_name) or os.path.basename(file_name) != file_name:
+                self.send_error(400, "Invalid biome or file name")
+                return
+            
             # Create target directory
-            base_dir = Path(__file__).parent.parent.parent
-            target_dir = base_dir / 'assets' / 'biomes' / biome_name / 'tiles'
+            target_dir = BASE_DIR / 'assets' / 'biomes' / biome_name / 'tiles'
             target_dir.mkdir(parents=True, exist_ok=True)
             
-            # Save the file
+            # Save the file; written to a temporary file and moved into place
+            # so a tile hardlinked by the dedupe never changes its twins. Bulk
+            # moves hold the same lock, so an upload never lands mid-move
             target_path = target_dir / file_name
-            with open(target_path, 'wb') as f:
-                f.write(image_file.file.read())
+            with file_locks.locked(BASE_DIR / 'assets' / 'biomes'):
+                replace_file(target_path, image_file)
+            relative_path = f'assets/biomes/{biome_name}/tiles/{file_name}'
+            caches.invalidate_paths([relative_path], reason='tiles-changed')
             
-            # Send success response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
+            # Optimized variants are built in the background
+            image_variants.enqueue(relative_path)
             
+            # Send success response
             response = {
                 'success': True,
                 'message': f'Image uploaded successfully: {file_name}',
@@ -125,8 +209,12 @@ class TileEditorAPIHandler(BaseHTTPRequestHandler):
                 'biomeName': biome_name
             }
             
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-            
+            self.send_tile_editor_json(response)
+        
+        except BodyError as e:
+            self.send_error(e.status, e.message)
+        except LockTimeout as e:
+            self.send_error(503, str(e))
         except Exception as e:
             print(f"Error uploading biome image: {e}")
             self.send_error(500, f"Internal server error: {str(e)}")
@@ -143,32 +231,34 @@ class TileEditorAPIHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "Missing biome parameter")
                 return
             
-            # Scan for images
-            base_dir = Path(__file__).parent.parent.parent
-            biome_dir = base_dir / 'assets' / 'biomes' / biome_name / 'tiles'
-            
-            image_paths = []
-            if biome_dir.exists():
-                for file_path in biome_dir.glob('*.png'):
-                    relative_path = f'assets/biomes/{biome_name}/tiles/{file_path.name}'
-                    image_paths.append(relative_path)
+            # Look up images in the shared tile index
+            image_paths = tile_index.images(biome_name)
             
             # Send response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
             response = {
                 'success': True,
                 'images': image_paths,
+                'blobs': tile_store.blob_urls(image_paths),
                 'biome': biome_name
             }
             
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-            
+            self.send_tile_editor_json(response)
+        
         except Exception as e:
             print(f"Error scanning biome images: {e}")
             self.send_error(500, f"Internal server error: {str(e)}")
+
+
+class TileEditorAPIHandler(TileEditorRoutes, BaseHTTPRequestHandler):
+    def do_POST(self):
+        """Handle POST requests for file operations"""
+        if not self.dispatch_tile_editor_route():
+            self.send_error(404, "API endpoint not found")
+    
+    def do_GET(self):
+        """Handle GET requests"""
+        if not self.dispatch_tile_editor_route():
+            self.send_error(404, "API endpoint not found")
     
     def log_message(self, format, *args):
         """Custom logging"""
@@ -176,12 +266,16 @@ class TileEditorAPIHandler(BaseHTTPRequestHandler):
 
 def run_server(port=8081):
     """Run the API server"""
+    # The shared tile index works with paths relative to the project root
+    os.chdir(BASE_DIR)
     server_address = ('', port)
     httpd = HTTPServer(server_address, TileEditorAPIHandler)
     print(f"TileEditor API server running on port {port}")
+    print(f"Note: the core server (modules/core/server.py) serves these routes too")
     print(f"Available endpoints:")
     print(f"  POST /api/rename-tile-file")
     print(f"  POST /api/upload-biome-image")
+    print(f"  POST /api/move-tile-files")
     print(f"  GET  /api/scan-biome-images?biome=<biome_name>")
     httpd.serve_forever()
 
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Transactional bulk move/rename of tile files
+
+All moves are validated before anything is touched. Files are then moved
+in two phases (sources to temporary names, temporary names to their
+targets) so swaps and chains work, and the per-biome tiles/manifest.json,
+tiles_config.json and tiles/tilesList.js are rewritten in the same pass.
+Any failure restores the files and documents already changed.
+
+Moves hold the lock of the biomes directory (see file_locks), so only one
+bulk operation runs at a time, also across server processes.
+"""
+
+import os
+import re
+import json
+from pathlib import Path
+
+from file_locks import file_locks, replace_file
+
+BIOMES_DIR = 'assets/biomes'
+
+
+class MoveError(Exception):
+    """A move that cannot be applied; carries the per-item results"""
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+def normalize_path(path):
+    """Project-relative path with forward slashes, or None if it leaves assets/"""
+    if not isinstance(path, str) or not path.strip():
+        return None
+    relative = os.path.normpath(path.replace('\\', '/').lstrip('/')).replace('\\', '/')
+    if relative.startswith('../') or relative == '..' or not relative.startswith('assets/'):
+        return None
+    return relative
+
+
+def biome_of(path):
+    """Biome name of a path inside assets/biomes/<biome>/tiles, else None"""
+    parts = path.split('/')
+    if len(parts) >= 5 and '/'.join(parts[:2]) == BIOMES_DIR and parts[3] == 'tiles':
+        return parts[2]
+    return None
+
+
+def validate_moves(moves, base_dir):
+    """Check every move; returns (normalized moves, per-item results, ok)"""
+    results = []
+    checked = []
+    sources = set()
+    targets = set()
+    for index, move in enumerate(moves):
+        result = {'index': index}
+        results.append(result)
+        if not isinstance(move, dict):
+            result.update(status='invalid', error='Expected {"oldPath", "newPath"}')
+            continue
+        result['oldPath'] = move.get('oldPath')
+        result['newPath'] = move.get('newPath')
+        old_path = normalize_path(move.get('oldPath'))
+        new_path = normalize_path(move.get('newPath'))
+        if old_path is None or new_path is None:
+            result.update(status='invalid', error='Paths must be inside assets/')
+        elif old_path == new_path:
+            result.update(status='invalid', error='Source and target are the same')
+        elif old_path in sources:
+            result.update(status='invalid', error='Source is moved twice')
+        elif new_path in targets:
+            result.update(status='invalid', error='Target is used twice')
+        elif not (base_dir / old_path).is_file():
+            result.update(status='invalid', error=f'Source file not found: {old_path}')
+        else:
+            result['status'] = 'ok'
+            sources.add(old_path)
+            targets.add(new_path)
+            checked.append((result, old_path, new_path))
+
+    # Targets may only exist if they are themselves moved away in this batch
+    for result, _, new_path in checked:
+        if new_path not in sources and (base_dir / new_path).exists():
+            result.update(status='invalid', error=f'Target already exists: {new_path}')
+
+    ok = all(result['status'] == 'ok' for result in results)
+    return [(old_path, new_path) for _, old_path, new_path in checked], results, ok
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _plan_documents(moves, base_dir):
+    """New contents of every biome document affected by the moves
+
+    Returns {Path: new text}.
+    """
+    biomes = set()
+    for old_path, new_path in moves:
+        biomes.update(name for name in (biome_of(old_path), biome_of(new_path)) if name)
+
+    manifests = {}
+    configs = {}
+    for biome in biomes:
+        manifest_path = base_dir / BIOMES_DIR / biome / 'tiles' / 'manifest.json'
+        if manifest_path.exists():
+            manifests[biome] = _read_json(manifest_path)
+        config_path = base_dir / BIOMES_DIR / biome / 'tiles_config.json'
+        if config_path.exists():
+            configs[biome] = _read_json(config_path)
+
+    # Every document is rewritten from its original state with all moves
+    # applied at once, so swaps and chains resolve correctly
+    mapping = dict(moves)
+    moved_images = {}
+    moved_entries = {}
+    for biome in biomes:
+        images = manifests.get(biome, {}).get('images')
+        if isinstance(images, list):
+            kept = []
+            for path in images:
+                new_path = mapping.get(path, path)
+                new_biome = biome_of(new_path)
+                if new_biome == biome:
+                    kept.append(new_path)
+                elif new_biome:
+                    moved_images.setdefault(new_biome, []).append(new_path)
+            manifests[biome]['images'] = kept
+
+        tiles = configs.get(biome, {}).get('tiles')
+        if isinstance(tiles, list):
+            kept = []
+            for entry in tiles:
+                if isinstance(entry, dict) and entry.get('path') in mapping:
+                    entry['path'] = mapping[entry['path']]
+                    entry['name'] = entry['path'].rsplit('/', 1)[-1]
+                    new_biome = biome_of(entry['path'])
+                    if new_biome and new_biome != biome:
+                        moved_entries.setdefault(new_biome, []).append(entry)
+                        continue
+                kept.append(entry)
+            configs[biome]['tiles'] = kept
+
+    # tiles/manifest.json: {"images": [paths]}; tiles_config.json entries
+    # carry their metadata to the new biome
+    for biome, images in moved_images.items():
+        manifest = manifests.setdefault(biome, {'images': []})
+        manifest.setdefault('images', []).extend(path for path in images if path not in manifest['images'])
+    for biome, entries in moved_entries.items():
+        config = configs.setdefault(biome, {'biomeName': biome, 'tiles': [], 'excludedFiles': []})
+        config.setdefault('tiles', []).extend(entries)
+
+    documents = {}
+    for biome, manifest in manifests.items():
+        documents[base_dir / BIOMES_DIR / biome / 'tiles' / 'manifest.json'] = json.dumps(manifest, indent=2) + '\n'
+    for biome, config in configs.items():
+        documents[base_dir / BIOMES_DIR / biome / 'tiles_config.json'] = \
+            json.dumps(config, indent=2, ensure_ascii=False) + '\n'
+
+    # tilesList.js: keep image references pointing at the moved files
+    references = re.compile('|'.join(re.escape(json.dumps(path)) for path in mapping))
+    for biome in biomes:
+        list_path = base_dir / BIOMES_DIR / biome / 'tiles' / 'tilesList.js'
+        if not list_path.exists():
+            continue
+        text = list_path.read_text(encoding='utf-8')
+        updated = references.sub(lambda match: json.dumps(mapping[json.loads(match.group(0))]), text)
+        if updated != text:
+            documents[list_path] = updated
+
+    # Only write what actually changed
+    return {
+        path: text for path, text in documents.items()
+        if not path.exists() or path.read_text(encoding='utf-8') != text
+    }
+
+
+def apply_moves(moves, base_dir, dry_run=False):
+    """Validate and apply moves as one transaction
+
+    Returns (results, changed paths, updated documents); raises MoveError
+    with the per-item results if validation or the transaction fails.
+    """
+    base_dir = Path(base_dir)
+    with file_locks.locked(base_dir / BIOMES_DIR):
+        normalized, results, ok = validate_moves(moves, base_dir)
+        if not ok or not normalized:
+            raise MoveError('Validation failed' if not ok else 'No moves given', results)
+
+        try:
+            documents = _plan_documents(normalized, base_dir)
+        except (OSError, ValueError) as e:
+            raise MoveError(f'Could not read tile manifests: {e}', results)
+        if dry_run:
+            return results, [], sorted(str(path.relative_to(base_dir)) for path in documents)
+
+        staged = []
+        moved = []
+        written = {}
+        current = None
+        try:
+            # Phase 1: every source to a temporary name next to it
+            for current, (old_path, _) in enumerate(normalized):
+                source = base_dir / old_path
+                temp = source.with_name(f'.{source.name}.move{os.getpid()}-{current}')
+                os.rename(source, temp)
+                staged.append((source, temp))
+            # Phase 2: temporary names to the targets
+            for current, ((source, temp), (_, new_path)) in enumerate(zip(staged, normalized)):
+                target = base_dir / new_path
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if target.exists():
+                    raise OSError(f'Target appeared during the move: {new_path}')
+                os.rename(temp, target)
+                moved.append((temp, target))
+            # Documents last; their previous contents are kept for the rollback
+            current = None
+            for path, text in documents.items():
+                written[path] = path.read_text(encoding='utf-8') if path.exists() else None
+                replace_file(path, text)
+        except Exception as e:
+            _rollback(staged, moved, written)
+            for index, result in enumerate(results):
+                result['status'] = 'rolled-back'
+                if index == current:
+                    result.update(status='failed', error=str(e))
+            raise MoveError(f'Move failed and was rolled back: {e}', results)
+
+        changed = [path for move in normalized for path in move]
+        return results, changed, sorted(str(path.relative_to(base_dir)) for path in documents)
+
+
+def _rollback(staged, moved, written):
+    for path, previous in written.items():
+        try:
+            if previous is None:
+                path.unlink()
+            else:
+                replace_file(path, previous)
+        except OSError as e:
+            print(f"Rollback: could not restore {path}: {e}")
+    for temp, target in reversed(moved):
+        try:
+            os.rename(target, temp)
+        except OSError as e:
+            print(f"Rollback: could not move {target} back: {e}")
+    for source, temp in reversed(staged):
+        try:
+            os.rename(temp, source)
+        except OSError as e:
+            print(f"Rollback: could not restore {source}: {e}")